@@ -1,5 +1,5 @@
 from src.grammar import Grammar
-from src.utils.tools import readFile
+from src.grammar_reader import GrammarSyntaxError, read_grammar_file
 import os
 
 
@@ -8,8 +8,11 @@ def main():
     if not os.path.isfile(file_path) or os.path.splitext(file_path)[1] != '.txt':
         print("Invalid file path or not a .txt file")
         return
-    lines = readFile(file_path)
-    grammar = Grammar(lines)
+    try:
+        grammar = Grammar(read_grammar_file(file_path))
+    except GrammarSyntaxError as error:
+        print(error)
+        return
     index = 0
     print('Original read grammar:')
     print(grammar)
@@ -0,0 +1,69 @@
+'''
+Compare the classic and linear CNF pipelines: conversion time, resulting
+grammar size, and agreement on random sentences (checked against the Earley
+parser on the original grammar).
+
+Usage:
+    python -m benchmarks.cnf_modes
+'''
+import random
+import time
+
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+
+SENTENCES = 300
+
+
+def optional_parts(k: int) -> list[str]:
+    '''
+    Grammar with one rule of k optional (nullable) parts, S -> A0 A1 ... x.
+    '''
+    parts = ' '.join(f'A{i}' for i in range(k))
+    lines = [f'S -> {parts} x']
+    lines += [f'A{i} -> a{i} | ϵ' for i in range(k)]
+    return lines
+
+
+def size(grammar: Grammar) -> int:
+    return sum(len(rules) for rules in grammar.productions.values())
+
+
+def compare(name: str, lines: list[str], check: bool = True) -> None:
+    grammars = {}
+    took = {}
+    for mode in ('classic', 'linear'):
+        grammar = Grammar(lines)
+        start_time = time.perf_counter()
+        grammar.CNF(mode)
+        took[mode] = time.perf_counter() - start_time
+        grammars[mode] = grammar
+
+    disagreements = '-'
+    if check:
+        terminals = sorted(grammars['linear'].terminals)
+        disagreements = 0
+        for _ in range(SENTENCES):
+            sentence = ' '.join(random.choice(terminals)
+                                for _ in range(random.randint(1, 8)))
+            expected = grammars['linear'].parse(
+                sentence, parser='earley').is_in
+            disagreements += grammars['linear'].parse(
+                sentence).is_in != expected
+    print(f'{name:<26} {size(grammars["classic"]):>8} {size(grammars["linear"]):>8} '
+          f'{took["classic"]:>9.4f} {took["linear"]:>9.4f} {disagreements:>9}')
+
+
+def main():
+    random.seed(0)
+    print(f'{"grammar":<26} {"classic":>8} {"linear":>8} '
+          f'{"classic s":>9} {"linear s":>9} {"mismatch":>9}')
+    for difficulty in ('easy', 'hard', 'normal', 'standard'):
+        path = f'docs/test_{difficulty}.txt'
+        compare(path, list(read_grammar_file(path)))
+    for k in (2, 4, 8, 12):
+        compare(f'{k} optional parts', optional_parts(k), check=k <= 8)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Compare the CYK chart engines on sentences of growing length.
+
+Usage:
+    python -m benchmarks.cyk_engines
+'''
+import random
+import time
+
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+
+LENGTHS = [10, 25, 50, 100, 150, 200]
+NAIVE_MAX_LENGTH = 50
+REPEAT = 3
+
+
+def expression(n: int) -> list[str]:
+    '''
+    Random sentence of about n tokens of the docs/test_standard.txt grammar.
+    '''
+    tokens = ['id']
+    while len(tokens) < n:
+        choice = random.random()
+        if choice < 0.4:
+            tokens = tokens + ['+', 'id']
+        elif choice < 0.8:
+            tokens = tokens + ['*', 'id']
+        else:
+            tokens = ['('] + tokens + [')']
+    return tokens
+
+
+def buffalo(n: int) -> list[str]:
+    '''
+    Sentence of n tokens of the (highly ambiguous) docs/test_hard.txt grammar.
+    '''
+    return ['buffalo'] * n
+
+
+def best_time(grammar: Grammar, tokens: list[str], engine: str) -> float:
+    times = []
+    for _ in range(REPEAT):
+        _, _, took = grammar.CYK(' '.join(tokens), web=True,
+                                 engine=engine, trees=False)
+        times.append(took)
+    return min(times)
+
+
+def main():
+    random.seed(0)
+    cases = [
+        ('docs/test_standard.txt', expression),
+        ('docs/test_hard.txt', buffalo),
+    ]
+    for path, sentence in cases:
+        grammar = Grammar(read_grammar_file(path))
+        grammar.CNF()
+        print(f'{path} (r = {len(grammar.productions)})')
+        print(f'{"n":>5} {"naive":>10} {"indexed":>10} {"numpy":>10}  winner')
+        for n in LENGTHS:
+            tokens = sentence(n)
+            times = {}
+            if len(tokens) <= NAIVE_MAX_LENGTH:
+                times['naive'] = best_time(grammar, tokens, 'naive')
+            times['indexed'] = best_time(grammar, tokens, 'indexed')
+            times['numpy'] = best_time(grammar, tokens, 'numpy')
+            row = ' '.join(f'{times[engine]:>10.4f}' if engine in times else f'{"-":>10}'
+                           for engine in ('naive', 'indexed', 'numpy'))
+            print(f'{len(tokens):>5} {row}  {min(times, key=times.get)}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+Speedup of the parallel CYK engine against the number of worker processes.
+
+Each sentence is parsed by the serial indexed engine, then by the parallel
+one with 1, 2, 4, ... workers up to the cores of the machine, best of
+REPEAT runs so the start of the pool is not timed. The speedup is over the
+indexed engine.
+
+Usage:
+    python -m benchmarks.cyk_parallel
+    python -m benchmarks.cyk_parallel --tokens 300 --workers 8
+'''
+import argparse
+import os
+import random
+import time
+
+from benchmarks.cyk_engines import buffalo, expression
+from src.cyk_parallel import ParallelCYK
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+from src.utils.constants import CYK_PARALLEL_MIN_SPAN_WORK
+
+REPEAT = 3
+
+
+def best_time(engine, tokens: list[str]) -> float:
+    times = []
+    for _ in range(REPEAT):
+        start_time = time.perf_counter()
+        engine.fill(tokens)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def worker_counts(cores: int) -> list[int]:
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Speedup of the parallel CYK engine against the number of workers.')
+    parser.add_argument('--tokens', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    random.seed(0)
+    cases = [
+        ('docs/test_standard.txt', expression),
+        ('docs/test_hard.txt', buffalo),
+    ]
+    print(f'{os.cpu_count()} cores')
+    for path, sentence in cases:
+        grammar = Grammar(read_grammar_file(path))
+        grammar.CNF()
+        index = grammar.cyk_index()
+        tokens = sentence(args.tokens)
+        serial = best_time(index, tokens)
+        print(f'{path}, {len(tokens)} tokens, indexed {serial:.3f}s')
+        print(f'{"workers":>8} {"seconds":>10} {"speedup":>8}')
+        for workers in worker_counts(args.workers):
+            engine = ParallelCYK(index, workers, CYK_PARALLEL_MIN_SPAN_WORK)
+            took = best_time(engine, tokens)
+            print(f'{workers:>8} {took:>10.3f} {serial / took:>8.2f}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
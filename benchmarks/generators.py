@@ -0,0 +1,218 @@
+'''
+Synthetic grammars and sentences for the benchmarks.
+
+The grammars use the docs/ format: non-terminals N0, N1, ... and terminals
+t0, t1, ...
+
+Usage:
+    python -m benchmarks.generators
+'''
+import random
+
+from src.analysis import EPSILON, body
+from src.grammar import Grammar
+
+
+def random_grammar(non_terminals: int = 20, rule_length: int = 3, rules_per_symbol: int = 3,
+                   nullable_density: float = 0.0, ambiguity: float = 0.0, terminals: int = 10,
+                   seed: int = 0) -> list[str]:
+    '''
+    Random grammar lines.
+
+    Every non-terminal gets a rule of terminals only, so all of them generate
+    some sentence, plus rules_per_symbol - 1 rules mixing terminals and
+    non-terminals.
+
+    Args:
+        non_terminals (int): Number of non-terminals.
+        rule_length (int): Maximum symbols per rule.
+        rules_per_symbol (int): Rules per non-terminal.
+        nullable_density (float): Fraction of the non-terminals with an ϵ rule.
+        ambiguity (float): Fraction of the non-terminals with an N -> N N rule,
+            which gives a Catalan number of parse trees.
+        terminals (int): Size of the terminal alphabet.
+        seed (int): Random seed.
+    '''
+    rng = random.Random(seed)
+    names = [f'N{i}' for i in range(non_terminals)]
+    alphabet = [f't{i}' for i in range(terminals)]
+
+    lines = []
+    for name in names:
+        rules = [' '.join(rng.choice(alphabet)
+                          for _ in range(rng.randint(1, rule_length)))]
+        for _ in range(rules_per_symbol - 1):
+            rules.append(' '.join(rng.choice(alphabet) if rng.random() < 0.5 else rng.choice(names)
+                                  for _ in range(rng.randint(1, rule_length))))
+        if rng.random() < nullable_density:
+            rules.append(EPSILON)
+        if rng.random() < ambiguity:
+            rules.append(f'{name} {name}')
+        lines.append(f'{name} -> {" | ".join(dict.fromkeys(rules))}')
+    return lines
+
+
+def lexical_grammar(rules: int = 1_000_000, tags: int = 500, phrases: int = 50, words: int = None,
+                    rule_length: int = 3, seed: int = 0) -> list[str]:
+    '''
+    Lines of a large vocabulary grammar: phrases P0, P1, ... over the part of
+    speech tags T0, T1, ..., and about rules lexical rules T -> word spread
+    over the tags.
+
+    Args:
+        rules (int): Lexical rules.
+        tags (int): Part of speech non-terminals.
+        phrases (int): Phrase non-terminals.
+        words (int): Vocabulary size, rules // 4 by default, so a word has
+            about 4 tags.
+        rule_length (int): Maximum symbols per phrase rule.
+        seed (int): Random seed.
+    '''
+    rng = random.Random(seed)
+    words = words or max(1, rules // 4)
+    tag_names = [f'T{i}' for i in range(tags)]
+    phrase_names = [f'P{i}' for i in range(phrases)]
+
+    bodies = {name: [] for name in phrase_names}
+    for i, name in enumerate(phrase_names):
+        # A rule of tags only, so every phrase generates some sentence.
+        bodies[name].append(' '.join(rng.choice(tag_names)
+                                     for _ in range(rng.randint(1, rule_length))))
+        for _ in range(2):
+            bodies[name].append(' '.join(rng.choice(tag_names if rng.random() < 0.5 else phrase_names)
+                                         for _ in range(rng.randint(1, rule_length))))
+        # Chained, so P0 reaches every phrase.
+        if i + 1 < phrases:
+            bodies[name].append(f'{rng.choice(tag_names)} {phrase_names[i + 1]}')
+    # And every tag is used by some phrase.
+    for i, tag in enumerate(tag_names):
+        bodies[phrase_names[i % phrases]].append(f'{tag} {rng.choice(phrase_names)}')
+    lines = [f'{name} -> {" | ".join(dict.fromkeys(rules))}'
+             for name, rules in bodies.items()]
+
+    per_tag = min(words, max(1, rules // tags))
+    for name in tag_names:
+        lexicon = ' | '.join(f'w{word}' for word in rng.sample(range(words), per_tag))
+        lines.append(f'{name} -> {lexicon}')
+    return lines
+
+
+def shortest_derivations(productions: dict) -> tuple[dict[str, int], dict[str, tuple[str]]]:
+    '''
+    Length of the shortest sentence each non-terminal derives, and the rule
+    starting that derivation.
+
+    A rule is only kept when it strictly improves the length, so following
+    the kept rules always ends.
+    '''
+    lengths: dict[str, int] = {}
+    shortest: dict[str, tuple[str]] = {}
+    changed = True
+    while changed:
+        changed = False
+        for non_terminal, rules in productions.items():
+            for rule in sorted(rules):
+                length = 0
+                for symbol in body(rule):
+                    if symbol in productions:
+                        if symbol not in lengths:
+                            break
+                        length += lengths[symbol]
+                    else:
+                        length += 1
+                else:
+                    if length < lengths.get(non_terminal, length + 1):
+                        lengths[non_terminal] = length
+                        shortest[non_terminal] = rule
+                        changed = True
+    return lengths, shortest
+
+
+def derive(grammar: Grammar, length: int, rng: random.Random) -> list[str]:
+    '''
+    Random sentence of about length tokens, derived on the original grammar.
+
+    Rules are picked at random while the sentence may still be shorter than
+    length, then the sentence is closed with the shortest derivations.
+    '''
+    productions = grammar.original_productions
+    lengths, shortest = shortest_derivations(productions)
+
+    def rule_length(rule: tuple[str]) -> int:
+        return sum(lengths[symbol] if symbol in productions else 1
+                   for symbol in body(rule))
+
+    tokens = []
+    # Pending symbols, right to left, and the shortest length they derive.
+    stack = [grammar.initial_symbol]
+    pending = lengths[grammar.initial_symbol]
+    while stack:
+        symbol = stack.pop()
+        if symbol not in productions:
+            tokens.append(symbol)
+            pending -= 1
+            continue
+        pending -= lengths[symbol]
+        # The stack bound stops ϵ rules from growing it forever.
+        if len(tokens) + pending < length and len(stack) < length:
+            rule = rng.choice([rule for rule in sorted(productions[symbol])
+                               if all(part in lengths or part not in productions for part in body(rule))])
+        else:
+            rule = shortest[symbol]
+        pending += rule_length(rule)
+        stack.extend(reversed(body(rule)))
+    return tokens
+
+
+def sentence_in(grammar: Grammar, length: int, rng: random.Random, tries: int = 50) -> list[str]:
+    '''
+    Sentence of the language of exactly length tokens if one is found in
+    tries derivations, the closest one otherwise.
+    '''
+    best = None
+    for _ in range(tries):
+        tokens = derive(grammar, length, rng)
+        if best is None or abs(len(tokens) - length) < abs(len(best) - length):
+            best = tokens
+        if len(tokens) == length:
+            break
+    return best
+
+
+def sentence_out(grammar: Grammar, length: int, rng: random.Random, tries: int = 50) -> list[str]:
+    '''
+    Sentence of length tokens out of the language, a sentence of the language
+    with one token changed. None if none is found in tries.
+
+    Checked with the Earley parser on the original grammar, so it works
+    before and after CNF().
+    '''
+    alphabet = sorted({symbol for rules in grammar.original_productions.values()
+                       for rule in rules for symbol in body(rule)
+                       if symbol not in grammar.original_productions})
+    if not alphabet:
+        return None
+    parser = grammar.earley_parser()
+    for _ in range(tries):
+        tokens = sentence_in(grammar, length, rng)
+        if tokens:
+            tokens[rng.randrange(len(tokens))] = rng.choice(alphabet)
+        else:
+            tokens = [rng.choice(alphabet)]
+        if not parser.parse(tokens).is_in:
+            return tokens
+    return None
+
+
+def main():
+    rng = random.Random(0)
+    lines = random_grammar(non_terminals=5, nullable_density=0.2, ambiguity=0.2)
+    print('\n'.join(lines))
+    grammar = Grammar(lines)
+    for length in (4, 8, 16):
+        print(f'in  {length:>3}:', ' '.join(sentence_in(grammar, length, rng)))
+        print(f'out {length:>3}:', ' '.join(sentence_out(grammar, length, rng) or ['-']))
+
+
+if __name__ == '__main__':
+    main()
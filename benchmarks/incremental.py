@@ -0,0 +1,68 @@
+'''
+Incremental classic CNF against a full one, on a sequence of small edits.
+
+A generated large vocabulary grammar is compiled once, then edited one line
+at a time (a word added to a tag, a word removed, a phrase rule changed, a
+nullable tag added) and each edited grammar is transformed with a full
+Grammar.CNF and with IncrementalCNF. Only the CNF is timed, the grammar is
+read before. Both must give the same grammar.
+
+Usage:
+    python -m benchmarks.incremental
+    python -m benchmarks.incremental --rules 200000
+'''
+import argparse
+import time
+
+from benchmarks.generators import lexical_grammar
+from src.cnf_incremental import IncrementalCNF
+from src.grammar import Grammar
+
+
+def edits(lines: list[str]):
+    '''
+    Yield (name, lines) after each edit, each one on the grammar edited before.
+    '''
+    lines = list(lines)
+    tags = [number for number, line in enumerate(lines) if line.startswith('T')]
+    phrases = [number for number, line in enumerate(lines) if line.startswith('P')]
+
+    lines[tags[0]] += ' | newword'
+    yield 'add a word', list(lines)
+    lines[tags[1]] = lines[tags[1]].rsplit(' | ', 1)[0]
+    yield 'remove a word', list(lines)
+    lines[phrases[-1]] += ' | T0 T1 T2 T3'
+    yield 'add a phrase rule', list(lines)
+    lines[tags[2]] += ' | ϵ'
+    yield 'nullable tag', list(lines)
+    lines[tags[2]] = lines[tags[2]].rsplit(' | ', 1)[0]
+    yield 'not nullable again', list(lines)
+
+
+def compile_time(lines: list[str], incremental: IncrementalCNF = None) -> tuple[Grammar, float]:
+    grammar = Grammar(lines)
+    start_time = time.perf_counter()
+    grammar.CNF(incremental=incremental)
+    return grammar, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Incremental classic CNF against a full one.')
+    parser.add_argument('--rules', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    lines = lexical_grammar(args.rules)
+    incremental = IncrementalCNF()
+    _, first = compile_time(lines, incremental)
+    print(f'{args.rules} rules, first compile {first:.3f} s')
+    print(f'{"edit":<20} {"full":>8} {"incremental":>12} {"speedup":>8}')
+    for name, this_lines in edits(lines):
+        full, full_took = compile_time(this_lines)
+        grammar, took = compile_time(this_lines, incremental)
+        assert grammar == full and str(grammar) == str(full)
+        print(f'{name:<20} {full_took:>8.3f} {took:>12.3f} {full_took / took:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
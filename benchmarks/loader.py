@@ -0,0 +1,90 @@
+'''
+Throughput of the streaming grammar reader.
+
+A generated grammar of about --rules lexical rules is written to a file,
+then read line by line (the disk speed), validated by read_grammar_file,
+and built into a Grammar from the reader, against the build from the whole
+file read at once. The peak is the memory traced during each step.
+
+Usage:
+    python -m benchmarks.loader
+    python -m benchmarks.loader --rules 5000000
+'''
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.generators import lexical_grammar
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+
+
+def read_lines(path: str) -> None:
+    with open(path, 'r', encoding='utf-8') as file:
+        for _ in file:
+            pass
+
+
+def validate(path: str) -> None:
+    for _ in read_grammar_file(path):
+        pass
+
+
+def build_streamed(path: str) -> None:
+    Grammar(read_grammar_file(path))
+
+
+def build_whole_file(path: str) -> None:
+    with open(path, 'r', encoding='utf-8') as file:
+        Grammar(file.read().splitlines())
+
+
+STEPS = (
+    ('read lines', read_lines),
+    ('validate', validate),
+    ('grammar (reader)', build_streamed),
+    ('grammar (whole file)', build_whole_file),
+)
+
+
+def measure(step, path: str) -> tuple[float, int]:
+    '''
+    Seconds of one run of the step, and its traced peak in a second run.
+    '''
+    gc.collect()
+    start_time = time.perf_counter()
+    step(path)
+    took = time.perf_counter() - start_time
+    gc.collect()
+    tracemalloc.start()
+    step(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return took, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Throughput of the streaming grammar reader.')
+    parser.add_argument('--rules', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'grammar.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            for line in lexical_grammar(args.rules):
+                file.write(line + '\n')
+        size = os.path.getsize(path) / 2 ** 20
+
+        print(f'{args.rules} rules, {size:.1f} MB')
+        print(f'{"step":<20} {"seconds":>8} {"MB/s":>8} {"peak MB":>8}')
+        for name, step in STEPS:
+            took, peak = measure(step, path)
+            print(f'{name:<20} {took:>8.3f} {size / took:>8.1f} {peak / 2 ** 20:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
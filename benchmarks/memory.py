@@ -0,0 +1,94 @@
+'''
+Memory and construction time of a large vocabulary grammar, by phase.
+
+A generated grammar of about --rules lexical rules is read, transformed to
+CNF and indexed for CYK. Each phase is timed on its own, then run again
+under tracemalloc for the bytes kept after it and its peak, reported per
+rule of the grammar read.
+
+Usage:
+    python -m benchmarks.memory
+    python -m benchmarks.memory --rules 100000 --cnf-mode linear
+'''
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.generators import lexical_grammar
+from src.grammar import CNF_MODES, Grammar
+
+PHASES = ('grammar', 'cnf', 'index')
+
+
+def build(lines: list[str], cnf_mode: str, measure) -> dict:
+    '''
+    Run the phases on the lines, calling measure(phase) after each one.
+    '''
+    grammar = Grammar(lines)
+    measure('grammar')
+    grammar.CNF(cnf_mode)
+    measure('cnf')
+    grammar.cyk_index()
+    measure('index')
+    return {
+        'rules': sum(len(rules) for rules in grammar.original_productions.values()),
+        'cnfRules': sum(len(rules) for rules in grammar.productions.values()),
+    }
+
+
+def timings(lines: list[str], cnf_mode: str) -> dict[str, float]:
+    took = {}
+    last = time.perf_counter()
+
+    def measure(phase: str) -> None:
+        nonlocal last
+        now = time.perf_counter()
+        took[phase] = now - last
+        last = now
+
+    build(lines, cnf_mode, measure)
+    return took
+
+
+def memory(lines: list[str], cnf_mode: str) -> tuple[dict, dict]:
+    '''
+    Bytes kept after each phase, and the peak during it, over the lines.
+    '''
+    kept = {}
+    peaks = {}
+
+    def measure(phase: str) -> None:
+        gc.collect()
+        kept[phase], peaks[phase] = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    gc.collect()
+    tracemalloc.start()
+    sizes = build(lines, cnf_mode, measure)
+    tracemalloc.stop()
+    return kept, peaks, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Memory and construction time of a large vocabulary grammar.')
+    parser.add_argument('--rules', type=int, default=1_000_000)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--cnf-mode', default='classic', choices=CNF_MODES)
+    args = parser.parse_args()
+
+    lines = lexical_grammar(args.rules, args.tags)
+    took = timings(lines, args.cnf_mode)
+    kept, peaks, sizes = memory(lines, args.cnf_mode)
+    rules = sizes['rules']
+
+    print(f'{rules} rules read, {sizes["cnfRules"]} CNF rules ({args.cnf_mode})')
+    print(f'{"phase":<10} {"seconds":>10} {"kept MB":>10} {"B/rule":>8} {"peak MB":>10}')
+    for phase in PHASES:
+        print(f'{phase:<10} {took[phase]:>10.3f} {kept[phase] / 2**20:>10.1f} '
+              f'{kept[phase] / rules:>8.0f} {peaks[phase] / 2**20:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
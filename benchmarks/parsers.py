@@ -0,0 +1,72 @@
+'''
+Compare the CYK (on the CNF grammar) and Earley (on the original grammar)
+engines on the grammars in docs/.
+
+Usage:
+    python -m benchmarks.parsers
+'''
+import glob
+import random
+import time
+
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+
+SENTENCES = 30
+MAX_DEPTH = 12
+
+
+def derive(grammar: Grammar, symbol: str, depth: int = 0) -> list[str]:
+    '''
+    Random sentence derived from symbol on the original grammar, preferring
+    the shortest rules once MAX_DEPTH is reached.
+    '''
+    if symbol not in grammar.original_productions:
+        return [] if symbol == 'ϵ' else [symbol]
+    rules = sorted(grammar.original_productions[symbol])
+    if depth >= MAX_DEPTH:
+        rules = [min(rules, key=lambda rule: sum(
+            part in grammar.original_productions for part in rule))]
+    tokens = []
+    for part in random.choice(rules):
+        tokens += derive(grammar, part, depth + 1)
+    return tokens
+
+
+def main():
+    random.seed(0)
+    print(f'{"grammar":<26} {"rules":>6} {"CNF rules":>9} {"CNF":>8} '
+          f'{"cyk":>8} {"earley":>8} {"tokens":>7}')
+    for path in sorted(glob.glob('docs/*.txt')):
+        grammar = Grammar(read_grammar_file(path))
+        rules = sum(len(rules)
+                    for rules in grammar.original_productions.values())
+
+        start_time = time.perf_counter()
+        grammar.CNF()
+        cnf_took = time.perf_counter() - start_time
+        cnf_rules = sum(len(rules) for rules in grammar.productions.values())
+
+        sentences = []
+        while len(sentences) < SENTENCES:
+            try:
+                tokens = derive(grammar, grammar.initial_symbol)
+            except RecursionError:
+                continue
+            if tokens:
+                sentences.append(' '.join(tokens))
+
+        took = {'cyk': 0, 'earley': 0}
+        for sentence in sentences:
+            for parser in took:
+                start_time = time.perf_counter()
+                forest = grammar.parse(sentence, parser=parser)
+                forest.count()
+                took[parser] += time.perf_counter() - start_time
+        tokens = sum(len(sentence.split(' ')) for sentence in sentences)
+        print(f'{path:<26} {rules:>6} {cnf_rules:>9} {cnf_took:>8.4f} '
+              f'{took["cyk"]:>8.4f} {took["earley"]:>8.4f} {tokens:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+The bitset recognizer against the indexed CYK engine, when only the
+membership of the sentence is needed.
+
+Each sentence is timed with the indexed engine (chart and back pointers)
+and with the recognizer, best of REPEAT runs. The rejected sentences have
+a token the grammar lacks inserted halfway, the recognizer stops on it.
+
+Usage:
+    python -m benchmarks.recognize
+'''
+import random
+import time
+
+from benchmarks.cyk_engines import buffalo, expression
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+
+LENGTHS = [25, 50, 100, 200, 400]
+INDEXED_MAX_LENGTH = 250
+REPEAT = 3
+
+
+def best_time(run, string: str) -> tuple[bool, float]:
+    times = []
+    for _ in range(REPEAT):
+        start_time = time.perf_counter()
+        is_in = run(string)
+        times.append(time.perf_counter() - start_time)
+    return is_in, min(times)
+
+
+def main():
+    random.seed(0)
+    cases = [
+        ('docs/test_standard.txt', expression),
+        ('docs/test_hard.txt', buffalo),
+    ]
+    for path, sentence in cases:
+        grammar = Grammar(read_grammar_file(path))
+        grammar.CNF()
+        print(f'{path} (r = {len(grammar.productions)})')
+        print(f'{"n":>5} {"isIn":>6} {"indexed":>10} {"recognize":>10} {"speedup":>8}')
+        for n in LENGTHS:
+            tokens = sentence(n)
+            strings = [' '.join(tokens), ' '.join(tokens[:n // 2] + ['?'] + tokens[n // 2:])]
+            for string in strings:
+                is_in, recognized = best_time(
+                    lambda string: grammar.recognize(string)[0], string)
+                if len(tokens) <= INDEXED_MAX_LENGTH:
+                    _, indexed = best_time(
+                        lambda string: grammar.parse(string).is_in, string)
+                    print(f'{len(tokens):>5} {str(is_in):>6} {indexed:>10.4f} '
+                          f'{recognized:>10.4f} {indexed / recognized:>8.1f}')
+                else:
+                    print(f'{len(tokens):>5} {str(is_in):>6} {"-":>10} {recognized:>10.4f} {"-":>8}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+'''
+Time every phase of a CYK request, on the docs/ grammars and on generated
+ones, and compare the results with a saved baseline.
+
+The phases are grammar (reading the lines), cnf.<pass> (each CNF pass),
+chart (the chart fill), trees (counting and extracting the parse trees) and
+render (drawing them with dot, skipped when dot is not installed). Each
+phase keeps the best of --repeat runs, summed over the sentences of a case.
+
+Usage:
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --threshold 0.25
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import time
+
+from benchmarks.generators import random_grammar, sentence_in, sentence_out
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar_file
+from src.render import render, tree_sources
+
+FORMAT_VERSION = 1
+
+# Phases faster than this are not compared, their noise is too high.
+NOISE_FLOOR = 0.001
+
+SENTENCE_LENGTHS = [8, 16, 32]
+MAX_TREES = 10
+
+GENERATED = {
+    'small': dict(non_terminals=10, rule_length=3, rules_per_symbol=3),
+    'wide': dict(non_terminals=100, rule_length=4, rules_per_symbol=6, terminals=30),
+    'long rules': dict(non_terminals=20, rule_length=8, rules_per_symbol=3),
+    'nullable': dict(non_terminals=20, rule_length=4, rules_per_symbol=3, nullable_density=0.5),
+    'ambiguous': dict(non_terminals=10, rule_length=3, rules_per_symbol=3, ambiguity=0.5),
+}
+
+
+def cases(quick: bool) -> dict[str, list[str]]:
+    '''
+    The grammar lines of each benchmark case.
+    '''
+    grammars = {path: list(read_grammar_file(path)) for path in sorted(glob.glob('docs/*.txt'))}
+    for name, parameters in GENERATED.items():
+        if quick and name == 'wide':
+            continue
+        grammars[f'generated {name}'] = random_grammar(**parameters)
+    return grammars
+
+
+def sentences(lines: list[str], lengths: list[int], seed: int = 0) -> list[tuple[str, bool]]:
+    '''
+    A sentence in the language and one out of it (when found) per length.
+    '''
+    rng = random.Random(seed)
+    grammar = Grammar(lines)
+    chosen = []
+    for length in lengths:
+        tokens = sentence_in(grammar, length, rng)
+        if tokens:
+            chosen.append((' '.join(tokens), True))
+        tokens = sentence_out(grammar, length, rng)
+        if tokens:
+            chosen.append((' '.join(tokens), False))
+    return chosen
+
+
+def run_case(lines: list[str], cases_sentences: list[tuple[str, bool]], cnf_mode: str, engine: str, draw: bool) -> dict:
+    '''
+    Time the phases of one case once.
+    '''
+    phases = {}
+
+    start_time = time.perf_counter()
+    grammar = Grammar(lines)
+    phases['grammar'] = time.perf_counter() - start_time
+
+    timings = {}
+    grammar.CNF(cnf_mode, timings)
+    for name, took in timings.items():
+        phases[f'cnf.{name}'] = took
+
+    phases['chart'] = phases['trees'] = 0
+    if draw:
+        phases['render'] = 0
+    parse_trees = 0
+    for sentence, expected in cases_sentences:
+        start_time = time.perf_counter()
+        forest = grammar.parse(sentence, engine)
+        phases['chart'] += time.perf_counter() - start_time
+        if forest.is_in != expected:
+            raise AssertionError(
+                f'{sentence!r} should {"" if expected else "not "}be in the language')
+        if not forest.is_in:
+            continue
+
+        start_time = time.perf_counter()
+        parse_trees += forest.count()
+        trees = list(forest.trees(MAX_TREES))
+        phases['trees'] += time.perf_counter() - start_time
+
+        if draw:
+            start_time = time.perf_counter()
+            render(tree_sources(trees), 'svg')
+            phases['render'] += time.perf_counter() - start_time
+
+    sizes = {
+        'rules': sum(len(rules) for rules in grammar.original_productions.values()),
+        'cnfRules': sum(len(rules) for rules in grammar.productions.values()),
+        'cnfNonTerminals': len(grammar.productions),
+        'sentences': len(cases_sentences),
+        'parseTrees': parse_trees,
+    }
+    return {'phases': phases, 'sizes': sizes}
+
+
+def run(quick: bool, repeat: int, cnf_mode: str, engine: str, draw: bool) -> dict:
+    results = {}
+    lengths = SENTENCE_LENGTHS[:2] if quick else SENTENCE_LENGTHS
+    for name, lines in cases(quick).items():
+        case_sentences = sentences(lines, lengths)
+        best = None
+        for _ in range(repeat):
+            result = run_case(lines, case_sentences, cnf_mode, engine, draw)
+            if best is None:
+                best = result
+            else:
+                for phase, took in result['phases'].items():
+                    best['phases'][phase] = min(best['phases'][phase], took)
+        results[name] = best
+    return {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'settings': {
+            'quick': quick,
+            'sentenceLengths': lengths,
+            'cnfMode': cnf_mode,
+            'engine': engine,
+            'render': draw,
+        },
+        'cases': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    '''
+    Phases slower than the baseline by more than threshold (0.25 is 25%).
+    '''
+    regressions = []
+    for name, case in results['cases'].items():
+        base_case = baseline['cases'].get(name)
+        if base_case is None:
+            continue
+        for phase, took in case['phases'].items():
+            base = base_case['phases'].get(phase)
+            if base is None or max(base, took) < NOISE_FLOOR:
+                continue
+            if took > base * (1 + threshold):
+                regressions.append(
+                    f'{name} {phase}: {base:.4f}s -> {took:.4f}s ({took / base - 1:+.0%})')
+    return regressions
+
+
+def report(results: dict) -> None:
+    print(f'{"case":<28} {"phase":<28} {"seconds":>10}')
+    for name, case in results['cases'].items():
+        for phase, took in case['phases'].items():
+            print(f'{name:<28} {phase:<28} {took:>10.5f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-phase benchmark suite.')
+    parser.add_argument('--output', help='Write the results as JSON here.')
+    parser.add_argument('--baseline', help='Compare with these saved results.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown over the baseline (default: 0.25).')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cnf-mode', default='classic')
+    parser.add_argument('--engine', default='indexed')
+    parser.add_argument('--quick', action='store_true',
+                        help='Fewer cases and shorter sentences.')
+    args = parser.parse_args()
+
+    draw = shutil.which('dot') is not None
+    if not draw:
+        print('dot not found, the render phase is skipped', file=sys.stderr)
+
+    results = run(args.quick, args.repeat, args.cnf_mode, args.engine, draw)
+    report(results)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('version') != FORMAT_VERSION:
+            sys.exit(f'{args.baseline} has another results format version')
+        if baseline['settings'] != results['settings']:
+            sys.exit(f'{args.baseline} was run with other settings: {baseline["settings"]}')
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions over {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
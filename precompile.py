@@ -0,0 +1,34 @@
+from glob import glob
+from src.grammar import CNF_MODES
+from src.grammar_reader import GrammarSyntaxError, read_grammar_file
+from src.registry import GrammarRegistry
+from src.utils.constants import REGISTRY_FOLDER
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile the grammar files of a folder into the grammars registry.')
+    parser.add_argument('folder', help='Folder with the grammar files.')
+    parser.add_argument('--pattern', default='*.txt',
+                        help='Grammar files pattern (default: *.txt).')
+    parser.add_argument('--registry', default=REGISTRY_FOLDER,
+                        help=f'Registry folder (default: {REGISTRY_FOLDER}).')
+    parser.add_argument('--cnf-mode', default='classic', choices=CNF_MODES)
+    args = parser.parse_args()
+
+    registry = GrammarRegistry(args.registry)
+    for file_path in sorted(glob(os.path.join(args.folder, args.pattern))):
+        try:
+            registered = registry.register(
+                list(read_grammar_file(file_path)), cnf_mode=args.cnf_mode)
+        except GrammarSyntaxError as error:
+            print(f'{file_path}: {error}')
+            continue
+        print(f'{file_path} -> {registered.key} '
+              f'({len(registered.index.symbols)} symbols, {len(registered.index.binary)} binary rules)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,340 @@
-
-from flask import Flask, jsonify, request
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from itertools import chain
 from wrapper import *
+from src.tree_format import dumps_json
+from src.utils.constants import (DEFAULT_MAX_TREES, SERVER_MAX_TASKS_PER_WORKER, SERVER_QUEUE_DEPTH,
+                                 SERVER_RETRY_AFTER, SERVER_SPARE_THREADS, SERVER_THREAD_SLOTS,
+                                 SERVER_WORKERS, TREE_MAX_AGE)
+import argparse
+import json
 import re
 
 HEIGHT_REGEX = re.compile(r'height="(\d+\.?\d*)(\w*)"', re.IGNORECASE)
 WIDTH_REGEX = re.compile(r'width="(\d+\.?\d*)(\w*)"', re.IGNORECASE)
 
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+class TreesJSONProvider(DefaultJSONProvider):
+    '''
+    The Flask JSON provider, writing the responses too deep for the json
+    encoder (the json trees of long sentences) with dumps_json.
+    '''
+
+    def dumps(self, obj, **kwargs) -> str:
+        try:
+            return super().dumps(obj, **kwargs)
+        except RecursionError:
+            return dumps_json(obj, kwargs.get('sort_keys', self.sort_keys),
+                              kwargs.get('ensure_ascii', self.ensure_ascii))
+
+
 app = Flask(__name__)
+app.json = TreesJSONProvider(app)
 CORS(app)
 
 
+def format_events(events, stream: str):
+    '''
+    Serialize the streaming wrapper events as NDJSON lines or SSE events.
+    '''
+    for event in events:
+        try:
+            data = json.dumps(event)
+        except RecursionError:
+            data = dumps_json(event)
+        if stream == 'sse':
+            yield f'event: {event["type"]}\ndata: {data}\n\n'
+        else:
+            yield f'{data}\n'
+
+
+def busy():
+    '''
+    The 503 answer of a request not admitted, or whose worker died.
+    '''
+    return jsonify({'error': 'Server busy, retry later'}), 503, {'Retry-After': str(SERVER_RETRY_AFTER)}
+
+
+def admitted(events):
+    '''
+    Hold a thread slot while the stream events are computed, from the first
+    one until the stream ends or the client leaves.
+    '''
+    with thread_slot():
+        yield from events
+
+
+def trees_url() -> str:
+    '''
+    The absolute URL of GET /trees/<hash> for this request, the images may
+    be shown by a page of another origin.
+    '''
+    return f'{request.host_url}trees/'
+
+
+def count_bytes(chunks, endpoint: str):
+    '''
+    Pass the streamed chunks through, recording the response size at the end.
+    '''
+    size = 0
+    for chunk in chunks:
+        size += len(chunk.encode('utf-8'))
+        yield chunk
+    RESPONSE_BYTES.observe(size, endpoint=endpoint)
+
+
 @app.route("/cyk", methods=['POST'])
 def work_simulation():
     data = request.json
-    lines = data['grammar']
+    lines = data.get('grammar')
     sentence = data['sentence']
-    prefix = data['prefix']
-    initial_symbol = data['initialSymbol']
+    prefix = data.get('prefix')
+    initial_symbol = data.get('initialSymbol')
+    engine = data.get('cykEngine', 'indexed')
+    max_trees = data.get('maxTrees', DEFAULT_MAX_TREES)
+    parser = data.get('engine', 'cyk')
+    cnf_mode = data.get('cnfMode', 'classic')
+    grammar_id = data.get('grammarId')
+    phases = data.get('phases', False)
+    budget = data.get('budget')
+    images = data.get('images', 'inline')
+    output = data.get('output', 'images')
+    recognize_only = data.get('recognizeOnly', False)
+    stream = data.get('stream')
+
+    # Without trees there is nothing to stream after the verdict.
+    if stream and not recognize_only:
+        if stream not in STREAM_MIMETYPES:
+            return jsonify({'error': f'Unknown stream format {stream!r}'}), 400
+        events = admitted(wrapper_cyk_stream(lines, sentence, HEIGHT_REGEX, WIDTH_REGEX,
+                                             prefix, initial_symbol, engine, max_trees, parser, cnf_mode, grammar_id, phases, budget, images, trees_url(), output))
+        try:
+            # The first event holds the verdict, errors are still reported as 400.
+            first = next(events)
+        except QueueFull:
+            return busy()
+        except UnknownGrammar:
+            return jsonify({'error': 'Unknown grammar'}), 404
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+        return Response(stream_with_context(count_bytes(format_events(chain([first], events), stream), 'cyk_stream')),
+                        mimetype=STREAM_MIMETYPES[stream])
+
+    try:
+        response = wrapper_cyk(lines, sentence, HEIGHT_REGEX,
+                               WIDTH_REGEX, prefix, initial_symbol, True, engine, max_trees, parser, cnf_mode, grammar_id, phases, budget, images, trees_url(), output, recognize_only)
+    except (QueueFull, BrokenProcessPool):
+        return busy()
+    except UnknownGrammar:
+        return jsonify({'error': 'Unknown grammar'}), 404
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    response = jsonify(response)
+    RESPONSE_BYTES.observe(response.content_length, endpoint='cyk')
+    return response, 200
+
+
+@app.route("/cyk/batch", methods=['POST'])
+def batch_simulation():
+    data = request.json
+    lines = data.get('grammar')
+    sentences = data['sentences']
+    prefix = data.get('prefix')
+    initial_symbol = data.get('initialSymbol')
+    trees = data.get('trees', False)
+    engine = data.get('cykEngine', 'indexed')
+    max_trees = data.get('maxTrees', DEFAULT_MAX_TREES)
+    parser = data.get('engine', 'cyk')
+    cnf_mode = data.get('cnfMode', 'classic')
+    grammar_id = data.get('grammarId')
+    budget = data.get('budget')
+    images = data.get('images', 'inline')
+    output = data.get('output', 'images')
+
+    try:
+        with thread_slot():
+            response = wrapper_cyk_batch(lines, sentences, HEIGHT_REGEX,
+                                         WIDTH_REGEX, prefix, initial_symbol, trees, engine, max_trees, parser, cnf_mode, grammar_id, budget, images, trees_url(), output)
+    except (QueueFull, BrokenProcessPool):
+        return busy()
+    except UnknownGrammar:
+        return jsonify({'error': 'Unknown grammar'}), 404
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    response = jsonify(response)
+    RESPONSE_BYTES.observe(response.content_length, endpoint='cyk_batch')
+    return response, 200
+
+
+@app.route("/sessions", methods=['POST'])
+def create_session():
+    data = request.json
+    try:
+        with thread_slot():
+            response = wrapper_session_create(
+                data.get('grammar'), data.get('prefix'), data.get('initialSymbol'), data.get('cnfMode', 'classic'), data.get('grammarId'))
+    except QueueFull:
+        return busy()
+    except UnknownGrammar:
+        return jsonify({'error': 'Unknown grammar'}), 404
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    return jsonify(response), 201
+
+
+@app.route("/sessions/<session_id>", methods=['GET'])
+def get_session(session_id):
+    try:
+        return jsonify(SESSIONS.get(session_id).state()), 200
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired session'}), 404
 
-    response = wrapper_cyk(lines, sentence, HEIGHT_REGEX,
-                           WIDTH_REGEX, prefix, initial_symbol, True)
 
-    return jsonify(response), 200
+@app.route("/sessions/<session_id>", methods=['DELETE'])
+def delete_session(session_id):
+    try:
+        SESSIONS.delete(session_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    return '', 204
+
+
+@app.route("/sessions/<session_id>/tokens", methods=['POST'])
+def append_tokens(session_id):
+    data = request.json
+    tokens = data['tokens'] if 'tokens' in data else [data['token']]
+    try:
+        with thread_slot():
+            session = SESSIONS.append(session_id, tokens)
+        return jsonify(session.state()), 200
+    except QueueFull:
+        return busy()
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+
+@app.route("/sessions/<session_id>/tokens", methods=['DELETE'])
+def pop_tokens(session_id):
+    count = request.args.get('count', 1, type=int)
+    try:
+        with thread_slot():
+            session = SESSIONS.pop(session_id, count)
+        return jsonify(session.state()), 200
+    except QueueFull:
+        return busy()
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+
+@app.route("/grammars", methods=['POST'])
+def register_grammar():
+    data = request.json
+    try:
+        with thread_slot():
+            response = wrapper_register(
+                data['grammar'], data.get('prefix'), data.get('initialSymbol'), data.get('cnfMode', 'classic'))
+    except QueueFull:
+        return busy()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    return jsonify(response), 201
+
+
+@app.route("/grammars", methods=['GET'])
+def list_grammars():
+    return jsonify({'grammarIds': REGISTRY.keys()}), 200
+
+
+@app.route("/grammars/<grammar_id>", methods=['GET'])
+def get_grammar(grammar_id):
+    try:
+        return jsonify(REGISTRY.get(grammar_id).describe()), 200
+    except UnknownGrammar:
+        return jsonify({'error': 'Unknown grammar'}), 404
+
+
+@app.route("/trees/<tree_hash>", methods=['GET'])
+def get_tree(tree_hash):
+    image = TREE_STORE.get(tree_hash)
+    if image is None:
+        return jsonify({'error': 'Unknown tree'}), 404
+    # The hash is the content, so the image never changes.
+    response = Response(image, mimetype='image/svg+xml')
+    response.set_etag(tree_hash)
+    response.cache_control.public = True
+    response.cache_control.max_age = TREE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@app.route("/trees", methods=['GET'])
+def tree_store_stats():
+    return jsonify(TREE_STORE.stats()), 200
+
+
+@app.route("/cache", methods=['GET'])
+def cache_stats():
+    return jsonify(GRAMMAR_CACHE.stats()), 200
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4'), 200
+
+
+@app.route("/pool", methods=['GET'])
+def pool_stats():
+    stats = wrapper_pool_stats()
+    if stats is None:
+        return jsonify({'error': 'No serving pool, run python server.py'}), 404
+    return jsonify(stats), 200
 
 
 @app.route("/healthz", methods=['GET'])
 def salute():
     return 'Hello from iGrammar server!', 200
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the grammar server with a pool of /cyk workers.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help=f'/cyk worker processes (default: {SERVER_WORKERS}).')
+    parser.add_argument('--queue-depth', type=int, default=SERVER_QUEUE_DEPTH,
+                        help=f'/cyk requests waiting for a worker before 503 (default: {SERVER_QUEUE_DEPTH}).')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=SERVER_MAX_TASKS_PER_WORKER,
+                        help=f'Requests a worker serves before it is replaced, 0 never (default: {SERVER_MAX_TASKS_PER_WORKER}).')
+    parser.add_argument('--thread-slots', type=int, default=SERVER_THREAD_SLOTS,
+                        help=f'Streams, batches, session and registration requests computed at once before 503 (default: {SERVER_THREAD_SLOTS}).')
+    args = parser.parse_args()
+
+    from waitress import serve
+
+    pool = start_serving_pool(
+        args.workers, args.queue_depth, args.max_tasks_per_worker, args.thread_slots)
+    try:
+        # Every admitted request holds a thread while it waits or computes,
+        # the spare ones keep /healthz and the 503 answers fast.
+        serve(app, host=args.host, port=args.port,
+              threads=args.workers + args.queue_depth + args.thread_slots + SERVER_SPARE_THREADS)
+    finally:
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Grammar analyses shared by the CNF passes and the parsers.
+
+Every analysis is a worklist fixpoint over an index from each symbol to the
+rules using it, so each one is linear in the size of the grammar and none of
+them recurses. Productions are dicts from a non-terminal to its set of rules,
+each rule a tuple of symbols; ('ϵ',) is the empty rule.
+'''
+from __future__ import annotations
+from collections import defaultdict, deque
+from heapq import heappop, heappush
+
+EPSILON = 'ϵ'
+
+
+def body(rule: tuple[str]) -> tuple[str]:
+    '''
+    The symbols of a rule, with ϵ removed.
+    '''
+    if EPSILON not in rule:
+        return rule
+    return tuple(symbol for symbol in rule if symbol != EPSILON)
+
+
+def uses_index(productions: dict) -> dict[str, list[tuple[str, tuple[str]]]]:
+    '''
+    Index each symbol to the (non_terminal, rule) pairs whose rule uses it.
+
+    A rule using the same symbol many times is listed once per use.
+    '''
+    index = defaultdict(list)
+    for non_terminal, rules in productions.items():
+        for rule in rules:
+            for symbol in body(rule):
+                index[symbol].append((non_terminal, rule))
+    return index
+
+
+def _counting_fixpoint(productions: dict, counted, uses: dict = None) -> set[str]:
+    '''
+    Heads reached by rules whose counted symbols are all already reached.
+
+    counted(symbol) tells whether a symbol has to be reached before the rule
+    fires. Each rule keeps a counter of its pending uses, decremented through
+    the uses index, so every rule is visited once per symbol in it.
+    '''
+    if uses is None:
+        uses = uses_index(productions)
+
+    remaining: dict[tuple[str, tuple[str]], int] = {}
+    for non_terminal, rules in productions.items():
+        for rule in rules:
+            remaining[(non_terminal, rule)] = 0
+    for symbol, users in uses.items():
+        if counted(symbol):
+            for user in users:
+                remaining[user] += 1
+
+    worklist = deque(user[0] for user, count in remaining.items() if not count)
+    reached = set()
+    while worklist:
+        non_terminal = worklist.popleft()
+        if non_terminal in reached:
+            continue
+        reached.add(non_terminal)
+        for user in uses.get(non_terminal, ()):
+            remaining[user] -= 1
+            if remaining[user] == 0:
+                worklist.append(user[0])
+    return reached
+
+
+def nullable_symbols(productions: dict, uses: dict = None) -> set[str]:
+    '''
+    Non-terminals deriving the empty string.
+    '''
+    # Every symbol is counted. Terminals are never reached, so a rule using
+    # one never fires.
+    return _counting_fixpoint(productions, lambda symbol: True, uses)
+
+
+def generating_symbols(productions: dict, non_terminals: set[str], uses: dict = None) -> set[str]:
+    '''
+    Non-terminals deriving at least one string of terminals.
+    '''
+    return _counting_fixpoint(productions, lambda symbol: symbol in non_terminals, uses)
+
+
+def reachable_symbols(productions: dict, initial_symbol: str) -> set[str]:
+    '''
+    Symbols reachable from the initial symbol.
+    '''
+    reachable = {initial_symbol}
+    worklist = deque([initial_symbol])
+    while worklist:
+        non_terminal = worklist.popleft()
+        for rule in productions.get(non_terminal, ()):
+            for symbol in body(rule):
+                if symbol not in reachable:
+                    reachable.add(symbol)
+                    worklist.append(symbol)
+    return reachable
+
+
+def unit_pairs(productions: dict, non_terminals: set[str]) -> dict[str, set[str]]:
+    '''
+    For each non-terminal A, the non-terminals B such that A =>* B using only
+    unit rules (A included).
+    '''
+    unit_edges = defaultdict(set)
+    for non_terminal, rules in productions.items():
+        for rule in rules:
+            if len(rule) == 1 and rule[0] in non_terminals:
+                unit_edges[non_terminal].add(rule[0])
+
+    return {non_terminal: unit_closure(unit_edges, non_terminal) for non_terminal in productions}
+
+
+def unit_closure(unit_edges: dict, non_terminal: str) -> set[str]:
+    '''
+    The non-terminals reached from one by unit edges, A -> {B, ...}, itself included.
+    '''
+    reached = {non_terminal}
+    worklist = [non_terminal]
+    while worklist:
+        for target in unit_edges.get(worklist.pop(), ()):
+            if target not in reached:
+                reached.add(target)
+                worklist.append(target)
+    return reached
+
+
+def best_empty_weights(productions: dict, nullables: set[str], weight) -> dict[str, float]:
+    '''
+    For each nullable non-terminal, the best weight of deriving ϵ from it.
+
+    weight(A, rule) is the weight of a rule, in (0, 1], and a derivation
+    weighs the product of its rules. Since no rule weighs more than 1 a
+    cycle never helps, so the improvements stop after as many rounds as
+    there are nullable non-terminals.
+    '''
+    best = dict.fromkeys(nullables, 0.0)
+    changed = True
+    while changed:
+        changed = False
+        for non_terminal in nullables:
+            for rule in productions.get(non_terminal, ()):
+                if not all(symbol in nullables for symbol in body(rule)):
+                    continue
+                this_weight = weight(non_terminal, rule)
+                for symbol in body(rule):
+                    this_weight *= best[symbol]
+                if this_weight > best[non_terminal]:
+                    best[non_terminal] = this_weight
+                    changed = True
+    return best
+
+
+def best_unit_pairs(productions: dict, non_terminals: set[str], weight) -> dict[str, dict[str, float]]:
+    '''
+    For each non-terminal A, the non-terminals B such that A =>* B using only
+    unit rules, with the best weight of such a chain (1 for A itself).
+
+    Rule weights are in (0, 1], so the best chains are found best first, as
+    shortest paths.
+    '''
+    unit_edges = defaultdict(list)
+    for non_terminal, rules in productions.items():
+        for rule in rules:
+            if len(rule) == 1 and rule[0] in non_terminals:
+                unit_edges[non_terminal].append(
+                    (rule[0], weight(non_terminal, rule)))
+
+    return {non_terminal: best_unit_closure(unit_edges, non_terminal) for non_terminal in productions}
+
+
+def best_unit_closure(unit_edges: dict, non_terminal: str) -> dict[str, float]:
+    '''
+    The non-terminals reached from one by weighted unit edges, A -> [(B, w), ...],
+    with the best weight of a chain to each (1 for itself).
+    '''
+    reached = {}
+    heap = [(-1.0, non_terminal)]
+    while heap:
+        negative, symbol = heappop(heap)
+        if symbol in reached:
+            continue
+        reached[symbol] = -negative
+        for target, this_weight in unit_edges.get(symbol, ()):
+            if target not in reached:
+                heappush(heap, (negative * this_weight, target))
+    return reached
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import time
+
+
+class BudgetExceeded(Exception):
+    '''
+    Raised by the cooperative budget checks when a request runs out of a limit.
+
+    Args:
+        limit (str): The budget key run out of, one of BUDGET_KEYS.
+        allowed (float): The limit value.
+        used (float): How much was used when the check failed.
+    '''
+
+    def __init__(self, limit: str, allowed: float, used: float) -> None:
+        super().__init__(limit, allowed, used)
+        self.limit = limit
+        self.allowed = allowed
+        self.used = used
+
+    def __str__(self) -> str:
+        return f'Budget exceeded: {self.limit} {self.used} over {self.allowed}'
+
+    def to_dict(self) -> dict:
+        return {'limit': self.limit, 'allowed': self.allowed, 'used': self.used}
+
+
+class Budget:
+    '''
+    Deadline and work limits of one request.
+
+    The CNF passes, the chart engines and the tree extraction check it as
+    they go and raise BudgetExceeded when a limit runs out, so a request
+    stops cleanly instead of holding a core. None means no limit.
+
+    The chart entries and trees are counted per sentence (see for_sentence),
+    the deadline is shared by every sentence of the request. The last
+    BudgetExceeded raised is kept in exceeded, for the callers that stop a
+    step early and go on with the partial results.
+
+    Args:
+        seconds (float): Wall time allowed from the creation of the budget.
+        max_tokens (int): Tokens of a sentence.
+        max_chart_entries (int): Chart entries filled for a sentence: CYK back
+            pointers, Earley items, or cell non-terminals for the numpy engine.
+        max_trees (int): Parse trees extracted for a sentence.
+        max_cnf_rules (int): Rules of the grammar during and after CNF.
+    '''
+
+    def __init__(self, seconds: float = None, max_tokens: int = None, max_chart_entries: int = None,
+                 max_trees: int = None, max_cnf_rules: int = None) -> None:
+        self.seconds = seconds
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.max_tokens = max_tokens
+        self.max_chart_entries = max_chart_entries
+        self.max_trees = max_trees
+        self.max_cnf_rules = max_cnf_rules
+        self.chart_entries = 0
+        self.trees = 0
+        self.exceeded: BudgetExceeded = None
+
+    @classmethod
+    def from_request(cls, requested: dict = None, limits: dict = None) -> Budget:
+        '''
+        Build the budget of a request from its camelCase 'budget' object.
+
+        Args:
+            requested (dict): The limits the request asks for, any missing
+                one takes the server value.
+            limits (dict): The server limits by the same keys, a request may
+                only lower them.
+        '''
+        requested = requested or {}
+        limits = limits or {}
+        if not isinstance(requested, dict):
+            raise ValueError('The budget must be an object')
+        unknown = set(requested) - set(BUDGET_KEYS)
+        if unknown:
+            raise ValueError(
+                f'Unknown budget limits {sorted(unknown)}, expected some of {list(BUDGET_KEYS)}')
+
+        values = {}
+        for key, argument in BUDGET_KEYS.items():
+            value = requested.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f'The budget {key} must be a positive number')
+            limit = limits.get(key)
+            if value is None or (limit is not None and value > limit):
+                value = limit
+            values[argument] = value
+        return cls(**values)
+
+    def for_sentence(self) -> Budget:
+        '''
+        A budget with the same deadline and fresh work counters, for the next sentence.
+        '''
+        budget = Budget(None, self.max_tokens, self.max_chart_entries,
+                        self.max_trees, self.max_cnf_rules)
+        budget.seconds = self.seconds
+        budget.deadline = self.deadline
+        return budget
+
+    def __exceed(self, limit: str, allowed: float, used: float) -> None:
+        self.exceeded = BudgetExceeded(limit, allowed, used)
+        raise self.exceeded
+
+    def check(self) -> None:
+        '''
+        Raise BudgetExceeded if the deadline passed.
+        '''
+        if self.deadline is not None:
+            now = time.monotonic()
+            if now > self.deadline:
+                self.__exceed(
+                    'seconds', self.seconds, round(self.seconds + now - self.deadline, 6))
+
+    def check_tokens(self, count: int) -> None:
+        if self.max_tokens is not None and count > self.max_tokens:
+            self.__exceed('maxTokens', self.max_tokens, count)
+
+    def check_cnf_rules(self, count: int) -> None:
+        '''
+        Check the rules of the grammar being transformed, and the deadline.
+        '''
+        if self.max_cnf_rules is not None and count > self.max_cnf_rules:
+            self.__exceed('maxCnfRules', self.max_cnf_rules, count)
+        self.check()
+
+    def add_chart_entries(self, count: int) -> None:
+        '''
+        Count chart entries just filled, and check the deadline.
+        '''
+        self.chart_entries += count
+        if self.max_chart_entries is not None and self.chart_entries > self.max_chart_entries:
+            self.__exceed(
+                'maxChartEntries', self.max_chart_entries, self.chart_entries)
+        self.check()
+
+    def add_tree(self) -> None:
+        '''
+        Count a parse tree about to be extracted, and check the deadline.
+        '''
+        if self.max_trees is not None and self.trees >= self.max_trees:
+            self.__exceed('maxTrees', self.max_trees, self.trees + 1)
+        self.trees += 1
+        self.check()
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, argument) for key, argument in BUDGET_KEYS.items()}
+
+
+# Request budget keys and the Budget arguments they set.
+BUDGET_KEYS = {
+    'seconds': 'seconds',
+    'maxTokens': 'max_tokens',
+    'maxChartEntries': 'max_chart_entries',
+    'maxTrees': 'max_trees',
+    'maxCnfRules': 'max_cnf_rules',
+}
@@ -0,0 +1,203 @@
+from __future__ import annotations
+from collections import OrderedDict
+from src.grammar_reader import normalize_line, read_grammar
+from threading import Lock
+import hashlib
+import sys
+import time
+
+
+def grammar_key(lines: list[str], initial_symbol: str = None, prefix: str = None, cnf_mode: str = 'classic') -> str:
+    '''
+    Canonical hash of the normalized grammar lines, initial symbol, prefix and CNF mode.
+    '''
+    digest = hashlib.sha256()
+    for line in lines:
+        if line.strip():
+            digest.update(normalize_line(line).encode('utf-8'))
+            digest.update(b'\0')
+    for part in (initial_symbol or '', prefix or '', cnf_mode):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def estimate_size(obj, seen: set[int] = None) -> int:
+    '''
+    Rough deep size in bytes of containers of strings, used for the memory limit.
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key, seen) + estimate_size(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    return size
+
+
+def grammar_sizes(grammar) -> dict[str, int]:
+    '''
+    Rules and non-terminals of a grammar before and after CNF.
+    '''
+    return {
+        'rules': sum(len(rules) for rules in grammar.original_productions.values()),
+        'nonTerminals': len(grammar.original_productions),
+        'cnfRules': sum(len(rules) for rules in grammar.productions.values()),
+        'cnfNonTerminals': len(grammar.productions),
+    }
+
+
+class CompiledGrammar:
+    '''
+    A grammar already transformed to CNF, ready to run CYK on.
+
+    Args:
+        key (str): The cache key of the grammar.
+        grammar (Grammar): The CNF grammar.
+        resultant_grammar (str): The CNF grammar as text, without the header lines.
+    '''
+
+    def __init__(self, key: str, grammar, resultant_grammar: str) -> None:
+        self.key = key
+        self.grammar = grammar
+        self.resultant_grammar = resultant_grammar
+        self.sizes = grammar_sizes(grammar)
+        self.size = estimate_size(grammar.productions) + \
+            sys.getsizeof(resultant_grammar)
+
+
+class GrammarCache:
+    '''
+    Bounded LRU cache of compiled grammars.
+
+    The classic CNF of a miss is recompiled incrementally from the last
+    grammar compiled, so editing a grammar rule by rule only transforms the
+    non-terminals each edit affects. There is one such state per cache, so
+    per process: editors interleaving their grammars diff against each
+    other (still exact, only slower), and each pool worker keeps its own.
+    The state counts in max_bytes, estimated at the bytes per rule of the
+    last compiled grammar, and is dropped when it takes more than half.
+
+    Args:
+        max_entries (int): Maximum number of grammars kept.
+        max_bytes (int): Maximum estimated memory used by the kept grammars.
+    '''
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 64 * 1024 * 1024) -> None:
+        from src.cnf_incremental import IncrementalCNF
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, CompiledGrammar] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+        self.incremental = IncrementalCNF()
+        self.incremental_bytes = 0
+
+    def get(self, key: str) -> CompiledGrammar | None:
+        '''
+        Get a compiled grammar, marking it as the most recently used.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, entry: CompiledGrammar) -> None:
+        '''
+        Store a compiled grammar, evicting the least recently used ones over the limits.
+        '''
+        with self.lock:
+            if entry.size > self.max_bytes:
+                return
+            previous = self.entries.pop(entry.key, None)
+            if previous is not None:
+                self.bytes -= previous.size
+            self.entries[entry.key] = entry
+            self.bytes += entry.size
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    self.bytes + self.incremental_bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def get_or_compile(self, lines: list[str], initial_symbol: str = None, prefix: str = None, cnf_mode: str = 'classic', timings: dict = None, budget=None) -> CompiledGrammar:
+        '''
+        Get the compiled grammar for the lines, running CNF only on a miss.
+
+        Args:
+            timings (dict): If given, on a miss the seconds spent reading the
+                grammar ('grammar') and on each CNF pass ('cnf_' + pass) are
+                stored in it.
+            budget (Budget): If given, CNF checks it and stops with
+                BudgetExceeded when it runs out. Nothing is cached then.
+        '''
+        from src.grammar import Grammar
+
+        key = grammar_key(lines, initial_symbol, prefix, cnf_mode)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        start_time = time.perf_counter()
+        grammar = Grammar(read_grammar(lines), initial_symbol, prefix)
+        cnf_timings = {}
+        if timings is not None:
+            timings['grammar'] = time.perf_counter() - start_time
+        grammar.CNF(cnf_mode, cnf_timings, budget, incremental=self.incremental)
+        if timings is not None:
+            for name, took in cnf_timings.items():
+                timings[f'cnf_{name}'] = took
+        resultant_grammar = '\n'.join(str(grammar).split('\n')[2:])
+        entry = CompiledGrammar(key, grammar, resultant_grammar)
+        if cnf_mode == 'classic':
+            self.__count_incremental(entry)
+        self.put(entry)
+        return entry
+
+    def __count_incremental(self, entry: CompiledGrammar) -> None:
+        '''
+        Estimate the incremental CNF state from the rules it keeps and the
+        bytes per rule of the entry just compiled, dropping it over half of
+        max_bytes.
+        '''
+        with self.incremental.lock:
+            size = self.incremental.rules() * entry.size // max(1, entry.sizes['cnfRules'])
+            if size > self.max_bytes // 2:
+                self.incremental.reset()
+                size = 0
+        with self.lock:
+            self.incremental_bytes = size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.incremental_bytes = 0
+        with self.incremental.lock:
+            self.incremental.reset()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'incrementalBytes': self.incremental_bytes,
+                'maxEntries': self.max_entries,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,555 @@
+'''
+Incremental classic CNF of edited grammars.
+
+An editor sends the whole grammar again after each change, while most of
+its non-terminals keep their rules. IncrementalCNF keeps every stage of the
+last grammar it compiled (without e-transitions, without unit productions,
+without useless symbols, in CNF) and the facts each stage came from, and on
+the next grammar recomputes only what the changed non-terminals affect:
+
+- the nullable and generating facts of the non-terminals using a changed
+  one, directly or not, the others being known;
+- the rules of each stage of the changed non-terminals and of the ones
+  using a symbol whose facts changed, with the steps Grammar.CNF runs on
+  each non-terminal;
+- the unit pairs of the non-terminals with a unit chain to a changed one;
+- the TERM and BIN step of the rules not in CNF yet, only when one of them
+  changed, since the new non-terminals are numbered over all of them.
+
+Reachability is recomputed on every compile, over the edges between
+non-terminals only. The result is the grammar a full Grammar.CNF('classic')
+gives, with the same rules, weights, names and order.
+'''
+from __future__ import annotations
+from collections import defaultdict
+from threading import Lock
+import time
+
+from src.analysis import best_empty_weights, best_unit_closure, body, unit_closure
+from src.grammar import chumsky_productions, copy_weights, e_free_rules, is_non_terminal, \
+    non_unit_rules, unit_free_rules
+
+
+class NonTerminalSymbols:
+    '''
+    Every non-terminal symbol, as a container for the passes that check
+    `symbol in non_terminals`.
+    '''
+
+    def __contains__(self, symbol: str) -> bool:
+        return is_non_terminal(symbol)
+
+
+NON_TERMINALS = NonTerminalSymbols()
+
+
+def non_terminal_symbols(rules) -> set[str]:
+    return {symbol for symbol in set().union(*rules) if is_non_terminal(symbol)}
+
+
+def nullable_summary(rules) -> frozenset[frozenset[str]]:
+    '''
+    The non-terminals each rule needs to derive ϵ. Rules with a terminal
+    never do and are left out.
+    '''
+    return frozenset(frozenset(body(rule)) for rule in rules
+                     if all(is_non_terminal(symbol) for symbol in body(rule)))
+
+
+def generating_summary(rules) -> frozenset[frozenset[str]]:
+    '''
+    The non-terminals each rule needs to derive a string of terminals.
+    '''
+    return frozenset(frozenset(symbol for symbol in body(rule) if is_non_terminal(symbol))
+                     for rule in rules)
+
+
+def _dependents(users: dict[str, set[str]], seeds) -> set[str]:
+    '''
+    The seeds and every non-terminal using one of them, directly or not.
+    '''
+    region = set(seeds)
+    worklist = list(region)
+    while worklist:
+        for user in users.get(worklist.pop(), ()):
+            if user not in region:
+                region.add(user)
+                worklist.append(user)
+    return region
+
+
+def _fixpoint(summaries: dict, region: set[str], known: set[str]) -> set[str]:
+    '''
+    The non-terminals of region reached by a rule whose symbols are all
+    reached, knowing the ones reached outside of region.
+    '''
+    waiting = defaultdict(list)
+    worklist = []
+    for non_terminal in region:
+        for symbols in summaries.get(non_terminal, ()):
+            inside = [symbol for symbol in symbols if symbol in region]
+            if len(inside) < len(symbols) and not all(
+                    symbol in known for symbol in symbols if symbol not in region):
+                continue
+            if not inside:
+                worklist.append(non_terminal)
+                continue
+            pending = [non_terminal, len(inside)]
+            for symbol in inside:
+                waiting[symbol].append(pending)
+
+    reached = set()
+    while worklist:
+        non_terminal = worklist.pop()
+        if non_terminal in reached:
+            continue
+        reached.add(non_terminal)
+        for pending in waiting.get(non_terminal, ()):
+            pending[1] -= 1
+            if pending[1] == 0:
+                worklist.append(pending[0])
+    return reached
+
+
+def _index(users: dict[str, set[str]], symbols: dict[str, set[str]], non_terminal: str, new: set[str]) -> None:
+    '''
+    Replace the symbols a non-terminal uses in a symbol -> users index.
+    '''
+    old = symbols.pop(non_terminal, set())
+    for symbol in old - new:
+        users[symbol].discard(non_terminal)
+        if not users[symbol]:
+            del users[symbol]
+    for symbol in new - old:
+        users[symbol].add(non_terminal)
+    if new:
+        symbols[non_terminal] = new
+
+
+def _rule_weights(weights: dict, non_terminal: str, rules) -> dict:
+    return {(non_terminal, rule): weights[(non_terminal, rule)]
+            for rule in rules if (non_terminal, rule) in weights}
+
+
+def _replace_weights(weights: dict, non_terminal: str, old_rules, new: dict) -> bool:
+    '''
+    Replace the weights of a non-terminal, telling whether they changed.
+    '''
+    old = _rule_weights(weights, non_terminal, old_rules or ())
+    for key in old:
+        del weights[key]
+    weights.update(new)
+    return old != new
+
+
+def _rebind(value, old_source, new_source):
+    '''
+    A rule set kept from the last compile, as the equal set of this one when
+    it was shared with the stage before, so the new grammar shares it too.
+    '''
+    return new_source if value is old_source else value
+
+
+class IncrementalCNF:
+    '''
+    Classic CNF of grammars, recompiling only what changed since the last one.
+
+    Grammars whose non-terminals do not all look like non-terminals (upper
+    case letters and digits) are not handled, compile returns None for them.
+    Compiles run one at a time, compile returns None while one is running.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Forget the last grammar, the next compile starts from scratch.
+        '''
+        self.prefix: str = None
+        self.weighted = (False, False, False)
+
+        # The grammar read and its nullable non-terminals.
+        self.read: dict[str, frozenset] = {}
+        self.read_weights: dict = {}
+        self.read_symbols: dict[str, set[str]] = {}
+        self.read_users: dict[str, set[str]] = defaultdict(set)
+        self.nullable_summaries: dict[str, frozenset] = {}
+        self.nullables: set[str] = set()
+        self.empty: dict[str, float] = None
+
+        # Without e-transitions.
+        self.e_free: dict[str, set] = {}
+        self.e_free_weights: dict = {}
+
+        # Without unit productions.
+        self.no_unary: dict[str, set] = {}
+        self.unit_edges: dict[str, set[str]] = {}
+        self.weighted_edges: dict[str, list] = {}
+        self.unit_users: dict[str, set[str]] = defaultdict(set)
+        self.unit_free: dict[str, set] = {}
+        self.unit_free_weights: dict = {}
+
+        # Without useless symbols.
+        self.unit_free_symbols: dict[str, set[str]] = {}
+        self.unit_free_users: dict[str, set[str]] = defaultdict(set)
+        self.generating_summaries: dict[str, frozenset] = {}
+        self.generating: set[str] = set()
+        self.useful: dict[str, set] = {}
+        self.successors: dict[str, set[str]] = {}
+        self.reachable: set[str] = set()
+        self.reduced: dict[str, set] = {}
+
+        # In CNF.
+        self.not_cnf: set[str] = set()
+        self.binarized: dict[str, set] = {}
+        self.binarized_weights: dict = {}
+        self.kept_weights: dict = {}
+        self.cnf: dict[str, set] = {}
+        self.symbol_counts: dict[str, int] = defaultdict(int)
+        self.terminals: set[str] = set()
+        self.used_non_terminals: set[str] = set()
+        self.nullable_heads: set[str] = set()
+
+    def rules(self) -> int:
+        '''
+        The rules, weights and index entries kept by every stage, to estimate
+        the memory of the state. A rule set shared by stages is counted once.
+        '''
+        seen = set()
+        count = 0
+        for stage in (self.read, self.e_free, self.no_unary, self.unit_free,
+                      self.useful, self.binarized, self.cnf):
+            for rules in stage.values():
+                if id(rules) not in seen:
+                    seen.add(id(rules))
+                    count += len(rules)
+        for index in (self.read_symbols, self.read_users, self.unit_edges, self.unit_users,
+                      self.unit_free_symbols, self.unit_free_users, self.successors):
+            count += sum(len(symbols) for symbols in index.values())
+        return count + sum(len(weights) for weights in (
+            self.read_weights, self.e_free_weights, self.unit_free_weights,
+            self.binarized_weights, self.kept_weights))
+
+    def compile(self, grammar, timings: dict = None, budget=None) -> tuple | None:
+        '''
+        The classic CNF of a grammar just read, diffing it against the last one.
+
+        Returns the CNF (productions, weights, non_terminals, terminals,
+        nullables), or None when Grammar.CNF has to transform the grammar
+        instead. If the budget runs out the last grammar is forgotten.
+
+        Args:
+            grammar (Grammar): The grammar, not transformed yet.
+            timings (dict): If given, the seconds of each stage are stored in
+                it by the names of the classic passes.
+            budget (Budget): Checked after each stage like Grammar.CNF.
+        '''
+        if not all(is_non_terminal(non_terminal) for non_terminal in grammar.original_productions):
+            return None
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self.__compile(grammar, timings, budget)
+        except BaseException:
+            self.reset()
+            raise
+        finally:
+            self.lock.release()
+
+    def __compile(self, grammar, timings: dict, budget) -> tuple:
+        read = grammar.original_productions
+        read_weights = grammar.weights
+
+        def stage(name: str, start_time: float, productions: dict) -> None:
+            if timings is not None:
+                timings[name] = time.perf_counter() - start_time
+            if budget is not None:
+                budget.check_cnf_rules(sum(len(rules) for rules in productions.values()))
+
+        start_time = time.perf_counter()
+        changed = {non_terminal for non_terminal in read.keys() | self.read.keys()
+                   if read.get(non_terminal) != self.read.get(non_terminal)}
+        changed |= {non_terminal for (non_terminal, _), _
+                    in set(read_weights.items()) ^ set(self.read_weights.items())}
+        last_e_free = self.e_free
+        changed = self.__e_transitions(read, read_weights, changed, budget)
+        stage('e_transitions', start_time, self.e_free)
+
+        start_time = time.perf_counter()
+        last_unit_free = self.unit_free
+        changed = self.__unary_productions(changed, last_e_free)
+        stage('unary_productions', start_time, self.unit_free)
+
+        start_time = time.perf_counter()
+        changed = self.__useless_symbols(changed, last_unit_free, grammar.initial_symbol)
+        stage('useless_symbols', start_time, self.reduced)
+
+        start_time = time.perf_counter()
+        self.__chumsky_normal_form(changed, grammar.prefix)
+        stage('chumsky_normal_form', start_time, self.cnf)
+
+        weights = {**self.kept_weights, **self.binarized_weights} if self.weighted[2] else {}
+        return (defaultdict(set, self.cnf), weights, set(self.cnf) | self.used_non_terminals,
+                set(self.terminals), set(self.nullable_heads))
+
+    def __e_transitions(self, read: dict, read_weights: dict, changed: set[str], budget) -> set[str]:
+        '''
+        Remove the e-transitions of the changed non-terminals and of the ones
+        using a symbol whose nullability or best ϵ weight changed. Returns
+        the non-terminals whose rules or weights changed.
+        '''
+        weighted = bool(read_weights)
+        if weighted != self.weighted[0]:
+            changed = set(read) | set(self.read)
+        for non_terminal in changed:
+            rules = read.get(non_terminal)
+            _index(self.read_users, self.read_symbols, non_terminal,
+                   non_terminal_symbols(rules) if rules is not None else set())
+            if rules is None:
+                self.nullable_summaries.pop(non_terminal, None)
+            else:
+                self.nullable_summaries[non_terminal] = nullable_summary(rules)
+
+        region = _dependents(self.read_users, changed)
+        known = self.nullables - region
+        nullables = known | _fixpoint(self.nullable_summaries, region, known)
+        flipped = nullables ^ self.nullables
+        empty = None
+        if weighted:
+            empty = self.empty
+            if empty is None or flipped or not changed.isdisjoint(nullables | self.nullables):
+                empty = best_empty_weights(
+                    read, nullables, lambda non_terminal, rule: read_weights.get((non_terminal, rule), 1.0))
+                last = self.empty or {}
+                flipped = flipped | {symbol for symbol, weight in empty.items()
+                                     if weight != last.get(symbol)}
+        affected = set(changed)
+        for symbol in flipped:
+            affected |= self.read_users.get(symbol, set())
+
+        check = budget.check_cnf_rules if budget is not None else None
+        this_changed = set()
+        computed = {}
+        for non_terminal in affected:
+            old = self.e_free.get(non_terminal)
+            rules = read.get(non_terminal)
+            new = weights = None
+            if rules is not None:
+                weights = {} if weighted else None
+                new = computed[non_terminal] = e_free_rules(
+                    non_terminal, rules, nullables, read_weights, empty, weights, check)
+            weights_changed = _replace_weights(self.e_free_weights, non_terminal, old, weights or {})
+            if old != new or weights_changed:
+                this_changed.add(non_terminal)
+
+        self.e_free = {non_terminal: computed[non_terminal] if non_terminal in computed
+                       else _rebind(self.e_free[non_terminal], self.read[non_terminal], rules)
+                       for non_terminal, rules in read.items()}
+        self.read, self.read_weights = read, read_weights
+        self.nullables, self.empty = nullables, empty
+        self.weighted = (weighted, *self.weighted[1:])
+        return this_changed
+
+    def __unary_productions(self, changed: set[str], last_e_free: dict) -> set[str]:
+        '''
+        Remove the unit productions of the changed non-terminals and of the
+        ones with a unit chain to one. Returns the non-terminals whose rules
+        or weights changed.
+        '''
+        e_free = self.e_free
+        weights = self.e_free_weights
+        weighted = bool(weights)
+        if weighted != self.weighted[1]:
+            changed = set(e_free) | set(self.unit_free)
+
+        # The ones reaching a changed non-terminal before and after the change.
+        affected = _dependents(self.unit_users, changed)
+        last_no_unary = self.no_unary
+        self.no_unary = {}
+        for non_terminal, rules in e_free.items():
+            if non_terminal not in changed:
+                self.no_unary[non_terminal] = _rebind(
+                    last_no_unary[non_terminal], last_e_free[non_terminal], rules)
+                continue
+            self.no_unary[non_terminal] = non_unit_rules(rules, NON_TERMINALS)
+        for non_terminal in changed:
+            rules = e_free.get(non_terminal, ())
+            units = [rule for rule in rules if len(rule) == 1 and is_non_terminal(rule[0])]
+            _index(self.unit_users, self.unit_edges, non_terminal, {rule[0] for rule in units})
+            self.weighted_edges[non_terminal] = [
+                (rule[0], weights.get((non_terminal, rule), 1.0)) for rule in units]
+            if not units:
+                del self.weighted_edges[non_terminal]
+        affected |= _dependents(self.unit_users, changed)
+
+        this_changed = set()
+        computed = {}
+        for non_terminal in affected:
+            old = self.unit_free.get(non_terminal)
+            new = this_weights = None
+            if non_terminal in e_free:
+                pairs = this_weights = None
+                if weighted:
+                    pairs = best_unit_closure(self.weighted_edges, non_terminal)
+                    this_weights = {}
+                new = computed[non_terminal] = unit_free_rules(
+                    non_terminal, unit_closure(self.unit_edges, non_terminal), self.no_unary,
+                    weights, pairs, this_weights)
+            weights_changed = _replace_weights(self.unit_free_weights, non_terminal, old, this_weights or {})
+            if old != new or weights_changed:
+                this_changed.add(non_terminal)
+
+        self.unit_free = {non_terminal: computed[non_terminal] if non_terminal in computed
+                          else _rebind(self.unit_free[non_terminal], last_no_unary[non_terminal],
+                                       self.no_unary[non_terminal])
+                          for non_terminal in e_free}
+        self.weighted = (self.weighted[0], weighted, self.weighted[2])
+        return this_changed
+
+    def __useless_symbols(self, changed: set[str], last_unit_free: dict, initial_symbol: str) -> set[str]:
+        '''
+        Remove the rules of the changed non-terminals and of the ones using a
+        symbol whose generating fact changed that use a non generating
+        non-terminal, then the non-terminals not reachable from the initial
+        symbol. Returns the non-terminals whose rules or weights changed.
+        '''
+        unit_free = self.unit_free
+        for non_terminal in changed:
+            rules = unit_free.get(non_terminal)
+            _index(self.unit_free_users, self.unit_free_symbols, non_terminal,
+                   non_terminal_symbols(rules) if rules is not None else set())
+            if rules is None:
+                self.generating_summaries.pop(non_terminal, None)
+            else:
+                self.generating_summaries[non_terminal] = generating_summary(rules)
+
+        region = _dependents(self.unit_free_users, changed)
+        known = self.generating - region
+        generating = known | _fixpoint(self.generating_summaries, region, known)
+        affected = set(changed)
+        for symbol in generating ^ self.generating:
+            affected |= self.unit_free_users.get(symbol, set())
+
+        def useful_rules(rules):
+            if all(symbol in generating or not is_non_terminal(symbol)
+                   for rule in rules for symbol in rule):
+                return rules
+            return {rule for rule in rules
+                    if all(symbol in generating or not is_non_terminal(symbol) for symbol in rule)}
+
+        this_changed = set(changed)
+        computed = {}
+        for non_terminal in affected:
+            rules = unit_free.get(non_terminal)
+            new = computed[non_terminal] = useful_rules(rules) if rules is not None else None
+            if self.useful.get(non_terminal) != new:
+                this_changed.add(non_terminal)
+                self.successors[non_terminal] = non_terminal_symbols(new) if new is not None else set()
+                if not self.successors[non_terminal]:
+                    del self.successors[non_terminal]
+
+        self.useful = {non_terminal: computed[non_terminal] if non_terminal in computed
+                       else _rebind(self.useful[non_terminal], last_unit_free[non_terminal], rules)
+                       for non_terminal, rules in unit_free.items()}
+        self.generating = generating
+
+        # Over the edges between non-terminals, only their reachability matters.
+        reachable = {initial_symbol}
+        worklist = [initial_symbol]
+        while worklist:
+            for symbol in self.successors.get(worklist.pop(), ()):
+                if symbol not in reachable:
+                    reachable.add(symbol)
+                    worklist.append(symbol)
+        this_changed |= (reachable ^ self.reachable) & (self.useful.keys() | self.reduced.keys())
+        self.reachable = reachable
+        self.reduced = {non_terminal: rules for non_terminal, rules in self.useful.items()
+                        if non_terminal in reachable}
+        return this_changed
+
+    def __chumsky_normal_form(self, changed: set[str], prefix: str) -> None:
+        '''
+        Keep the rules already in CNF of the changed non-terminals, and run
+        the TERM and BIN steps again on the rules not in CNF when one of them
+        changed, then update the symbols of the changed rule sets.
+        '''
+        reduced = self.reduced
+        weights = self.unit_free_weights
+        weighted = bool(weights)
+        last_cnf = self.cnf
+        last_not_cnf = self.not_cnf
+        if weighted != self.weighted[2]:
+            changed = set(reduced) | set(last_cnf)
+
+        not_cnf = set(last_not_cnf)
+        for non_terminal in changed:
+            rules = reduced.get(non_terminal)
+            if rules is not None and not all(
+                    len(rule) == 1 or (len(rule) == 2 and is_non_terminal(rule[0]) and is_non_terminal(rule[1]))
+                    for rule in rules):
+                not_cnf.add(non_terminal)
+            else:
+                not_cnf.discard(non_terminal)
+            if rules is None or non_terminal in not_cnf:
+                _replace_weights(self.kept_weights, non_terminal, last_cnf.get(non_terminal), {})
+            else:
+                kept = {} if weighted else None
+                if weighted:
+                    copy_weights(kept, weights, non_terminal, rules)
+                _replace_weights(self.kept_weights, non_terminal, last_cnf.get(non_terminal), kept or {})
+
+        last_binarized = self.binarized
+        if prefix != self.prefix or weighted != self.weighted[2] or \
+                not changed.isdisjoint(last_not_cnf | not_cnf):
+            binarized_weights = {} if weighted else None
+            self.binarized = chumsky_productions(
+                {non_terminal: rules for non_terminal, rules in reduced.items() if non_terminal in not_cnf},
+                prefix, weights, binarized_weights)
+            self.binarized_weights = binarized_weights or {}
+            # The names of the new non-terminals may all have moved.
+            changed = changed | last_binarized.keys() | self.binarized.keys()
+
+        binarized = self.binarized
+        cnf = {non_terminal: binarized[non_terminal] if non_terminal in not_cnf else rules
+               for non_terminal, rules in reduced.items()}
+        for non_terminal, rules in binarized.items():
+            if non_terminal not in cnf:
+                cnf[non_terminal] = rules
+
+        for non_terminal in changed:
+            self.__count_symbols(non_terminal, last_cnf.get(non_terminal), cnf.get(non_terminal))
+
+        self.cnf = cnf
+        self.not_cnf = not_cnf
+        self.prefix = prefix
+        self.weighted = (*self.weighted[:2], weighted)
+
+    def __count_symbols(self, non_terminal: str, old, new) -> None:
+        '''
+        Count the uses of each symbol in the rules of a non-terminal that are
+        gone or new, keeping the terminals and non-terminals used.
+        '''
+        if old is new:
+            return
+        old = old if old is not None else frozenset()
+        new = new if new is not None else frozenset()
+        counts = self.symbol_counts
+        for rule in old - new:
+            for symbol in set(rule):
+                counts[symbol] -= 1
+                if not counts[symbol]:
+                    del counts[symbol]
+                    used = self.used_non_terminals if is_non_terminal(symbol) else self.terminals
+                    used.discard(symbol)
+        for rule in new - old:
+            for symbol in set(rule):
+                counts[symbol] += 1
+                if counts[symbol] == 1:
+                    used = self.used_non_terminals if is_non_terminal(symbol) else self.terminals
+                    used.add(symbol)
+        if any('ϵ' in rule for rule in new):
+            self.nullable_heads.add(non_terminal)
+        else:
+            self.nullable_heads.discard(non_terminal)
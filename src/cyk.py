@@ -0,0 +1,172 @@
+from __future__ import annotations
+from collections import defaultdict
+
+
+class LazyChart:
+    '''
+    Read only n x n chart whose cells are computed on first access and kept.
+
+    Args:
+        n (int): The number of tokens.
+        compute (callable): Function (l, s) -> cell value.
+    '''
+
+    def __init__(self, n: int, compute) -> None:
+        self.n = n
+        self.compute = compute
+        self.cells: dict[tuple[int, int], object] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, l: int):
+        return LazyChartRow(self, l)
+
+
+class LazyChartRow:
+    def __init__(self, chart: LazyChart, l: int) -> None:
+        self.chart = chart
+        self.l = l
+
+    def __len__(self) -> int:
+        return self.chart.n
+
+    def __getitem__(self, s: int):
+        key = (self.l, s)
+        cells = self.chart.cells
+        if key not in cells:
+            cells[key] = self.chart.compute(self.l, s)
+        return cells[key]
+
+
+class CYKIndex:
+    '''
+    Interned view of a CNF grammar for the CYK chart engines.
+
+    Every symbol is mapped once to a small integer. Binary rules are indexed
+    in reverse, (B, C) -> {A}, and terminal rules as a lexicon, terminal -> {A},
+    so a cell is filled by looking up the pairs of its children cells instead
+    of scanning every rule.
+
+    Args:
+        grammar (Grammar): A grammar already transformed to CNF.
+    '''
+
+    __numpy = None
+    __parallel = None
+    __recognizer = None
+
+    def __init__(self, grammar) -> None:
+        self.symbols: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.lexicon: dict[str, frozenset[int]] = {}
+        self.binary: dict[tuple[int, int], frozenset[int]] = {}
+
+        lexicon = defaultdict(set)
+        binary = defaultdict(set)
+
+        # The initial symbol is always interned first, as id 0. The rules are
+        # sorted so the ids do not depend on the set order of the process.
+        self.intern(grammar.initial_symbol)
+        for non_terminal, rules in grammar.productions.items():
+            A = self.intern(non_terminal)
+            for rule in sorted(rules):
+                if len(rule) == 1 and rule[0] in grammar.terminals:
+                    lexicon[rule[0]].add(A)
+                elif len(rule) == 2:
+                    B, C = rule
+                    binary[(self.intern(B), self.intern(C))].add(A)
+
+        # Many terminals have the same non-terminals, share their sets.
+        shared: dict[frozenset[int], frozenset[int]] = {}
+        self.lexicon = {terminal: shared.setdefault(frozenset(ids), frozenset(ids))
+                        for terminal, ids in lexicon.items()}
+        self.binary = {pair: frozenset(ids) for pair, ids in binary.items()}
+        self.initial = 0
+
+    def intern(self, symbol: str) -> int:
+        '''
+        Get the integer id of a symbol, creating it if needed.
+        '''
+        if symbol not in self.ids:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.ids[symbol]
+
+    def numpy(self):
+        '''
+        Get the NumPy backend of this index, built once. Requires numpy.
+        '''
+        if self.__numpy is None:
+            from src.cyk_numpy import NumpyCYK
+            self.__numpy = NumpyCYK(self)
+        return self.__numpy
+
+    def parallel(self):
+        '''
+        Get the wavefront parallel backend of this index, built once.
+        '''
+        if self.__parallel is None:
+            from src.cyk_parallel import ParallelCYK
+            from src.utils.constants import CYK_PARALLEL_MIN_SPAN_WORK, CYK_PARALLEL_WORKERS
+            self.__parallel = ParallelCYK(
+                self, CYK_PARALLEL_WORKERS, CYK_PARALLEL_MIN_SPAN_WORK)
+        return self.__parallel
+
+    def recognizer(self):
+        '''
+        Get the recognition only bitset backend of this index, built once.
+        '''
+        if self.__recognizer is None:
+            from src.cyk_bitset import BitsetRecognizer
+            self.__recognizer = BitsetRecognizer(self)
+        return self.__recognizer
+
+    def fill(self, I: list[str], budget=None):
+        '''
+        Fill the CYK chart for the tokens I.
+
+        If a Budget is given, the back pointers of each cell are counted on
+        it as the cell is filled.
+
+        Returns:
+            P (list[list[set[str]]]): P[l][s] holds the non-terminals deriving I[s:s+l+1].
+            back (list[list[list[tuple]]]): The back pointers, with the same
+                (l, p, s, A) and (l, p, s, A, B, C) format of Grammar.CYK.
+        '''
+        symbols = self.symbols
+        binary = self.binary
+        n = len(I)
+
+        cells = [[set() for _ in range(n)] for _ in range(n)]
+        back = [[[] for _ in range(n)] for _ in range(n)]
+
+        for s in range(n):
+            for A in self.lexicon.get(I[s], ()):
+                cells[0][s].add(A)
+                back[0][s].append((0, 0, s, symbols[A]))
+            if budget is not None:
+                budget.add_chart_entries(len(back[0][s]))
+
+        for l in range(1, n):
+            for s in range(n-l):
+                cell = cells[l][s]
+                cell_back = back[l][s]
+                for p in range(l):
+                    right = cells[l-p-1][s+p+1]
+                    if not right:
+                        continue
+                    for B in cells[p][s]:
+                        for C in right:
+                            heads = binary.get((B, C))
+                            if heads is None:
+                                continue
+                            for A in heads:
+                                cell.add(A)
+                                cell_back.append(
+                                    (l, p, s, symbols[A], symbols[B], symbols[C]))
+                if budget is not None:
+                    budget.add_chart_entries(len(cell_back))
+
+        P = [[{symbols[A] for A in cell} for cell in row] for row in cells]
+        return P, back
@@ -0,0 +1,81 @@
+'''
+Recognition only CYK over a CYKIndex, with bitsets.
+
+Each span length is a row of one int per non-terminal, whose bit s is set
+when the non-terminal derives the span starting at s. A binary rule A -> B C
+over the split p is then one AND of the B row of length p with the C row of
+the rest shifted by p + 1 starts, ORed into the A row: every start of the
+span length at once, and no back pointers. The rows hold n bits for each of
+the r non-terminals and n span lengths, O(n² r / 64) machine words.
+'''
+from __future__ import annotations
+
+
+class BitsetRecognizer:
+    '''
+    Bit parallel CYK backend over a CYKIndex that only tells whether the
+    tokens are in the language.
+
+    It stops as soon as the answer is known: when a token has no
+    non-terminal, or when the span lengths left can no longer be filled.
+
+    Args:
+        index (CYKIndex): The interned CNF grammar.
+    '''
+
+    def __init__(self, index) -> None:
+        self.index = index
+        # The binary rules by their left symbol, B -> [(C, heads), ...].
+        self.rules: dict[int, list[tuple[int, tuple[int, ...]]]] = {}
+        for (B, C), heads in index.binary.items():
+            self.rules.setdefault(B, []).append((C, tuple(heads)))
+
+    def recognize(self, I: list[str], budget=None) -> bool:
+        '''
+        Whether the initial symbol derives the tokens I.
+
+        If a Budget is given, the non-terminals of each span length are
+        counted on it as chart entries, like the numpy engine.
+        '''
+        n = len(I)
+        lexicon = self.index.lexicon
+        rules = self.rules
+
+        first = {}
+        for s in range(n):
+            ids = lexicon.get(I[s])
+            if not ids:
+                # No span holding this token is derived.
+                return False
+            for A in ids:
+                first[A] = first.get(A, 0) | 1 << s
+        if budget is not None:
+            budget.add_chart_entries(sum(bits.bit_count() for bits in first.values()))
+
+        rows = [first]
+        longest = 1
+        for l in range(1, n):
+            row = {}
+            for p in range(l):
+                right = rows[l-p-1]
+                shift = p + 1
+                for B, left_bits in rows[p].items():
+                    for C, heads in rules.get(B, ()):
+                        right_bits = right.get(C)
+                        if right_bits is None:
+                            continue
+                        bits = left_bits & right_bits >> shift
+                        if bits:
+                            for A in heads:
+                                row[A] = row.get(A, 0) | bits
+            rows.append(row)
+            if budget is not None:
+                budget.add_chart_entries(sum(bits.bit_count() for bits in row.values()))
+            if row:
+                longest = l + 1
+            elif l + 1 >= 2 * longest:
+                # The spans of longest + 1 ... l + 1 tokens are all empty, so
+                # a longer span would split in two of at most longest tokens,
+                # which add up to less than its length: none is derived.
+                return False
+        return bool(rows[n-1].get(self.index.initial, 0) & 1)
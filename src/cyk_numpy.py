@@ -0,0 +1,106 @@
+from __future__ import annotations
+import numpy as np
+
+from src.cyk import LazyChart
+
+
+class NumpyCYK:
+    '''
+    Vectorized CYK backend over a CYKIndex.
+
+    The chart is a boolean array of shape [n, n, r] (span length, start,
+    non-terminal) and the binary rules are a [K, r] matrix from the K distinct
+    (B, C) pairs to their heads. Each span length is filled with one gather
+    over all split points and start positions followed by one matmul. Back
+    pointers are rebuilt lazily, only for the cells the tree drawing visits.
+
+    Args:
+        index (CYKIndex): The interned CNF grammar.
+    '''
+
+    def __init__(self, index) -> None:
+        self.index = index
+        r = len(index.symbols)
+        pairs = list(index.binary.items())
+
+        self.left_ids = np.array([B for (B, _), _ in pairs], dtype=np.intp)
+        self.right_ids = np.array([C for (_, C), _ in pairs], dtype=np.intp)
+        self.pair_heads: list[tuple[int, ...]] = [
+            tuple(sorted(heads)) for _, heads in pairs]
+
+        self.heads = np.zeros((len(pairs), r), dtype=np.float32)
+        for k, heads in enumerate(self.pair_heads):
+            self.heads[k, list(heads)] = 1
+
+        self.lexicon: dict[str, np.ndarray] = {}
+        for terminal, ids in index.lexicon.items():
+            vector = np.zeros(r, dtype=bool)
+            vector[list(ids)] = True
+            self.lexicon[terminal] = vector
+
+    def chart(self, I: list[str], budget=None) -> np.ndarray:
+        '''
+        Fill the boolean chart for the tokens I.
+
+        If a Budget is given, the non-terminals of each span length are
+        counted on it as chart entries, there are no back pointers yet.
+        '''
+        n = len(I)
+        r = len(self.index.symbols)
+        chart = np.zeros((n, n, r), dtype=bool)
+
+        for s in range(n):
+            vector = self.lexicon.get(I[s])
+            if vector is not None:
+                chart[0, s] = vector
+        if budget is not None:
+            budget.add_chart_entries(int(np.count_nonzero(chart[0])))
+
+        if not len(self.pair_heads):
+            return chart
+
+        for l in range(1, n):
+            m = n - l
+            splits = np.arange(l)
+            # left[p, s] = chart[p, s], right[p, s] = chart[l-p-1, s+p+1]
+            left = chart[:l, :m]
+            right = chart[(l - 1 - splits)[:, None],
+                          splits[:, None] + 1 + np.arange(m)[None, :]]
+            pairs = (left[:, :, self.left_ids] &
+                     right[:, :, self.right_ids]).any(axis=0)
+            if pairs.any():
+                chart[l, :m] = (pairs.astype(np.float32) @ self.heads) > 0
+            if budget is not None:
+                budget.add_chart_entries(int(np.count_nonzero(chart[l, :m])))
+
+        return chart
+
+    def fill(self, I: list[str], budget=None):
+        '''
+        Fill the chart for the tokens I.
+
+        Returns the same (P, back) pair as CYKIndex.fill, but both are lazy
+        charts computed from the boolean array on access.
+        '''
+        chart = self.chart(I, budget)
+        symbols = self.index.symbols
+
+        def cell(l: int, s: int) -> set[str]:
+            return {symbols[A] for A in np.flatnonzero(chart[l, s])}
+
+        def cell_back(l: int, s: int) -> list[tuple]:
+            if l == 0:
+                return [(0, 0, s, symbols[A]) for A in np.flatnonzero(chart[0, s])]
+            pointers = []
+            for p in range(l):
+                hits = np.flatnonzero(chart[p, s, self.left_ids] &
+                                      chart[l-p-1, s+p+1, self.right_ids])
+                for k in hits:
+                    B = symbols[self.left_ids[k]]
+                    C = symbols[self.right_ids[k]]
+                    for A in self.pair_heads[k]:
+                        pointers.append((l, p, s, symbols[A], B, C))
+            return pointers
+
+        n = len(I)
+        return LazyChart(n, cell), LazyChart(n, cell_back)
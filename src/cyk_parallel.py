@@ -0,0 +1,299 @@
+'''
+Wavefront parallel CYK over a CYKIndex.
+
+The cells of one span length only read the cells of shorter spans, so each
+span length is split in ranges of start positions filled by a process pool,
+with a barrier (waiting for every range) before the next length. The chart
+is a bitset per cell, one bit per non-terminal, in shared memory: the
+workers read the shorter spans and write their own cells in place, nothing
+of the chart is pickled. The binary rules are in shared memory too, decoded
+once per worker and grammar.
+'''
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from threading import Lock, local
+import array
+import multiprocessing
+import weakref
+
+from src.cyk import LazyChart
+
+# Process pools by number of workers, started on first use.
+_executors: dict[int, ProcessPoolExecutor] = {}
+_executors_lock = Lock()
+
+# The chart being filled by this thread, with the span lengths already
+# decoded, and the binary rules of the last grammars, shared by the threads
+# filling small spans in the calling process.
+_attached = local()
+_rules: dict[str, dict] = {}
+_rules_lock = Lock()
+MAX_CACHED_RULES = 8
+
+
+def executor(workers: int) -> ProcessPoolExecutor:
+    '''
+    Get the process pool of the given number of workers, started with spawn.
+    '''
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executors[workers]
+
+
+def _restart(workers: int, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    with _executors_lock:
+        if _executors.get(workers) is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            del _executors[workers]
+    return executor(workers)
+
+
+def cell_offset(n: int, width: int, l: int, s: int) -> int:
+    '''
+    Byte offset of the cell (l, s) in a chart of n tokens, the spans of each
+    length after the longer ones, width bytes per cell.
+    '''
+    return (l * (2 * n - l + 1) // 2 + s) * width
+
+
+def mask_ids(mask: int) -> tuple[int, ...]:
+    '''
+    The non-terminal ids set in a cell bitset.
+    '''
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return tuple(ids)
+
+
+def encode_rules(binary) -> array.array:
+    '''
+    Flatten the binary rules to B, C, A triples of unsigned ints.
+    '''
+    triples = array.array('I')
+    for (B, C), heads in binary.items():
+        for A in heads:
+            triples.extend((B, C, A))
+    return triples
+
+
+def _binary(rules_name: str, count: int) -> dict[tuple[int, int], tuple[int, int]]:
+    '''
+    The binary rules in a shared memory block, (B, C) -> (heads, heads bitset).
+    '''
+    with _rules_lock:
+        binary = _rules.get(rules_name)
+    if binary is None:
+        block = shared_memory.SharedMemory(rules_name)
+        try:
+            triples = block.buf[:count * 3 * 4].cast('I')
+            heads = {}
+            for k in range(0, len(triples), 3):
+                pair = (triples[k], triples[k + 1])
+                heads[pair] = heads.get(pair, 0) | 1 << triples[k + 2]
+            triples.release()
+        finally:
+            block.close()
+        binary = {pair: (mask.bit_count(), mask)
+                  for pair, mask in heads.items()}
+        with _rules_lock:
+            if rules_name not in _rules and len(_rules) >= MAX_CACHED_RULES:
+                _rules.pop(next(iter(_rules)))
+            _rules[rules_name] = binary
+    return binary
+
+
+def _attach(chart_name: str) -> tuple:
+    '''
+    The chart block and its decoded span lengths, attached once per chart.
+    '''
+    chart = getattr(_attached, 'chart', None)
+    if chart is None or chart[0] != chart_name:
+        release()
+        chart = _attached.chart = (chart_name, shared_memory.SharedMemory(chart_name), [])
+    return chart
+
+
+def release() -> None:
+    '''
+    Detach from the last chart filled by this thread.
+    '''
+    chart = getattr(_attached, 'chart', None)
+    if chart is not None:
+        _attached.chart = None
+        chart[1].close()
+
+
+def fill_span(chart_name: str, rules_name: str, rules_count: int, n: int, width: int,
+              l: int, start: int, stop: int) -> int:
+    '''
+    Fill the cells (l, start) ... (l, stop - 1) of a shared chart.
+
+    Every shorter span must be filled already. Returns the back pointers
+    of the filled cells, the chart entries the indexed engine would count.
+    '''
+    _, block, cells = _attach(chart_name)
+    buf = block.buf
+    binary = _binary(rules_name, rules_count)
+
+    # The shorter spans are final, each one is decoded once.
+    while len(cells) < l:
+        p = len(cells)
+        offset = cell_offset(n, width, p, 0)
+        row = bytes(buf[offset:offset + (n - p) * width])
+        cells.append([mask_ids(int.from_bytes(row[s * width:(s + 1) * width], 'little'))
+                      for s in range(n - p)])
+
+    entries = 0
+    for s in range(start, stop):
+        mask = 0
+        for p in range(l):
+            right = cells[l-p-1][s+p+1]
+            if not right:
+                continue
+            for B in cells[p][s]:
+                for C in right:
+                    heads = binary.get((B, C))
+                    if heads is None:
+                        continue
+                    entries += heads[0]
+                    mask |= heads[1]
+        if mask:
+            offset = cell_offset(n, width, l, s)
+            buf[offset:offset + width] = mask.to_bytes(width, 'little')
+    return entries
+
+
+def _unlink(block: shared_memory.SharedMemory) -> None:
+    block.close()
+    block.unlink()
+
+
+class ParallelCYK:
+    '''
+    Wavefront parallel CYK backend over a CYKIndex.
+
+    Spans of less than min_span_work cell splits (start positions times
+    split points) are filled in the calling process, the pool would only add
+    its round trips. Back pointers are rebuilt lazily from the final chart,
+    like the numpy engine, only for the cells the trees visit.
+
+    Args:
+        index (CYKIndex): The interned CNF grammar.
+        workers (int): Processes of the pool.
+        min_span_work (int): Cell splits of a span length worth the pool.
+    '''
+
+    def __init__(self, index, workers: int, min_span_work: int) -> None:
+        self.index = index
+        self.workers = workers
+        self.min_span_work = min_span_work
+        self.width = max(1, (len(index.symbols) + 7) // 8)
+
+        triples = encode_rules(index.binary)
+        self.rules_count = len(triples) // 3
+        self.rules = shared_memory.SharedMemory(create=True, size=max(1, len(triples) * 4))
+        self.rules.buf[:len(triples) * 4] = triples.tobytes()
+        weakref.finalize(self, _unlink, self.rules)
+
+    def __spans(self, chart_name: str, n: int, l: int) -> int:
+        '''
+        Fill every cell of span length l, returning its back pointers.
+        '''
+        args = (chart_name, self.rules.name, self.rules_count, n, self.width, l)
+        m = n - l
+        if self.workers <= 1 or m * l < self.min_span_work:
+            return fill_span(*args, 0, m)
+
+        chunks = min(self.workers, m)
+        bounds = [m * k // chunks for k in range(chunks + 1)]
+        pool = executor(self.workers)
+        try:
+            return self.__fill_ranges(pool, args, bounds)
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory), start a new pool and
+            # fill the length again, its cells only read the shorter ones.
+            pool = _restart(self.workers, pool)
+            return self.__fill_ranges(pool, args, bounds)
+
+    def __fill_ranges(self, pool: ProcessPoolExecutor, args: tuple, bounds: list[int]) -> int:
+        futures = [pool.submit(fill_span, *args, start, stop)
+                   for start, stop in zip(bounds, bounds[1:])]
+        # The barrier: the next length reads every cell of this one.
+        return sum(future.result() for future in futures)
+
+    def chart(self, I: list[str], budget=None) -> bytes:
+        '''
+        Fill the bitset chart for the tokens I.
+
+        If a Budget is given, the back pointers of each span length are
+        counted on it once the length is filled.
+        '''
+        n = len(I)
+        width = self.width
+        size = n * (n + 1) // 2 * width
+        block = shared_memory.SharedMemory(create=True, size=max(1, size))
+        try:
+            entries = 0
+            for s in range(n):
+                ids = self.index.lexicon.get(I[s], ())
+                mask = 0
+                for A in ids:
+                    mask |= 1 << A
+                offset = cell_offset(n, width, 0, s)
+                block.buf[offset:offset + width] = mask.to_bytes(width, 'little')
+                entries += len(ids)
+            if budget is not None:
+                budget.add_chart_entries(entries)
+
+            for l in range(1, n):
+                entries = self.__spans(block.name, n, l)
+                if budget is not None:
+                    budget.add_chart_entries(entries)
+            return bytes(block.buf[:size])
+        finally:
+            release()
+            _unlink(block)
+
+    def fill(self, I: list[str], budget=None):
+        '''
+        Fill the chart for the tokens I.
+
+        Returns the same (P, back) pair as CYKIndex.fill, as lazy charts
+        computed from the bitsets on access.
+        '''
+        chart = self.chart(I, budget)
+        n = len(I)
+        width = self.width
+        symbols = self.index.symbols
+        binary = self.index.binary
+
+        def ids(l: int, s: int) -> tuple[int, ...]:
+            offset = cell_offset(n, width, l, s)
+            return mask_ids(int.from_bytes(chart[offset:offset + width], 'little'))
+
+        def cell(l: int, s: int) -> set[str]:
+            return {symbols[A] for A in ids(l, s)}
+
+        def cell_back(l: int, s: int) -> list[tuple]:
+            if l == 0:
+                return [(0, 0, s, symbols[A]) for A in ids(0, s)]
+            pointers = []
+            for p in range(l):
+                right = ids(l-p-1, s+p+1)
+                if not right:
+                    continue
+                for B in ids(p, s):
+                    for C in right:
+                        for A in binary.get((B, C), ()):
+                            pointers.append(
+                                (l, p, s, symbols[A], symbols[B], symbols[C]))
+            return pointers
+
+        return LazyChart(n, cell), LazyChart(n, cell_back)
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from collections import defaultdict
+from src.analysis import EPSILON, nullable_symbols
+import time
+
+
+class EarleyParser:
+    '''
+    Earley recognizer and parser working directly on the original grammar.
+
+    No CNF transformation is needed, so the parsing cost follows the size of
+    the grammar the user wrote. Nullable non-terminals are handled with the
+    Aycock-Horspool prediction rule.
+
+    Args:
+        productions (dict[str, set[tuple[str]]]): The grammar productions, as read.
+        non_terminals (set[str]): The non-terminal symbols.
+        initial_symbol (str): The start symbol.
+    '''
+
+    def __init__(self, productions: dict, non_terminals: set[str], initial_symbol: str) -> None:
+        self.initial_symbol = initial_symbol
+        self.non_terminals = set(non_terminals) | set(productions)
+        self.rules: list[tuple[str, tuple[str]]] = []
+        self.by_lhs: dict[str, list[int]] = defaultdict(list)
+        for non_terminal in sorted(productions):
+            for rule in sorted(productions[non_terminal]):
+                rhs = tuple(symbol for symbol in rule if symbol != EPSILON)
+                self.by_lhs[non_terminal].append(len(self.rules))
+                self.rules.append((non_terminal, rhs))
+        self.nullables = nullable_symbols(productions)
+
+    def parse(self, I: list[str], budget=None) -> EarleyForest:
+        '''
+        Run the Earley recognizer over the tokens I.
+
+        If a Budget is given, the items of each Earley set are counted on it
+        as chart entries once the set is complete.
+        '''
+        rules = self.rules
+        non_terminals = self.non_terminals
+        nullables = self.nullables
+        n = len(I)
+
+        start_time = time.perf_counter()
+
+        # completed[(A, i, j)]: rules of A deriving I[i:j].
+        completed: dict[tuple, set[int]] = defaultdict(set)
+        chart: list[set[tuple]] = [set() for _ in range(n + 1)]
+        waiting: list[dict[str, list[tuple]]] = [defaultdict(list)
+                                                 for _ in range(n + 1)]
+
+        def add(j: int, item: tuple, agenda: list) -> None:
+            if item in chart[j]:
+                return
+            chart[j].add(item)
+            r, dot, _ = item
+            rhs = rules[r][1]
+            if dot < len(rhs):
+                waiting[j][rhs[dot]].append(item)
+            if agenda is not None:
+                agenda.append(item)
+
+        for r in self.by_lhs.get(self.initial_symbol, ()):
+            add(0, (r, 0, 0), None)
+
+        for j in range(n + 1):
+            agenda = list(chart[j])
+            while agenda:
+                r, dot, origin = agenda.pop()
+                A, rhs = rules[r]
+                if dot == len(rhs):
+                    # Complete
+                    if r in completed[(A, origin, j)]:
+                        continue
+                    completed[(A, origin, j)].add(r)
+                    for waiting_r, waiting_dot, waiting_origin in list(waiting[origin][A]):
+                        add(j, (waiting_r, waiting_dot + 1,
+                            waiting_origin), agenda)
+                    continue
+                X = rhs[dot]
+                if X in non_terminals:
+                    # Predict
+                    for predicted in self.by_lhs.get(X, ()):
+                        add(j, (predicted, 0, j), agenda)
+                    if X in nullables:
+                        add(j, (r, dot + 1, origin), agenda)
+                elif j < n and I[j] == X:
+                    # Scan
+                    add(j + 1, (r, dot + 1, origin), None)
+            if budget is not None:
+                budget.add_chart_entries(len(chart[j]))
+
+        end_time = time.perf_counter()
+        return EarleyForest(self, I, completed, end_time - start_time)
+
+
+class EarleyForest:
+    '''
+    Packed parse forest of an Earley parse, in terms of the original grammar.
+
+    Nodes are (A, i, j) triples, the non-terminal A deriving I[i:j]. Each
+    derivation is a tuple of children: nodes, (k,) for the token I[k] and ()
+    for an ϵ. A tree never has the same node twice on a path from its root,
+    the derivations closing a unit or ϵ cycle are left out on each path, so
+    the counts and trees are finite.
+
+    It has the same interface as ParseForest: is_in, took, count, trees and
+    release_trees.
+    '''
+
+    def __init__(self, parser: EarleyParser, I: list[str], completed: dict, took: float) -> None:
+        self.parser = parser
+        self.I = I
+        self.n = len(I)
+        self.took = took
+        self.completed = completed
+        self.cells = len(completed)
+        self.root = (parser.initial_symbol, 0, self.n)
+        self.is_in = self.root in completed
+        self.ends: dict[tuple, list[int]] = defaultdict(list)
+        for A, i, j in completed:
+            self.ends[(A, i)].append(j)
+        self.__derivations: dict[tuple, list[tuple]] = {}
+        # By (node, path) key, see __path_derivations.
+        self.__keyed: dict[tuple, list[tuple]] = {}
+        self.__counts: dict[tuple, int] = {}
+
+    def __splits(self, rhs: tuple, j: int):
+        '''
+        Yield every way of matching rhs against the tokens, from a start to j.
+        '''
+        I = self.I
+        non_terminals = self.parser.non_terminals
+
+        def splits(t: int, k: int):
+            if t == len(rhs):
+                if k == j:
+                    yield ()
+                return
+            X = rhs[t]
+            if X in non_terminals:
+                for m in self.ends.get((X, k), ()):
+                    if m <= j:
+                        for rest in splits(t + 1, m):
+                            yield ((X, k, m),) + rest
+            elif k < j and I[k] == X:
+                for rest in splits(t + 1, k + 1):
+                    yield ((k,),) + rest
+
+        return splits
+
+    def derivations(self, node: tuple) -> list[tuple]:
+        if node not in self.__derivations:
+            A, i, j = node
+            derivations = []
+            for r in sorted(self.completed.get(node, ())):
+                rhs = self.parser.rules[r][1]
+                if not rhs:
+                    derivations.append(((),))
+                    continue
+                derivations.extend(self.__splits(rhs, j)(0, i))
+            self.__derivations[node] = derivations
+        return self.__derivations[node]
+
+    def __path_derivations(self, key: tuple) -> list[tuple]:
+        '''
+        The derivations of a (node, path) key with no child on the path, the
+        nodes above it with its span. Each child node is given as its own
+        key, whose path goes on only while the span stays the same: a node
+        of a shorter span never derives one of a longer one, so only these
+        can close a cycle.
+        '''
+        if key not in self.__keyed:
+            node, path = key
+            path = path | {node}
+            kept = []
+            for derivation in self.derivations(node):
+                if any(len(child) == 3 and child in path for child in derivation):
+                    continue
+                kept.append(tuple((child, path if child[1:] == node[1:] else frozenset())
+                                  if len(child) == 3 else child for child in derivation))
+            self.__keyed[key] = kept
+        return self.__keyed[key]
+
+    def count(self, node: tuple = None) -> int:
+        '''
+        Number of (cycle free) parse trees under a node, the root by default.
+
+        Counted by dynamic programming over the (node, path) keys, see
+        __path_derivations, so no tree is lost to the order nodes are visited.
+        '''
+        if not self.is_in:
+            return 0
+        return self.__count((node or self.root, frozenset()))
+
+    def __count(self, key: tuple) -> int:
+        counts = self.__counts
+        stack = [key]
+        while stack:
+            current = stack[-1]
+            if current in counts:
+                stack.pop()
+                continue
+            pending = [child for derivation in self.__path_derivations(current)
+                       for child in derivation if len(child) == 2 and child not in counts]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            total = 0
+            for derivation in self.__path_derivations(current):
+                amount = 1
+                for child in derivation:
+                    if len(child) == 2:
+                        amount *= counts[child]
+                total += amount
+            counts[current] = total
+        return counts[key]
+
+    def __choose(self, key: tuple, i: int) -> tuple:
+        '''
+        The children of the i-th parse tree under a (node, path) key, by mixed
+        radix over its derivations: (child key, index) pairs for the nodes,
+        the token (k,) or () for an ϵ otherwise.
+        '''
+        for derivation in self.__path_derivations(key):
+            sizes = [self.__count(child) if len(child) == 2 else 1
+                     for child in derivation]
+            amount = 1
+            for size in sizes:
+                amount *= size
+            if i >= amount:
+                i -= amount
+                continue
+            chosen = []
+            for child, size in zip(derivation, sizes):
+                amount //= size
+                index, i = divmod(i, amount)
+                chosen.append((child, index) if len(child) == 2 else child)
+            return tuple(chosen)
+        raise IndexError('Parse tree index out of range')
+
+    def tree(self, i: int, node: tuple = None, node_id: str = 'n') -> tuple:
+        '''
+        Get the i-th parse tree under a node, see __choose.
+
+        Node ids are paths from the root, so they are unique within a tree.
+        The tree is built with an explicit stack, each subtree is pushed on
+        built once its children are, so deep trees do not recurse.
+        '''
+        key = (node or self.root, frozenset())
+        built = []
+        # (key, i, node_id) to expand into its children, or (label, node_id,
+        # k) to build from the last k subtrees built.
+        stack = [(key, i, node_id)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item[0], str):
+                A, this_id, k = item
+                children = tuple(built[len(built) - k:])
+                del built[len(built) - k:]
+                built.append((A, this_id, children))
+                continue
+            this_key, this_i, this_id = item
+            chosen = self.__choose(this_key, this_i)
+            stack.append((this_key[0][0], this_id, len(chosen)))
+            for t in reversed(range(len(chosen))):
+                child, child_id = chosen[t], f'{this_id}_{t}'
+                if len(child) == 2:
+                    stack.append((*child, child_id))
+                else:
+                    # A leaf, built from no subtrees.
+                    stack.append((self.I[child[0]] if child else EPSILON, child_id, 0))
+        return built[0]
+
+    def release_trees(self) -> None:
+        pass
+
+    def trees(self, k: int = None, start: int = 0, budget=None):
+        '''
+        Yield at most k parse trees (all of them when k is None), lazily,
+        starting at the start-th tree. Each tree is counted on the budget
+        before it is extracted.
+        '''
+        if not self.is_in:
+            return
+        total = self.count()
+        if k is not None:
+            total = min(total, start + k)
+        for i in range(start, total):
+            if budget is not None:
+                budget.add_tree()
+            yield self.tree(i)
@@ -0,0 +1,358 @@
+from __future__ import annotations
+from heapq import heapify, heappop, heappush
+import math
+
+
+class ParseForest:
+    '''
+    Shared packed parse forest built from the CYK back pointers chart.
+
+    Each node is a (l, s, A) triple: the non-terminal A deriving the tokens
+    I[s:s+l+1]. Nodes are shared between all the trees using them and the
+    alternatives of a node are packed in its list of derivations, so the
+    forest is polynomial even when the number of trees is exponential.
+
+    Trees are nested (label, id, children) tuples. Leaves are the tokens, with
+    no children. The ids are the ones the parse tree images always used,
+    str(l) + str(s) + symbol.
+
+    Args:
+        back (list[list[list[tuple]]]): The CYK back pointers chart.
+        I (list[str]): The tokens.
+        initial_symbol (str): The root symbol.
+        took (float): Seconds spent filling the chart.
+    '''
+
+    def __init__(self, back, I: list[str], initial_symbol: str, took: float = 0) -> None:
+        self.back = back
+        self.I = I
+        self.initial_symbol = initial_symbol
+        self.took = took
+        self.n = len(I)
+        self.cells = self.n * (self.n + 1) // 2
+        self.root = (self.n - 1, 0, initial_symbol)
+        self.__derivations: dict[tuple, list[tuple]] = {}
+        self.__counts: dict[tuple, int] = {}
+        self.__trees: dict[tuple, tuple] = {}
+        self.is_in = bool(self.derivations(self.root))
+
+    def derivations(self, node: tuple) -> list[tuple]:
+        '''
+        Get the packed alternatives of a node, as tuples of children nodes.
+
+        A lexical derivation has no children nodes.
+        '''
+        if node not in self.__derivations:
+            l, s, A = node
+            derivations = []
+            for pointer in self.back[l][s]:
+                if pointer[3] != A:
+                    continue
+                if pointer[0] == 0:
+                    derivations.append(())
+                else:
+                    _, p, _, _, B, C = pointer
+                    derivations.append(((p, s, B), (l-p-1, s+p+1, C)))
+            # The same pointer may be stored once per split by some engines.
+            self.__derivations[node] = list(dict.fromkeys(derivations))
+        return self.__derivations[node]
+
+    def count(self, node: tuple = None) -> int:
+        '''
+        Exact number of parse trees under a node (the root by default), by dynamic programming.
+        '''
+        node = node or self.root
+        counts = self.__counts
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if current in counts:
+                stack.pop()
+                continue
+            pending = [child for derivation in self.derivations(current)
+                       for child in derivation if child not in counts]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            total = 0
+            for derivation in self.derivations(current):
+                if not derivation:
+                    total += 1
+                else:
+                    left, right = derivation
+                    total += counts[left] * counts[right]
+            counts[current] = total
+        return counts[node]
+
+    def __choose(self, node: tuple, i: int) -> tuple:
+        '''
+        The subtrees of the i-th parse tree under a node, as (child, index)
+        pairs, () for a lexical derivation.
+        '''
+        for derivation in self.derivations(node):
+            if not derivation:
+                if i == 0:
+                    return ()
+                i -= 1
+                continue
+            left, right = derivation
+            right_count = self.count(right)
+            amount = self.count(left) * right_count
+            if i < amount:
+                return ((left, i // right_count), (right, i % right_count))
+            i -= amount
+        raise IndexError('Parse tree index out of range')
+
+    def tree(self, i: int, node: tuple = None) -> tuple:
+        '''
+        Get the i-th parse tree under a node (the root by default), without enumerating the previous ones.
+
+        Subtrees are memoized, so the trees share their common subtrees. The
+        subtrees are built children first with an explicit stack, so a tree
+        as deep as the sentence is long does not recurse.
+        '''
+        node = node or self.root
+        trees = self.__trees
+        stack = [(node, i)]
+        while stack:
+            key = stack[-1]
+            if key in trees:
+                stack.pop()
+                continue
+            chosen = self.__choose(*key)
+            pending = [child for child in chosen if child not in trees]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            l, s, A = key[0]
+            label_id = f'{str(l)+str(s)+A}'
+            if not chosen:
+                word = self.I[s]
+                trees[key] = (A, label_id, ((word, f'{str(0)+str(s)+word}', ()),))
+            else:
+                trees[key] = (A, label_id, tuple(trees[child] for child in chosen))
+        return trees[(node, i)]
+
+    def release_trees(self) -> None:
+        '''
+        Forget the memoized subtrees, to keep memory flat while streaming many trees.
+        '''
+        self.__trees.clear()
+
+    def trees(self, k: int = None, start: int = 0, budget=None):
+        '''
+        Yield at most k parse trees (all of them when k is None), lazily,
+        starting at the start-th tree.
+
+        If a Budget is given, each tree is counted on it before it is
+        extracted, so a run out budget stops the extraction.
+        '''
+        if not self.is_in:
+            return
+        total = self.count()
+        if k is not None:
+            total = min(total, start + k)
+        for i in range(start, total):
+            if budget is not None:
+                budget.add_tree()
+            yield self.tree(i)
+
+
+class WeightedForest:
+    '''
+    Best first view of a ParseForest over weighted rules.
+
+    A tree scores the product of the weights of its rules. The best score
+    of every node (its Viterbi tree) is computed bottom up over the packed
+    forest, then the trees come out best first, the i-th one only when it is
+    asked for: each node keeps the trees found so far and a heap of the next
+    candidates, the successors of the last tree taken (lazy k-best, Huang and
+    Chiang 2005). Getting k trees is polynomial in k and the forest size, no
+    matter how many trees there are. Scores are logarithms, so the long
+    sentences do not underflow.
+
+    It has the same interface as ParseForest: is_in, took, count, trees and
+    release_trees, plus probability.
+
+    Args:
+        forest (ParseForest): The packed forest of the parse.
+        weight (callable): (A, rule) -> weight of a CNF rule, in (0, 1].
+    '''
+
+    def __init__(self, forest: ParseForest, weight) -> None:
+        self.forest = forest
+        self.weight = weight
+        self.I = forest.I
+        self.n = forest.n
+        self.cells = forest.cells
+        self.took = forest.took
+        self.root = forest.root
+        self.is_in = forest.is_in
+        # Per node: the (log weight, children) edges, the trees found best
+        # first as (score, edge, ranks), and the heap of the candidates.
+        self.__edges: dict[tuple, list[tuple]] = {}
+        self.__best: dict[tuple, list[tuple]] = {}
+        self.__candidates: dict[tuple, list[tuple]] = {}
+        self.__seen: dict[tuple, set[tuple]] = {}
+        # The nodes with no more trees than found.
+        self.__exhausted: set[tuple] = set()
+        self.__trees: dict[tuple, tuple] = {}
+        if self.is_in:
+            self.__viterbi()
+
+    def edges(self, node: tuple) -> list[tuple]:
+        '''
+        The derivations of a node as (log weight, children nodes) pairs.
+        '''
+        if node not in self.__edges:
+            l, s, A = node
+            edges = []
+            for derivation in self.forest.derivations(node):
+                if not derivation:
+                    rule = (self.I[s],)
+                else:
+                    rule = (derivation[0][2], derivation[1][2])
+                edges.append((math.log(self.weight(A, rule)), derivation))
+            self.__edges[node] = edges
+        return self.__edges[node]
+
+    def __viterbi(self) -> None:
+        '''
+        The best tree of every node under the root, children first.
+        '''
+        best = self.__best
+        stack = [self.root]
+        while stack:
+            current = stack[-1]
+            if current in best:
+                stack.pop()
+                continue
+            pending = [child for _, children in self.edges(current)
+                       for child in children if child not in best]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            candidates = []
+            for e, (weight, children) in enumerate(self.edges(current)):
+                score = weight + sum(best[child][0][0] for child in children)
+                candidates.append((-score, e, (0,) * len(children)))
+            heapify(candidates)
+            score, e, ranks = heappop(candidates)
+            best[current] = [(-score, e, ranks)]
+            self.__candidates[current] = candidates
+            self.__seen[current] = {(e, ranks) for _, e, ranks in candidates} | {(e, ranks)}
+
+    def __kth(self, node: tuple, k: int) -> tuple | None:
+        '''
+        The k-th best (score, edge, ranks) of a node, None if it has fewer trees.
+
+        Worked out on an explicit stack of (node, rank) goals: the successors
+        of a tree are scored once the trees of the children they use are
+        found, so long sentences do not recurse once per level.
+        '''
+        goals = [(node, k)]
+        while goals:
+            current, rank = goals[-1]
+            best = self.__best[current]
+            if len(best) > rank or current in self.__exhausted:
+                goals.pop()
+                continue
+            # The successors of the last tree taken: the same edge with the
+            # next tree of one of its children.
+            seen = self.__seen[current]
+            _, e, ranks = best[-1]
+            weight, children = self.edges(current)[e]
+            successors = [ranks[:t] + (ranks[t] + 1,) + ranks[t+1:]
+                          for t in range(len(children))]
+            successors = [next_ranks for next_ranks in successors
+                          if (e, next_ranks) not in seen]
+            missing = [(child, child_rank) for next_ranks in successors
+                       for child, child_rank in zip(children, next_ranks)
+                       if len(self.__best[child]) <= child_rank and child not in self.__exhausted]
+            if missing:
+                goals.extend(missing)
+                continue
+            candidates = self.__candidates[current]
+            for next_ranks in successors:
+                seen.add((e, next_ranks))
+                found = [self.__best[child][child_rank]
+                         for child, child_rank in zip(children, next_ranks)
+                         if len(self.__best[child]) > child_rank]
+                if len(found) < len(children):
+                    continue
+                score = weight + sum(item[0] for item in found)
+                heappush(candidates, (-score, e, next_ranks))
+            if not candidates:
+                self.__exhausted.add(current)
+                continue
+            score, e, ranks = heappop(candidates)
+            best.append((-score, e, ranks))
+        best = self.__best[node]
+        return best[k] if len(best) > k else None
+
+    def count(self, node: tuple = None) -> int:
+        return self.forest.count(node)
+
+    def probability(self, i: int = 0) -> float:
+        '''
+        The score of the i-th best parse tree, the product of its rule weights.
+        '''
+        found = self.__kth(self.root, i) if self.is_in else None
+        if found is None:
+            raise IndexError('Parse tree index out of range')
+        return math.exp(found[0])
+
+    def tree(self, i: int = 0, node: tuple = None) -> tuple:
+        '''
+        Get the i-th best parse tree under a node (the root by default).
+
+        Built children first with an explicit stack, like ParseForest.tree.
+        '''
+        node = node or self.root
+        trees = self.__trees
+        stack = [(node, i)]
+        while stack:
+            key = stack[-1]
+            if key in trees:
+                stack.pop()
+                continue
+            found = self.__kth(*key)
+            if found is None:
+                raise IndexError('Parse tree index out of range')
+            _, e, ranks = found
+            chosen = tuple(zip(self.edges(key[0])[e][1], ranks))
+            pending = [child for child in chosen if child not in trees]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            l, s, A = key[0]
+            label_id = f'{str(l)+str(s)+A}'
+            if not chosen:
+                word = self.I[s]
+                trees[key] = (A, label_id, ((word, f'{str(0)+str(s)+word}', ()),))
+            else:
+                trees[key] = (A, label_id, tuple(trees[child] for child in chosen))
+        return trees[(node, i)]
+
+    def release_trees(self) -> None:
+        self.__trees.clear()
+
+    def trees(self, k: int = None, start: int = 0, budget=None):
+        '''
+        Yield at most k parse trees (all of them when k is None), best first,
+        starting at the start-th one. Each tree is counted on the budget
+        before it is extracted.
+        '''
+        if not self.is_in:
+            return
+        total = self.count()
+        if k is not None:
+            total = min(total, start + k)
+        for i in range(start, total):
+            if budget is not None:
+                budget.add_tree()
+            yield self.tree(i)
@@ -1,45 +1,377 @@
 from __future__ import annotations
 from collections import defaultdict
-from graphviz import Digraph
-import copy
+from functools import lru_cache
+from src.analysis import best_empty_weights, best_unit_pairs, generating_symbols, nullable_symbols, \
+    reachable_symbols, unit_pairs
+from src.budget import Budget
+from src.cyk import CYKIndex
+from src.earley import EarleyParser
+from src.forest import ParseForest, WeightedForest
+from src.tree_format import TREE_OUTPUTS, format_trees
+from src.utils.constants import CYK_PARALLEL_MIN_TOKENS
+from sys import intern
+import math
+import re
 import time
 
+CYK_ENGINES = ('naive', 'indexed', 'numpy', 'parallel')
+CNF_MODES = ('classic', 'linear')
+PARSERS = ('cyk', 'earley', 'viterbi')
+
+# Optional weight at the end of a rule, NP -> DET N [0.7]. Any other text in
+# brackets is symbols, S -> [ S ] | a.
+WEIGHT_REGEX = re.compile(r' \[([0-9.eE+-]+)\]$')
+
+
+@lru_cache(maxsize=1 << 16)
+def is_non_terminal(symbol: str) -> bool:
+    '''
+    Check if the symbol contains just upper case letters and numbers.
+
+    Cached, since the CNF passes classify the same symbols many times.
+    '''
+    if len(symbol) == 1:
+        return symbol.isupper()
+
+    return all(character.isupper() or character.isnumeric() for character in symbol)
+
+
+def parse_with_index(index: CYKIndex, string: str, engine: str = 'indexed', budget: Budget = None) -> ParseForest:
+    '''
+    Parse the string with the 'indexed', 'numpy' or 'parallel' engine of a
+    CYK index. The 'parallel' engine parses the sentences shorter than
+    CYK_PARALLEL_MIN_TOKENS with the 'indexed' one.
+    '''
+    I = string.split(' ')
+    if budget is not None:
+        budget.check_tokens(len(I))
+
+    if engine == 'numpy':
+        try:
+            chart_engine = index.numpy()
+        except ImportError as error:
+            raise ValueError(
+                'The numpy CYK engine requires numpy to be installed') from error
+    elif engine == 'parallel' and len(I) >= CYK_PARALLEL_MIN_TOKENS:
+        chart_engine = index.parallel()
+    else:
+        chart_engine = index
+
+    start_time = time.perf_counter()
+    _, back = chart_engine.fill(I, budget)
+    end_time = time.perf_counter()
+    return ParseForest(back, I, index.symbols[index.initial], end_time - start_time)
+
+
+def recognize_with_index(index: CYKIndex, string: str, budget: Budget = None) -> tuple[bool, float]:
+    '''
+    Tell whether the string is in the language with the bitset recognizer of
+    a CYK index, without back pointers nor trees.
+
+    Returns whether it is, and the seconds the recognizer took.
+    '''
+    I = string.split(' ')
+    if budget is not None:
+        budget.check_tokens(len(I))
+
+    start_time = time.perf_counter()
+    is_in = index.recognizer().recognize(I, budget)
+    return is_in, time.perf_counter() - start_time
+
+
+def keep_weight(weights: dict, non_terminal: str, rule: tuple[str], weight: float) -> None:
+    '''
+    Keep the best weight of a rule derived in more than one way.
+
+    Each pass reads the weights of the rules it replaces from the grammar
+    and keeps the ones of the rules it makes in a new weights dict.
+    '''
+    if weight > weights.get((non_terminal, rule), 0.0):
+        weights[(non_terminal, rule)] = weight
+
+
+def copy_weights(weights: dict, source: dict, non_terminal: str, rules) -> None:
+    '''
+    Keep the weights of a rule set a pass leaves unchanged.
+    '''
+    for rule in rules:
+        if (non_terminal, rule) in source:
+            weights[(non_terminal, rule)] = source[(non_terminal, rule)]
+
+
+def e_free_rules(non_terminal: str, rules, nullables: set[str], source: dict, empty: dict = None,
+                 weights: dict = None, check=None):
+    '''
+    The rules of a non-terminal without its e-transitions, the same set when
+    it has nothing to omit.
+
+    Each rule is replaced by every non empty variant omitting some of its
+    nullable non-terminals, weighing the rule times the best weight of
+    deriving ϵ from each symbol it omits.
+
+    Args:
+        source (dict): The weights of the rules, by (non-terminal, rule).
+        empty (dict): The best weight of deriving ϵ from each nullable.
+        weights (dict): Where the weights of the new rules are kept, None
+            when the grammar has no weights.
+        check (callable): Called with the number of rules made after each
+            rule with nullable symbols.
+    '''
+    from itertools import product
+
+    if ('ϵ',) not in rules and all(nullables.isdisjoint(rule) for rule in rules):
+        # Nothing to omit, keep the set.
+        if weights is not None:
+            copy_weights(weights, source, non_terminal, rules)
+        return rules
+    this_rules = set()
+    for rule in rules:
+        if rule == ('ϵ',):
+            continue
+        if nullables.isdisjoint(rule):
+            this_rules.add(rule)
+            if weights is not None:
+                keep_weight(weights, non_terminal, rule,
+                            source.get((non_terminal, rule), 1.0))
+            continue
+        # Each nullable symbol may be kept or omitted.
+        options = [((symbol,), ()) if symbol in nullables else ((symbol,),)
+                   for symbol in rule]
+        for choice in product(*options):
+            combination = tuple(
+                symbol for part in choice for symbol in part)
+            if combination:
+                this_rules.add(combination)
+                if weights is not None:
+                    weight = source.get((non_terminal, rule), 1.0)
+                    for symbol, part in zip(rule, choice):
+                        if not part:
+                            weight *= empty[symbol]
+                    keep_weight(weights, non_terminal, combination, weight)
+        if check is not None:
+            check(len(this_rules))
+    return this_rules
+
+
+def non_unit_rules(rules, non_terminals):
+    '''
+    The rules that are not unit productions, the same set if there are none.
+    '''
+    unary = {rule for rule in rules if len(
+        rule) == 1 and rule[0] in non_terminals}
+    return rules - unary if unary else rules
+
+
+def unit_free_rules(non_terminal: str, targets, no_unary_productions: dict, source: dict,
+                    pairs: dict = None, weights: dict = None):
+    '''
+    The rules of a non-terminal without unit productions: the non unit rules
+    of every B such that A =>* B by unit productions.
+
+    Each rule of B weighs the best unit chain from A to B (pairs) times
+    its own weight.
+    '''
+    if len(targets) == 1:
+        # Just (A, A).
+        rules = no_unary_productions[non_terminal]
+        if weights is not None:
+            copy_weights(weights, source, non_terminal, rules)
+        return rules
+    rules = set()
+    for target in targets:
+        if target in no_unary_productions:
+            rules |= no_unary_productions[target]
+            if weights is not None:
+                for rule in no_unary_productions[target]:
+                    keep_weight(weights, non_terminal, rule,
+                                pairs[target] * source.get((target, rule), 1.0))
+    return rules
+
+
+def binarize(rule: tuple[str], productions: dict, suffixes: dict[tuple[str], str], names) -> tuple[str]:
+    '''
+    Shorten a rule to two symbols, adding the suffix non-terminals it needs.
+
+    Args:
+        rule (tuple[str]): The rule to shorten.
+        productions (dict): Where the new suffix productions are added.
+        suffixes (dict[tuple[str], str]): The non-terminal of each suffix already added.
+        names (Iterator[str]): The new non-terminal names.
+    '''
+    if len(rule) <= 2:
+        return rule
+    # From the shortest suffix, so a suffix only reuses shorter ones.
+    tail = rule[-2:]
+    for start in range(len(rule) - 2, 0, -1):
+        suffix = rule[start:]
+        if suffix not in suffixes:
+            suffixes[suffix] = next(names)
+            productions[suffixes[suffix]].add(tail)
+        tail = (rule[start - 1], suffixes[suffix])
+    return tail
+
+
+def chumsky_productions(productions: dict, prefix: str, source: dict, weights: dict = None) -> defaultdict:
+    '''
+    The TERM and BIN steps of the classic CNF pipeline, on rules without
+    e-transitions nor unit productions.
+
+    New non-terminals are numbered prefix + 0, prefix + 1, ... from a single
+    counter: first the lifted terminals, in sorted order, then the shared
+    suffixes of the long rules.
+
+    Args:
+        productions (dict): The rules by non-terminal.
+        prefix (str): The prefix of the new non-terminals.
+        source (dict): The weights of the rules, by (non-terminal, rule).
+        weights (dict): Where the weights of the new rules are kept, None
+            when the grammar has no weights.
+    '''
+    from itertools import count
+
+    names = (f'{prefix}{index}' for index in count())
+
+    # 1. Replace terminals in the right side of the productions by new non-terminals.
+    # Just if the terminal is not alone in the right side of the production.
+    used = {symbol for rules in productions.values() for rule in rules
+            if len(rule) > 1 for symbol in rule if not is_non_terminal(symbol)}
+    lifted = {terminal: next(names) for terminal in sorted(used)}
+
+    # The new non-terminals go after the original ones.
+    chumsky = defaultdict(set, {non_terminal: set()
+                                for non_terminal in productions})
+    for terminal, non_terminal in lifted.items():
+        chumsky[non_terminal].add((terminal,))
+
+    # 2. Replace productions with more than 2 symbols, sorted so the names
+    # are deterministic.
+    # A -> X1 X2 ... Xn becomes A -> X1 N1, N1 -> X2 N2, ..., Nn-2 -> Xn-1 Xn
+    # where each distinct suffix X2 ... Xn gets one non-terminal shared by
+    # every rule ending with it.
+    # The rules made for the lifted terminals and the suffixes weigh 1.
+    suffixes = {}
+    for non_terminal in sorted(productions):
+        rules = productions[non_terminal]
+        if all(len(rule) == 1 or (len(rule) == 2 and lifted.keys().isdisjoint(rule)) for rule in rules):
+            # Already in CNF, keep the set.
+            chumsky[non_terminal] = rules
+            if weights is not None:
+                copy_weights(weights, source, non_terminal, rules)
+            continue
+        for rule in sorted(rules):
+            weight = source.get((non_terminal, rule), 1.0)
+            if len(rule) > 1:
+                rule = tuple(lifted.get(symbol, symbol) for symbol in rule)
+            rule = binarize(rule, chumsky, suffixes, names)
+            chumsky[non_terminal].add(rule)
+            if weights is not None:
+                keep_weight(weights, non_terminal, rule, weight)
+    return chumsky
+
 
 class Grammar:
     '''
     Grammar class
 
+    The rules are tuples of symbols, with the symbols and the rules interned
+    when read: a word listed under many non-terminals is one string and one
+    (word,) tuple. The productions as read are kept in original_productions
+    as frozensets, shared with the CNF productions while a pass leaves them
+    unchanged, so the lexical rules of a large vocabulary are stored once.
+
+    A rule may end with a weight in (0, 1], NP -> DET N [0.7], 1 when it has
+    none. The weights are kept in weights by (non-terminal, rule), only for
+    the rules that have one, and CNF() carries them to the rules it derives:
+    each CNF rule weighs the best derivation it stands for, so the best tree
+    of the CNF grammar is the best tree of the grammar read.
+
     Args: 
-        lines (list[str]): The lines of the grammar file.    
+        lines (Iterable[str]): The lines of the grammar file, or a reader yielding them.    
     '''
 
     def __init__(self, lines: list[str], initial_symbol: str = None, prefix: str = None) -> None:
         self.non_terminals: set[str] = set()
         self.nullables: set[str] = set()
         self.terminals: set[str] = set()
-        self.production_terminals = defaultdict(set)
-        self.production_non_terminals = defaultdict(set)
         self.productions = defaultdict(set)
+        self.weights: dict[tuple[str, tuple[str]], float] = {}
         self.initial_symbol: str = initial_symbol
         self.prefix: str = prefix
+        self.__cyk_index: CYKIndex = None
+        self.__earley: EarleyParser = None
         self.__transform_lines(lines)
 
-    def CNF(self) -> None:
+    def CNF(self, mode: str = 'classic', timings: dict = None, budget: Budget = None, incremental=None) -> None:
         '''
         Transform the grammar to Chumsky Normal Form.
+
+        Args:
+            mode (str): One of CNF_MODES. 'classic' removes the e-transitions
+                first (DEL, UNIT, useless symbols, TERM, BIN), which may add an
+                exponential number of rules. 'linear' runs TERM, BIN, DEL and
+                UNIT in this order, so the e-transitions are removed on binary
+                rules and the grammar grows only linearly.
+            timings (dict): If given, the seconds spent on each phase are
+                stored in it, by phase name.
+            budget (Budget): If given, its deadline and CNF rules limit are
+                checked after each phase and while removing the e-transitions.
+            incremental (IncrementalCNF): If given, the 'classic' CNF is
+                recomputed from the last grammar it compiled, only for the
+                non-terminals affected by what changed since.
         '''
-        self.__remove_e_transitions()
-        self.__remove_unary_productions()
-        self.__remove_useless_symbols()
-        self.__to_chumsky_normal_form()
+        if mode not in CNF_MODES:
+            raise ValueError(
+                f'Unknown CNF mode {mode!r}, expected one of {CNF_MODES}')
+
+        self.__cyk_index = None
+        if mode == 'classic' and incremental is not None:
+            compiled = incremental.compile(self, timings, budget)
+            if compiled is not None:
+                self.productions, self.weights, self.non_terminals, self.terminals, self.nullables = compiled
+                return
+
+        if mode == 'linear':
+            phases = [('binary_rules', self.__to_binary_rules),
+                      ('binary_e_transitions', self.__remove_binary_e_transitions),
+                      ('unary_productions', self.__remove_unary_productions),
+                      ('useless_symbols', self.__remove_useless_symbols),
+                      ('map_rules', self.__remap)]
+        else:
+            phases = [('e_transitions', lambda: self.__remove_e_transitions(budget)),
+                      ('unary_productions', self.__remove_unary_productions),
+                      ('useless_symbols', self.__remove_useless_symbols),
+                      ('chumsky_normal_form', self.__to_chumsky_normal_form)]
+
+        for name, phase in phases:
+            start_time = time.perf_counter()
+            phase()
+            if timings is not None:
+                timings[name] = time.perf_counter() - start_time
+            if budget is not None:
+                budget.check_cnf_rules(
+                    sum(len(rules) for rules in self.productions.values()))
+
+        if self.weights:
+            # Forget the weights of the rules replaced by the passes.
+            self.weights = {(non_terminal, rule): weight for (non_terminal, rule), weight in self.weights.items()
+                            if rule in self.productions.get(non_terminal, ())}
+
+    def rule_weight(self, non_terminal: str, rule: tuple[str]) -> float:
+        '''
+        The weight of a rule, 1 when it has none.
+        '''
+        return self.weights.get((non_terminal, rule), 1.0)
 
     def __str__(self) -> str:
         output = f'initial symbol := {self.initial_symbol}\n'
         output += f'new symbols prefix := {self.prefix}\n'
         for production, rules in self.productions.items():
             rules_str = ''
-            for rule in rules:
+            for rule in sorted(rules):
                 symbol_str = ' '.join(symbol for symbol in rule)
+                weight = self.rule_weight(production, rule)
+                if weight != 1:
+                    symbol_str += f' [{weight:g}]'
                 rules_str += f'{symbol_str} | '
             output += f'{production} -> {rules_str[:-3]}\n'
         return output[:-1]
@@ -48,78 +380,121 @@ class Grammar:
         if isinstance(other, Grammar):
             return self.non_terminals == other.non_terminals and \
                 self.terminals == other.terminals and \
-                self.productions == other.productions
+                self.productions == other.productions and \
+                self.weights == other.weights
         return False
 
+    @property
+    def production_terminals(self) -> dict[str, set[str]]:
+        '''
+        The terminals (and ϵ) used by the rules of each non-terminal.
+        '''
+        return self.__production_symbols(False)
+
+    @property
+    def production_non_terminals(self) -> dict[str, set[str]]:
+        '''
+        The non-terminals used by the rules of each non-terminal.
+        '''
+        return self.__production_symbols(True)
+
+    def __production_symbols(self, non_terminals: bool) -> dict[str, set[str]]:
+        symbols = defaultdict(set)
+        for non_terminal, rules in self.productions.items():
+            for symbol in set().union(*rules):
+                if is_non_terminal(symbol) == non_terminals:
+                    symbols[non_terminal].add(symbol)
+        return symbols
+
     def __clean(self) -> None:
         '''
         Clean the grammar references set utils.
         '''
 
         self.non_terminals.clear()
-        self.production_non_terminals.clear()
         self.nullables.clear()
         self.terminals.clear()
-        self.production_terminals.clear()
+
+    def __remap(self) -> None:
+        '''
+        Rebuild the terminals and non-terminals sets from the productions.
+        '''
+        self.__clean()
+        for non_terminal, rules in self.productions.items():
+            self.__map_rules(non_terminal, rules)
 
     def __map_rules(self, non_terminal: str, rules: set[tuple[str]]) -> None:
         '''
         Map the rule set to the terminals and non-terminals sets.
         '''
-        def contains_just_upper_and_numeric(symbol: str) -> bool:
-            '''
-            Check if the symbol contains just upper case letters and numbers.
-            '''
-            if len(symbol) == 1:
-                return symbol.isupper()
-
-            return all(character.isupper() or character.isnumeric() for character in symbol)
-
         self.non_terminals.add(non_terminal)
 
-        for rule in rules:
-            # Add each symbol to the terminals or non-terminals set.
-            for symbol in rule:
-                if contains_just_upper_and_numeric(symbol):
-                    self.non_terminals.add(symbol)
-                    self.production_non_terminals[non_terminal] |= set(
-                        (symbol,))
-                else:
-                    if symbol == 'ϵ':
-                        self.nullables.add(non_terminal)
-                    self.terminals.add(symbol)
-                    self.production_terminals[non_terminal] |= set(
-                        (symbol,))
+        symbols = set().union(*rules)
+        if 'ϵ' in symbols:
+            self.nullables.add(non_terminal)
+        # Add each symbol not seen yet to the terminals or non-terminals set.
+        for symbol in symbols.difference(self.non_terminals, self.terminals):
+            if is_non_terminal(symbol):
+                self.non_terminals.add(symbol)
+            else:
+                self.terminals.add(symbol)
 
     def __transform_lines(self, lines) -> list[str]:
         '''
         Transform the received lines into productions. Each line have been already validated.
 
         Args:
-            lines (list[str]): The lines of the grammar file.
+            lines (Iterable[str]): The lines of the grammar file, or a reader yielding them.
         '''
         def procedural_prefix(non_terminals: set[str], k: int = 3) -> str:
             '''
-            Generate a random letters prefix checking it not exist on terminals
+            Generate a deterministic letters prefix checking no non-terminal starts with it.
+
+            Candidates are tried in lexicographic order (AA, AB, ...), so the same
+            grammar always gets the same prefix and therefore the same CNF output.
             '''
-            from random import choices
+            from itertools import product
             from string import ascii_uppercase
 
-            prefix = ''.join(choices(ascii_uppercase, k=k))
-            while prefix in non_terminals:
-                prefix = ''.join(choices(ascii_uppercase, k=k))
-
-            return prefix
-
-        # Divide each line by non-terminal -> rule | rule | ...
-        productions = [line.split('->') for line in lines]
-
-        for production in productions:
+            while True:
+                for letters in product(ascii_uppercase, repeat=k):
+                    prefix = ''.join(letters)
+                    if not any(symbol.startswith(prefix) for symbol in non_terminals):
+                        return prefix
+                k += 1
+
+        def rule_weight(non_terminal: str, rule: tuple[str], text: str) -> float:
+            try:
+                weight = float(text)
+            except ValueError:
+                weight = math.nan
+            if not 0 < weight <= 1:
+                raise ValueError(
+                    f'The weight of {non_terminal} -> {" ".join(rule)} must be a number in (0, 1], got {text!r}')
+            return weight
+
+        # The same rule under many non-terminals is kept once.
+        interned_rules: dict[tuple[str], tuple[str]] = {}
+
+        # The lines are consumed one at a time, they may come from a reader.
+        for line in lines:
+            # Divide the line by non-terminal -> rule | rule | ...
+            head, _, body = line.partition('->')
             # Remove the spaces from the non-terminal.
-            this_non_terminal = production[0].strip()
+            this_non_terminal = intern(head.strip())
             # Split the rules string by the pipe symbol. And then group the symbols in a tuple.
-            rules = {tuple(rule.strip().split(' '))
-                     for rule in production[1].split('|')}
+            rules = set()
+            for rule in body.split('|'):
+                rule = rule.strip()
+                weight = WEIGHT_REGEX.search(rule) if rule.endswith(']') else None
+                if weight is not None:
+                    rule = rule[:weight.start()].strip()
+                rule = tuple(map(intern, rule.split(' ')))
+                rule = interned_rules.setdefault(rule, rule)
+                rules.add(rule)
+                if weight is not None:
+                    keep_weight(self.weights, this_non_terminal, rule,
+                                rule_weight(this_non_terminal, rule, weight.group(1)))
 
             # Add the non-terminal to the productions dictionary.
             self.productions[this_non_terminal] |= rules
@@ -132,303 +507,213 @@ class Grammar:
         if not self.prefix:
             self.prefix = procedural_prefix(self.non_terminals, 2)
 
-    def __remove_e_transitions(self):
-        '''
-        Remove the e-transitions from the grammar.
-        '''
-        from itertools import combinations
-
-        def get_combinations(production, non_dynamic: set[str]):
-
-            combinations_set = set()
-            n = len(production)
-
-            non_dynamic_len = sum(
-                element in non_dynamic for element in production)
-
-            for i in range(1, n+1):
-                for comb in combinations(production, i):
-                    comb_non_dynamic_len = sum(
-                        element in non_dynamic for element in comb)
-                    if non_dynamic_len == comb_non_dynamic_len:
-                        combinations_set.add(comb)
-
-            return combinations_set
-
-        BREAK_INF_LOOP = False
-        nullables_history = set()
+        # Keep the grammar as read. CNF() replaces the rule sets it changes
+        # and shares the others, so they are frozen.
+        self.original_productions = {non_terminal: frozenset(rules)
+                                     for non_terminal, rules in self.productions.items()}
+        self.productions = defaultdict(set, self.original_productions)
+        self.original_non_terminals = set(self.non_terminals)
 
-        while self.nullables and not BREAK_INF_LOOP:
-            for nullable_non_terminal in self.nullables.copy():
-                # For each production that contains the nullable non-terminal.
-                for non_terminal, non_terminals in self.production_non_terminals.items():
-                    if BREAK_INF_LOOP:
-                        break
-
-                    if nullable_non_terminal in non_terminals:
-                        # Get the productions that contains the nullable non-terminal and have the nullable non-terminal.
-                        productions_with_nullable = {
-                            production for production in self.productions[non_terminal] if nullable_non_terminal in production}
-
-                        for production in productions_with_nullable:
-                            if len(production) == 1 and non_terminal != nullable_non_terminal:
-                                # Add the nullable non-terminal to the production.
-                                self.productions[non_terminal] |= {('ϵ',)}
-
-                                self.nullables.add(non_terminal)
-                                nullables_history.add(non_terminal)
-
-                                if len(nullables_history) == len(self.productions):
-                                    BREAK_INF_LOOP = True
-                                continue
-
-                            # Get the combinations of the production without the nullable non-terminal.
-                            non_dynamic = set(
-                                production) - {nullable_non_terminal}
-
-                            combinations_set = get_combinations(
-                                production, non_dynamic)
-
-                            # Add the combinations to the production.
-                            self.productions[non_terminal] |= combinations_set
-
-                if BREAK_INF_LOOP:
-                    for nullable in self.nullables:
-                        self.productions[nullable] -= {('ϵ',)}
-                    break
+    def __remove_e_transitions(self, budget: Budget = None):
+        '''
+        Remove the e-transitions from the grammar, see e_free_rules.
 
-                # Remove the non-terminal from the nullables set.
-                self.nullables.remove(nullable_non_terminal)
-                # Quit ϵ from the production.
-                self.productions[nullable_non_terminal] -= {('ϵ',)}
+        That is exponential in the nullable symbols of a rule, so the budget
+        is checked after each rule.
+        '''
+        nullables = nullable_symbols(self.productions)
+        weights = {} if self.weights else None
+        empty = None
+        if weights is not None:
+            empty = best_empty_weights(
+                self.productions, nullables, self.rule_weight)
+
+        produced = 0
+        check = None
+        if budget is not None:
+            def check(count: int) -> None:
+                budget.check_cnf_rules(produced + count)
+        for non_terminal, rules in self.productions.items():
+            this_rules = e_free_rules(non_terminal, rules, nullables, self.weights,
+                                      empty, weights, check)
+            produced += len(this_rules)
+            if this_rules is rules:
+                if budget is not None:
+                    budget.check_cnf_rules(produced)
+                continue
+            self.productions[non_terminal] = this_rules
+
+        if weights is not None:
+            self.weights = weights
+        self.nullables.clear()
 
     def __remove_unary_productions(self):
         '''
-        Remove the unary productions from the grammar.
+        Remove the unary productions from the grammar, see unit_free_rules.
         '''
-        # Filter and get only the unary productions for each production
-        unary_productions = {production: {rule for rule in rules if len(
-            rule) == 1 and rule[0] in self.non_terminals} for production, rules in self.productions.items()}
-        # Get no unary productions the same way.
-        no_unary_productions = {productions: {rule for rule in rules if len(
-            rule) != 1 or rule[0] not in self.non_terminals} for productions, rules in self.productions.items()}
-
-        # For dynamic programming store the already get pairs.
-        pairs = set()
-
-        def induction(pair: tuple[str, str]):
-            '''
-            Create the pairs of the unary productions.
-            '''
-            if pair in pairs:
-                return
-
-            if pair[0] in unary_productions:
-                pairs.add(pair)
-
-            if pair[1] not in unary_productions:
-                return
-
-            # Get the unary productions of the second element of the pair.
-            unary_productions_second = unary_productions[pair[1]]
-
-            # Check if there is no unary productions.
-            if not unary_productions_second:
-                return
-
-            #  Create new pairs using them as the second element and pair[0] as the first element.
-            new_pairs = [(pair[0], unary_production[0])
-                         for unary_production in unary_productions_second]
-
-            # Repeat the induction for each new pair.
-            for pair in new_pairs:
-                induction(pair)
-
-        # Generate the initial pairs, with it selves.
-        base = list(zip(self.non_terminals, self.non_terminals))
-
-        # Repeat the induction for each pair.
-        for pair in base:
-            induction(pair)
+        # Get no unary productions for each production, the same set if it has none.
+        no_unary_productions = {non_terminal: non_unit_rules(rules, self.non_terminals)
+                                for non_terminal, rules in self.productions.items()}
 
         self.simplified_productions = defaultdict(set)
 
-        # For each pair, create a new production [pair[0] -> no_unary_productions[pair[1]]]
-        for pair in pairs:
-            if pair[1] in no_unary_productions:
-                self.simplified_productions[pair[0]
-                                            ] |= no_unary_productions[pair[1]]
+        # For each unit pair (A, B), create a new production [A -> no_unary_productions[B]]
+        # weighing the best unit chain from A to B times the rule of B.
+        weights = {} if self.weights else None
+        pairs = {}
+        if weights is not None:
+            pairs = best_unit_pairs(
+                self.productions, self.non_terminals, self.rule_weight)
+        for non_terminal, targets in unit_pairs(self.productions, self.non_terminals).items():
+            self.simplified_productions[non_terminal] = unit_free_rules(
+                non_terminal, targets, no_unary_productions, self.weights, pairs.get(non_terminal), weights)
 
         self.productions = self.simplified_productions
+        if weights is not None:
+            self.weights = weights
 
     def __remove_useless_symbols(self):
         '''
         Remove the useless symbols from the grammar.
         '''
-        def remove_non_terminal_from_production(this_non_terminal: str):
-            '''
-            Remove the non-terminal from the production that contains it.
-            '''
-            for non_terminal, rules in self.productions.items():
-                self.productions[non_terminal] -= {
-                    rule for rule in rules if this_non_terminal in rule}
-
         self.__clean()
         for non_terminal, rules in self.productions.items():
             self.__map_rules(non_terminal, rules)
 
-        # 1. Remove symbols that dont produce anything.
-        generative_productions = set()
-        for this_non_terminal in self.non_terminals:
-            # Check if the current non-terminal have any rule.
-
-            # Remove the non-terminal from any production that contains it.
-            if this_non_terminal not in self.productions:
-                remove_non_terminal_from_production(this_non_terminal)
-
-            else:
-                composed_just_terminals_productions = {
-                    rule for rule in self.productions[this_non_terminal] if all(symbol in self.terminals for symbol in rule)}
-                if composed_just_terminals_productions:
-                    generative_productions.add(this_non_terminal)
-
-        non_in_generative_productions = self.non_terminals - generative_productions
-
-        # Check if it has a non-terminal that is in generative productions. Maybe on many transitions down.
-        checked = set()
-
-        def go_deep(this_non_terminal: str, non_in_generative: str):
-            for non_terminal in self.production_non_terminals[this_non_terminal]:
-                if non_terminal not in checked:
-                    checked.add(non_terminal)
-                    if non_terminal in generative_productions:
-                        generative_productions.add(non_in_generative)
-                    else:
-                        go_deep(non_terminal, non_in_generative)
-
-        for non_terminal in non_in_generative_productions:
-            checked = set()
-            checked.add(non_terminal)
-            go_deep(non_terminal, non_terminal)
-
-        # Remove the non-terminals that dont produce anything based on the generative productions.
-        for this_non_terminal in self.non_terminals:
-            if this_non_terminal not in generative_productions or this_non_terminal not in self.productions:
-                # Remove the non-terminal from the production that contains it.
-                remove_non_terminal_from_production(this_non_terminal)
-
-        self.__clean()
+        # 1. Remove the rules using symbols that dont produce anything.
+        generative = generating_symbols(self.productions, self.non_terminals)
+        useless = self.non_terminals - generative
         for non_terminal, rules in self.productions.items():
-            self.__map_rules(non_terminal, rules)
+            if any(not useless.isdisjoint(rule) for rule in rules):
+                self.productions[non_terminal] = {
+                    rule for rule in rules if useless.isdisjoint(rule)}
 
         # 2. Remove symbols that are not reachable by the initial symbol.
-        reachable_non_terminals: set[str] = set()
-
-        def induction(non_terminal: str):
-            '''
-            Induction to get the reachable non-terminals.
-            '''
-            if non_terminal in reachable_non_terminals:
-                return
-
-            reachable_non_terminals.add(non_terminal)
-
-            if non_terminal not in self.production_non_terminals:
-                return
-
-            for production_non_terminal in self.production_non_terminals[non_terminal]:
-                induction(production_non_terminal)
-
-        induction(self.initial_symbol)
-        unreachable_non_terminals = self.non_terminals - reachable_non_terminals
-
-        # Remove the unreachable non-terminals from self.productions.
-        for unreachable_non_terminal in unreachable_non_terminals:
-            self.productions.pop(unreachable_non_terminal)
+        reachable = reachable_symbols(self.productions, self.initial_symbol)
+        for non_terminal in list(self.productions):
+            if non_terminal not in reachable:
+                self.productions.pop(non_terminal)
 
     def __to_chumsky_normal_form(self):
         '''
-        Transform the grammar to Chumsky Normal Form.
+        Transform the grammar to Chumsky Normal Form, see chumsky_productions.
         '''
+        weights = {} if self.weights else None
+        self.productions = chumsky_productions(
+            self.productions, self.prefix, self.weights, weights)
+        if weights is not None:
+            self.weights = weights
         self.__clean()
         for non_terminal, rules in self.productions.items():
             self.__map_rules(non_terminal, rules)
 
-        # 1. Replace terminals in the right side of the productions by new non-terminals.
-        # Just if the terminal is not alone in the right side of the production.
-        index = 0
-
-        for i, terminal in enumerate(self.terminals):
-            used = False
-            for non_terminal, rules in self.productions.items():
-                # Just for the rule in rules that contains the terminal, but not alone, replace with a prefix + i.
-                this_rules = {
-                    tuple(map(
-                        lambda symbol: self.prefix +
-                        str(i) if symbol == terminal else symbol,
-                        rule
-                    )) for rule in rules if terminal in rule and isinstance(rule, tuple) and len(rule) > 1}
-
-                if this_rules:
-                    used = True
-                    self.productions[non_terminal] -= {
-                        rule for rule in rules if terminal in rule and isinstance(rule, tuple) and len(rule) > 1}
-                    self.productions[non_terminal] |= this_rules
-
-            if used:
-                index += 1
-                self.productions[self.prefix + str(i)] |= {(terminal,)}
-
-        # 2. Replace productions with more than 2 non-terminals by new non-terminals.
-        # Just if the production is not already in the Chumsky Normal Form. (len(rule) > 2)
-
-        # Non in chumsky normal form: nCNF
-        nCNF: set(tuple[str]) = set()  # len(rule) > 2
-
-        for non_terminal, rules in self.productions.items():
-            nCNF |= {
-                rule for rule in rules if len(rule) > 2 and isinstance(rule, tuple)}
-
-        # Start transforming A -> Bk1 Bk2 ... Bkn to A -> Bk1 C1, C1 -> Bk2 C2, ..., Cn-2 -> Bkn-1 Bkn
-
-        nCNF = list(nCNF)
-        nCNF_initial: list[tuple[str]] = nCNF
-
-        nCNF = list(zip(
-            nCNF, [None]*len(nCNF)))
+    def __to_binary_rules(self):
+        '''
+        TERM and BIN steps of the linear CNF pipeline.
 
-        for i, rule in enumerate(nCNF):
-            transformed_rule = rule[0]
-            while len(transformed_rule) > 2 and isinstance(transformed_rule, tuple):
-                last_two = transformed_rule[-2:]
+        Terminals in rules of more than one symbol are replaced by a new
+        non-terminal each, then every rule longer than two symbols is split in
+        a chain of new non-terminals, A -> X1 N1, N1 -> X2 N2, ..., shared by
+        the rules ending with the same symbols, so each rule adds at most as
+        many rules as it has symbols.
+        '''
+        from itertools import count
 
-                index += 1
+        names = (f'{self.prefix}{index}' for index in count())
+        lifted: dict[str, str] = {}
+        suffixes: dict[tuple[str], str] = {}
+        binary_productions = defaultdict(set)
+        weights = {} if self.weights else None
 
-                transformed_rule = transformed_rule[:-
-                                                    2] + (self.prefix + str(index),)
+        for non_terminal, rules in self.productions.items():
+            for rule in sorted(rules):
+                weight = self.rule_weight(non_terminal, rule)
+                if len(rule) > 1:
+                    this_rule = []
+                    for symbol in rule:
+                        if symbol in self.terminals and symbol != 'ϵ':
+                            if symbol not in lifted:
+                                lifted[symbol] = next(names)
+                                binary_productions[lifted[symbol]] |= {
+                                    (symbol,)}
+                            symbol = lifted[symbol]
+                        this_rule.append(symbol)
+                    rule = tuple(this_rule)
+
+                # The head goes before its new suffix non-terminals.
+                binary_rules = binary_productions[non_terminal]
+                rule = binarize(
+                    rule, binary_productions, suffixes, names)
+                binary_rules.add(rule)
+                if weights is not None:
+                    keep_weight(weights, non_terminal, rule, weight)
+
+        self.productions = binary_productions
+        if weights is not None:
+            self.weights = weights
+        self.__clean()
+        for non_terminal, rules in self.productions.items():
+            self.__map_rules(non_terminal, rules)
 
-                self.productions[f'{self.prefix}{index}'] |= {last_two}
+    def __remove_binary_e_transitions(self):
+        '''
+        DEL step of the linear CNF pipeline, on rules of at most two symbols.
 
-            nCNF[i] = (rule[0], transformed_rule)
+        A binary rule A -> B C gets at most the two variants A -> C (B
+        nullable) and A -> B (C nullable), instead of every subset of a long
+        right side.
+        '''
+        nullables = nullable_symbols(self.productions)
+        weights = {} if self.weights else None
+        if weights is not None:
+            empty = best_empty_weights(
+                self.productions, nullables, self.rule_weight)
 
-        # Replace the old rule by the new rule in the rules of productions.
         for non_terminal, rules in self.productions.items():
-            this_rules = {
-                nCNF[nCNF_initial.index(rule)][1] for rule in rules if rule in nCNF_initial}
-            if this_rules:
-                self.productions[non_terminal] -= {
-                    rule for rule in rules if rule in nCNF_initial}
-                self.productions[non_terminal] |= this_rules
+            this_rules = set()
+            for rule in rules:
+                if rule == ('ϵ',):
+                    continue
+                this_rules.add(rule)
+                if weights is not None:
+                    weight = self.rule_weight(non_terminal, rule)
+                    keep_weight(weights, non_terminal, rule, weight)
+                if len(rule) == 2:
+                    B, C = rule
+                    if B in nullables:
+                        this_rules.add((C,))
+                        if weights is not None:
+                            keep_weight(
+                                weights, non_terminal, (C,), weight * empty[B])
+                    if C in nullables:
+                        this_rules.add((B,))
+                        if weights is not None:
+                            keep_weight(
+                                weights, non_terminal, (B,), weight * empty[C])
+            # A -> A adds nothing to the language.
+            this_rules.discard((non_terminal,))
+            self.productions[non_terminal] = this_rules
+
+        if weights is not None:
+            self.weights = weights
 
         self.__clean()
         for non_terminal, rules in self.productions.items():
             self.__map_rules(non_terminal, rules)
 
-    def CYK(self, string: str, index: int = 0, folder: str = './', web=False):
+    def cyk_index(self) -> CYKIndex:
         '''
-        CYK algorithm implementation.
+        Get the interned CYK index of the grammar, built once per CNF grammar.
+        '''
+        if self.__cyk_index is None:
+            self.__cyk_index = CYKIndex(self)
+        return self.__cyk_index
 
-        Reference: https://en.wikipedia.org/wiki/CYK_algorithm
+    def __naive_chart(self, I: list[str], budget: Budget = None):
+        '''
+        Fill the CYK chart scanning every rule of every non-terminal for each cell.
+
+        Kept as the reference engine for differential testing.
         '''
         # Not part of the original algorithm, but and adaptation to the problem.
         unary_productions = {production: {rule for rule in rules if len(
@@ -438,10 +723,6 @@ class Grammar:
         sorted_productions.remove(self.initial_symbol)
         sorted_productions.insert(0, self.initial_symbol)
 
-        # let the input be a string I consisting of n characters: a1 ... an.
-        # split by spaces
-        I = string.split(' ')
-
         # let the grammar contain r non terminal symbols R1 ... Rr, with start symbol R1.
         R = self.productions
 
@@ -456,8 +737,6 @@ class Grammar:
         back = [[[] for _ in range(n)]
                 for _ in range(n)]
 
-        start_time = time.perf_counter()
-
         for s in range(n):
             a_s = I[s]
             for A in sorted_productions:
@@ -467,6 +746,9 @@ class Grammar:
                         P[0][s].append(A)
                         back[0][s].append((0, 0, s, A))
 
+        if budget is not None:
+            budget.add_chart_entries(sum(len(cell) for cell in back[0]))
+
         for l in range(1, n):
             for s in range(n-l):
                 for p in range(l):
@@ -478,127 +760,132 @@ class Grammar:
                                 if B in P[p][s] and C in P[l-p-1][s+p+1]:
                                     P[l][s].append(A)
                                     back[l][s].append((l, p, s, A, B, C))
+                if budget is not None:
+                    budget.add_chart_entries(len(back[l][s]))
+
+        return P, back
+
+    def earley_parser(self) -> EarleyParser:
+        '''
+        Get the Earley parser of the original (not CNF) grammar, built once.
+        '''
+        if self.__earley is None:
+            self.__earley = EarleyParser(
+                self.original_productions, self.original_non_terminals, self.initial_symbol)
+        return self.__earley
+
+    def parse(self, string: str, engine: str = 'indexed', parser: str = 'cyk', budget: Budget = None):
+        '''
+        Parse the string and pack its parse trees in a forest.
+
+        Args:
+            string (str): The sentence, tokens separated by spaces.
+            engine (str): The chart engine, one of CYK_ENGINES. 'naive' scans
+                every rule for each cell, 'indexed' uses the interned CYKIndex
+                and 'numpy' fills each span length with vectorized operations,
+                rebuilding the back pointers only when the trees are drawn.
+                'parallel' splits each span length of long sentences across
+                a process pool sharing the chart.
+            parser (str): One of PARSERS. 'cyk' parses with the CNF grammar,
+                'earley' with the original one, and its trees use only the
+                user's own non-terminals. The engine is ignored for 'earley'.
+                'viterbi' parses like 'cyk' and returns a WeightedForest, the
+                trees best first by the rule weights. 'earley' ignores them.
+            budget (Budget): If given, the tokens and chart entries are
+                checked against it, and its deadline while filling the chart.
+        '''
+        if parser not in PARSERS:
+            raise ValueError(
+                f'Unknown parser {parser!r}, expected one of {PARSERS}')
+        if parser == 'earley':
+            I = string.split(' ')
+            if budget is not None:
+                budget.check_tokens(len(I))
+            return self.earley_parser().parse(I, budget)
+        if parser == 'viterbi':
+            return WeightedForest(self.parse(string, engine, 'cyk', budget), self.rule_weight)
+
+        if engine not in CYK_ENGINES:
+            raise ValueError(
+                f'Unknown CYK engine {engine!r}, expected one of {CYK_ENGINES}')
+
+        if engine != 'naive':
+            return parse_with_index(self.cyk_index(), string, engine, budget)
+
+        # let the input be a string I consisting of n characters: a1 ... an.
+        # split by spaces
+        I = string.split(' ')
+        if budget is not None:
+            budget.check_tokens(len(I))
 
+        start_time = time.perf_counter()
+        _, back = self.__naive_chart(I, budget)
         end_time = time.perf_counter()
-        took = end_time - start_time
-        is_in = None
+        return ParseForest(back, I, self.initial_symbol, end_time - start_time)
+
+    def recognize(self, string: str, budget: Budget = None) -> tuple[bool, float]:
+        '''
+        Tell whether the string is in the language, see recognize_with_index.
+        '''
+        return recognize_with_index(self.cyk_index(), string, budget)
+
+    def CYK(self, string: str, index: int = 0, folder: str = './', web=False, engine: str = 'indexed', trees: bool = True, max_trees: int = None, output: str = 'images', parser: str = 'cyk'):
+        '''
+        CYK algorithm implementation.
+
+        Reference: https://en.wikipedia.org/wiki/CYK_algorithm
+
+        Args:
+            engine (str): The chart engine, one of CYK_ENGINES.
+            trees (bool): Whether to draw the parse trees. When False only the
+                membership is computed.
+            max_trees (int): Draw at most this many parse trees, all when None.
+            output (str): One of TREE_OUTPUTS. 'json' and 'bracketed' return
+                (or print) the trees as nested objects or bracketed strings,
+                built from the chart without graphviz nor dot.
+            parser (str): 'cyk', or 'viterbi' to get the trees best first
+                by the rule weights, see parse.
+        '''
+        if output not in TREE_OUTPUTS:
+            raise ValueError(
+                f'Unknown trees output {output!r}, expected one of {TREE_OUTPUTS}')
+        if parser not in ('cyk', 'viterbi'):
+            raise ValueError(
+                f'Unknown parser {parser!r}, expected cyk or viterbi')
+        forest = self.parse(string, engine, parser)
+        took = forest.took
+        is_in = forest.is_in
         if not web:
-            if self.initial_symbol in P[n-1][0]:
-                print(f'w = {string} is in L(G). (took {took} seconds)')
+            if is_in:
+                print(
+                    f'w = {string} is in L(G), {forest.count()} parse trees. (took {took} seconds)')
+                if parser == 'viterbi':
+                    print(f'Best parse tree probability {forest.probability():g}')
             else:
                 print(f'w = {string} is NOT in L(G). (took {took} seconds)')
                 return
-        else:
-            if self.initial_symbol in P[n-1][0]:
-                is_in = True
-            else:
-                is_in = False
-                return is_in, [], took
-
-        attributes = {
-            'rankdir': 'TB',
-            'labelloc': 'b',
-            'fontname': 'Helvetica'
-        }
-        digraphs = []
-
-        def draw_trees(element, digraph):
-            l_A, p, s, A, b_A, c_A = element
-
-            B = back[p][s]
-            C = back[l_A-p-1][s+p+1]
-
-            s_A = s
-
-            counter = 0
-            duplicated_digraph = None
-            for b in B:
-                if b[0] == 0 and b[3] == b_A:
-                    l, p, s, _b = b
-                    digraph.node(f'{str(l)+str(s)+_b}', label=f'{_b}')
-                    digraph.edge(f'{str(l_A)+str(s_A)+A}',
-                                 f'{str(l)+str(s)+_b}')
-                    # with no border
-                    digraph.node(
-                        f'{str(l)+str(s)+I[s]}', label=f'{I[s]}', shape='none')
-                    digraph.edge(f'{str(l)+str(s)+_b}',
-                                 f'{str(l)+str(s)+I[s]}')
-                elif b[0] != 0 and b[3] == b_A:
-                    l, p, s, _b, _b_a, _b_b = b
-                    if counter > 0:
-                        digraphs.append(duplicated_digraph)
-                        duplicated_digraph.node(
-                            f'{str(l)+str(s)+_b}', label=f'{_b}')
-                        duplicated_digraph.edge(
-                            f'{str(l_A)+str(s_A)+A}', f'{str(l)+str(s)+_b}')
-                        draw_trees(b, duplicated_digraph)
-                    else:
-                        duplicated_digraph = copy.deepcopy(digraph)
-                        digraph.node(f'{str(l)+str(s)+_b}', label=f'{_b}')
-                        digraph.edge(f'{str(l_A)+str(s_A)+A}',
-                                     f'{str(l)+str(s)+_b}')
-                        draw_trees(b, digraph)
-                        counter += 1
-
-            counter = 0
-            duplicated_digraph = None
-            for c in C:
-                if c[0] == 0 and c[3] == c_A:
-                    l, p, s, _c = c
-                    digraph.node(f'{str(l)+str(s)+_c}', label=f'{_c}')
-                    digraph.edge(f'{str(l_A)+str(s_A)+A}',
-                                 f'{str(l)+str(s)+_c}')
-                    digraph.node(
-                        f'{str(l)+str(s)+I[s]}', label=f'{I[s]}', shape='none')
-                    digraph.edge(f'{str(l)+str(s)+_c}',
-                                 f'{str(l)+str(s)+I[s]}')
-                elif c[0] != 0 and c[3] == c_A:
-                    l, p, s, _c, _c_a, _c_b = c
-                    if counter > 0:
-                        # Create a new digraph based on the previous one, including all the nodes and edges.
-
-                        digraphs.append(duplicated_digraph)
-                        duplicated_digraph.node(
-                            f'{str(l)+str(s)+_c}', label=f'{_c}')
-                        duplicated_digraph.edge(
-                            f'{str(l_A)+str(s_A)+A}', f'{str(l)+str(s)+_c}')
-                        draw_trees(c, duplicated_digraph)
-                    else:
-                        duplicated_digraph = copy.deepcopy(digraph)
-                        digraph.node(
-                            f'{str(l)+str(s)+_c}', label=f'{_c}')
-                        digraph.edge(
-                            f'{str(l_A)+str(s_A)+A}', f'{str(l)+str(s)+_c}')
-                        draw_trees(c, digraph)
-                        counter += 1
-
-        for top in back[n-1][0]:
-            if top[0] == 0 and top[3] == self.initial_symbol:
-                l, p, s, A = top
-                digraph = Digraph(graph_attr=attributes)
-                digraphs.append(digraph)
-                digraph.node(f'{str(l)+str(s)+A}', label=f'{A}')
-                digraph.node(
-                    f'{str(l)+str(s)+I[s]}', label=f'{I[s]}', shape='none')
-                digraph.edge(f'{str(l)+str(s)+A}',
-                             f'{str(l)+str(s)+I[s]}')
-
-            elif top[0] != 0 and top[3] == self.initial_symbol:
-                l, p, s, A, b_A, c_A = top
-                digraph = Digraph(graph_attr=attributes)
-                digraphs.append(digraph)
-                digraph.node(f'{str(l)+str(s)+A}', label=f'{A}')
-                draw_trees(top, digraph)
+        elif not is_in or not trees:
+            return is_in, [], took
+
+        if output != 'images':
+            formatted = format_trees(forest.trees(max_trees), output)
+            if web:
+                return is_in, formatted, took
+            for tree in formatted:
+                print(tree)
+            return
+
+        from src.render import render, tree_sources
+
+        sources = tree_sources(forest.trees(max_trees))
 
         if not web:
             save_on = f'{folder}parse_tree_{index}_'
-            for i, digraph in enumerate(digraphs):
-                digraph.render(f'{save_on}{i}',
-                               format='png', cleanup=True)
+            for i, image in enumerate(render(sources, format='png')):
+                with open(f'{save_on}{i}.png', 'wb') as file:
+                    file.write(image)
                 print(f'Parse tree {i} saved on {save_on}{i}.png')
         else:
-            images = []
-            for digraph in digraphs:
-                images.append(digraph.pipe(format='svg'))
+            images = render(sources, format='svg')
 
             return is_in, images, took
@@ -0,0 +1,81 @@
+'''
+Single pass grammar reader.
+
+The lines of a grammar, from a file or a request body, are normalized and
+validated one at a time against the rule pattern, compiled once, and handed
+to the Grammar builder as they come, nothing is kept in between.
+'''
+from __future__ import annotations
+from typing import Iterable, Iterator
+import re
+
+from src.utils.constants import regex_str
+
+RULE_REGEX = re.compile(regex_str)
+
+# Malformed lines kept in the error, the rest are only counted.
+MAX_REPORTED_LINES = 10
+
+
+class GrammarSyntaxError(ValueError):
+    '''
+    Malformed lines of a grammar, reported with their line numbers.
+
+    Args:
+        errors (list[tuple[int, str]]): The first malformed lines, (number, line).
+        count (int): Every malformed line.
+    '''
+
+    def __init__(self, errors: list[tuple[int, str]], count: int) -> None:
+        self.errors = errors
+        self.count = count
+        lines = '; '.join(f'line {number}: {line!r}' for number, line in errors)
+        more = f' and {count - len(errors)} more' if count > len(errors) else ''
+        super().__init__(f'Malformed grammar, expected N -> x y | z on each line, got {lines}{more}')
+
+    def __reduce__(self):
+        # Raised in the pool workers, rebuilt from the lines in the parent.
+        return type(self), (self.errors, self.count)
+
+
+def normalize_line(line: str) -> str:
+    '''
+    Collapse the whitespace around `->`, `|` and between symbols to a single space.
+    '''
+    return ' '.join(line.replace('->', ' -> ', 1).replace('|', ' | ').split())
+
+
+def read_grammar(lines: Iterable[str]) -> Iterator[str]:
+    '''
+    Normalize and validate grammar lines, yielding them one by one.
+
+    Blank lines are skipped. The malformed lines are collected and raised
+    together as a GrammarSyntaxError once the lines are exhausted, so the
+    grammar being built from them is dropped.
+
+    Args:
+        lines (Iterable[str]): The lines of the grammar, with or without newlines.
+    '''
+    errors = []
+    count = 0
+    match = RULE_REGEX.fullmatch
+    for number, line in enumerate(lines, 1):
+        if not line or line.isspace():
+            continue
+        normalized = normalize_line(line)
+        if match(normalized) is None:
+            count += 1
+            if len(errors) < MAX_REPORTED_LINES:
+                errors.append((number, line.strip()))
+            continue
+        yield normalized
+    if count:
+        raise GrammarSyntaxError(errors, count)
+
+
+def read_grammar_file(file_path: str) -> Iterator[str]:
+    '''
+    Read a grammar file lazily, line by line, see read_grammar.
+    '''
+    with open(file_path, 'r', encoding='utf-8') as file:
+        yield from read_grammar(file)
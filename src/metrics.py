@@ -0,0 +1,139 @@
+from __future__ import annotations
+from bisect import bisect_left
+from threading import Lock
+
+
+def format_labels(names: tuple[str], values: tuple[str], extra: str = '') -> str:
+    '''
+    Format label values as a Prometheus label set, {name="value",...}.
+    '''
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Monotonic counter, one value per label values.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labels (tuple[str]): The label names.
+    '''
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple[str], float] = {}
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(
+                    f'{self.name}{format_labels(self.labels, key)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    '''
+    Cumulative histogram, one set of buckets per label values.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        buckets (tuple[float]): The bucket upper bounds, in increasing order.
+        labels (tuple[str]): The label names.
+        clamp_sum (bool): Add at most the largest bucket bound to the sum, for
+            values that may not fit in a float (parse tree counts), so a
+            single one does not turn the sum into +Inf for good.
+    '''
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float], labels: tuple[str] = (), clamp_sum: bool = False) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.labels = labels
+        self.sum_limit = self.buckets[-2] if clamp_sum and buckets else float('inf')
+        # Per label values: the count of each bucket (not cumulative), the sum.
+        self.values: dict[tuple[str], tuple[list[int], float]] = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        try:
+            value = float(value)
+        except OverflowError:
+            # Parse tree counts may not fit in a float.
+            value = float('inf')
+        with self.lock:
+            counts, total = self.values.get(
+                key, ([0] * len(self.buckets), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + min(value, self.sum_limit))
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = format_labels(
+                        self.labels, key, f'le="{format_value(bound)}"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.labels, key)
+                lines.append(
+                    f'{self.name}_sum{labels} {format_value(float(total))}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    The metrics of the server, rendered in the Prometheus text format.
+    '''
+
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def counter(self, name: str, documentation: str, labels: tuple[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labels)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float], labels: tuple[str] = (), clamp_sum: bool = False) -> Histogram:
+        histogram = Histogram(name, documentation, buckets, labels, clamp_sum)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+def exponential_buckets(start: float, factor: float, count: int) -> tuple[float]:
+    return tuple(start * factor ** i for i in range(count))
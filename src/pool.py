@@ -0,0 +1,138 @@
+from __future__ import annotations
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+import multiprocessing
+
+
+class QueueFull(Exception):
+    '''
+    Raised when a job is submitted to a WorkerPool with no free slot.
+    '''
+
+
+class WorkerPool:
+    '''
+    Process pool with bounded admission, for the CPU bound work of requests.
+
+    At most workers jobs run and queue_depth more wait for a worker. Submitting
+    past that raises QueueFull at once, so an overloaded server answers fast
+    instead of piling up requests. Workers are started with spawn, never
+    forked from the threaded server, and replaced after max_tasks_per_child
+    jobs when given.
+
+    Args:
+        workers (int): Worker processes.
+        queue_depth (int): Jobs allowed to wait for a worker.
+        max_tasks_per_child (int): Jobs a worker runs before it is replaced,
+            never replaced when 0 or None.
+    '''
+
+    def __init__(self, workers: int, queue_depth: int, max_tasks_per_child: int = None) -> None:
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.slots = BoundedSemaphore(workers + queue_depth)
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = Lock()
+        self.executor = self.__executor()
+
+    def __executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   max_tasks_per_child=self.max_tasks_per_child)
+
+    def __release(self, _: Future) -> None:
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def __submit(self, fn, args: tuple, kwargs: dict) -> Future:
+        with self.lock:
+            try:
+                return self.executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (killed, out of memory), start a new pool.
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self.__executor()
+                return self.executor.submit(fn, *args, **kwargs)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        '''
+        Submit a job, or raise QueueFull if every slot is taken.
+        '''
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise QueueFull()
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = self.__submit(fn, args, kwargs)
+        except BaseException:
+            self.__release(None)
+            raise
+        future.add_done_callback(self.__release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        '''
+        Run a job on the pool and wait for its result.
+        '''
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'queueDepth': self.queue_depth,
+                'maxTasksPerChild': self.max_tasks_per_child,
+                'inFlight': self.in_flight,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ThreadSlots:
+    '''
+    Bounded admission for the work that runs on the request threads.
+
+    Streams, batches, sessions and registrations compute on the thread of
+    their request, not on a WorkerPool. At most slots of them run at once,
+    entering past that raises QueueFull at once, so they can not take every
+    server thread and starve the pool requests and /healthz.
+
+    Args:
+        slots (int): Requests allowed to run at once.
+    '''
+
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self.semaphore = BoundedSemaphore(slots)
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = Lock()
+
+    def __enter__(self) -> ThreadSlots:
+        if not self.semaphore.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise QueueFull()
+        with self.lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *_) -> None:
+        with self.lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'slots': self.slots,
+                'inFlight': self.in_flight,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,495 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from src.cache import GrammarCache, grammar_key
+from src.cyk import CYKIndex
+from src.grammar_reader import read_grammar
+from threading import Lock
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b'GRMC'
+VERSION = 2
+
+# Sections of a compiled grammar file, in file order. The metadata is the
+# small JSON part, the grammar texts have sections of their own, read only
+# when they are used.
+SECTIONS = ('metadata', 'symbol_offsets', 'symbols', 'terminal_offsets', 'terminals',
+            'lexicon_offsets', 'lexicon_heads', 'binary_keys', 'binary_offsets', 'binary_heads',
+            'line_offsets', 'lines', 'resultant_grammar')
+
+# Magic, version and the (offset, length) of each section.
+HEADER = struct.Struct(f'<4sI{2 * len(SECTIONS)}Q')
+
+EMPTY_KEY = (1 << 64) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+KEY_REGEX = re.compile(r'[0-9a-f]{64}')
+
+
+class UnknownGrammar(KeyError):
+    '''
+    Raised when no grammar is registered with the requested id.
+    '''
+
+
+def pair_slot(key: int, bits: int) -> int:
+    '''
+    First slot of a (B, C) pair key in a table of 2 ** bits slots, by Fibonacci hashing.
+    '''
+    return ((key * HASH_MULTIPLIER) & EMPTY_KEY) >> (64 - bits)
+
+
+def pack_strings(strings: list[str]) -> tuple[array, bytes]:
+    '''
+    Pack strings as an offsets array and one utf-8 blob.
+    '''
+    offsets = array('I', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def write_compiled(path: str, compiled, lines: list[str], cnf_mode: str) -> None:
+    '''
+    Write a compiled grammar to a versioned binary file.
+
+    The file holds the interned symbol table, the lexicon sorted by terminal
+    and the binary rules as an open addressing hash table from the (B, C)
+    pair to its heads, so it can be used mapped in memory without parsing.
+    The grammar lines and the CNF grammar text are kept apart from the JSON
+    metadata, they are only decoded when asked for.
+    All the integers are little endian. The file is written aside and moved
+    in place, so readers never see it half written.
+
+    Args:
+        path (str): The file to write.
+        compiled (CompiledGrammar): The CNF grammar.
+        lines (list[str]): The grammar lines as received.
+        cnf_mode (str): The CNF mode the grammar was compiled with.
+    '''
+    if sys.byteorder != 'little':
+        raise ValueError('Compiled grammar files need a little endian host')
+
+    grammar = compiled.grammar
+    index = grammar.cyk_index()
+
+    metadata = json.dumps({
+        'key': compiled.key,
+        'prefix': grammar.prefix,
+        'initialSymbol': grammar.initial_symbol,
+        'cnfMode': cnf_mode,
+        'sizes': compiled.sizes,
+    }).encode('utf-8')
+    line_offsets, lines_blob = pack_strings(lines)
+
+    symbol_offsets, symbols = pack_strings(index.symbols)
+
+    # Sorted by their utf-8 bytes, the order the readers bisect on.
+    terminals = sorted(index.lexicon, key=lambda terminal: terminal.encode('utf-8'))
+    terminal_offsets, terminals_blob = pack_strings(terminals)
+    lexicon_offsets = array('I', [0])
+    lexicon_heads = array('I')
+    for terminal in terminals:
+        lexicon_heads.extend(sorted(index.lexicon[terminal]))
+        lexicon_offsets.append(len(lexicon_heads))
+
+    # Half full at most, so the linear probing stays short.
+    bits = max(1, (2 * len(index.binary) - 1).bit_length())
+    size = 1 << bits
+    binary_keys = array('Q', [EMPTY_KEY]) * size
+    slot_heads: list[frozenset[int]] = [frozenset()] * size
+    for (B, C), heads in index.binary.items():
+        key = B << 32 | C
+        slot = pair_slot(key, bits)
+        while binary_keys[slot] != EMPTY_KEY:
+            slot = (slot + 1) & (size - 1)
+        binary_keys[slot] = key
+        slot_heads[slot] = heads
+    binary_offsets = array('I', [0])
+    binary_heads = array('I')
+    for heads in slot_heads:
+        binary_heads.extend(sorted(heads))
+        binary_offsets.append(len(binary_heads))
+
+    sections = [metadata, symbol_offsets.tobytes(), symbols, terminal_offsets.tobytes(),
+                terminals_blob, lexicon_offsets.tobytes(), lexicon_heads.tobytes(),
+                binary_keys.tobytes(), binary_offsets.tobytes(), binary_heads.tobytes(),
+                line_offsets.tobytes(), lines_blob, compiled.resultant_grammar.encode('utf-8')]
+
+    # Every section starts 8 bytes aligned.
+    positions = []
+    offset = HEADER.size
+    for section in sections:
+        offset += -offset % 8
+        positions += [offset, len(section)]
+        offset += len(section)
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, *positions))
+        for section, start in zip(sections, positions[::2]):
+            file.write(b'\0' * (start - file.tell()))
+            file.write(section)
+    os.replace(temporary, path)
+
+
+class MappedStrings(Sequence):
+    '''
+    Read only list of the strings of a packed section, decoded on access.
+    '''
+
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Symbol index out of range')
+        if i not in self.decoded:
+            self.decoded[i] = self.raw(i).decode('utf-8')
+        return self.decoded[i]
+
+
+class KeyView(Sequence):
+    '''
+    The raw utf-8 keys of a MappedStrings, for bisect.
+    '''
+
+    def __init__(self, strings: MappedStrings) -> None:
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.strings.raw(i)
+
+
+class MappedLexicon(Mapping):
+    '''
+    Read only terminal -> heads mapping over the sorted terminals section.
+    '''
+
+    def __init__(self, terminals: MappedStrings, offsets: memoryview, heads: memoryview) -> None:
+        self.terminals = terminals
+        self.offsets = offsets
+        self.heads = heads
+        self.keys_view = KeyView(terminals)
+
+    def __getitem__(self, terminal: str) -> tuple[int, ...]:
+        if not isinstance(terminal, str):
+            raise KeyError(terminal)
+        raw = terminal.encode('utf-8')
+        i = bisect_left(self.keys_view, raw)
+        if i == len(self.terminals) or self.terminals.raw(i) != raw:
+            raise KeyError(terminal)
+        return tuple(self.heads[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self):
+        return iter(self.terminals)
+
+    def __len__(self) -> int:
+        return len(self.terminals)
+
+
+class MappedBinary(Mapping):
+    '''
+    Read only (B, C) -> heads mapping over the binary rules hash table.
+    '''
+
+    def __init__(self, keys: memoryview, offsets: memoryview, heads: memoryview) -> None:
+        self.keys = keys
+        self.offsets = offsets
+        self.heads = heads
+        self.bits = len(keys).bit_length() - 1
+        self.mask = len(keys) - 1
+        self.count = None
+
+    def get(self, pair, default=None):
+        B, C = pair
+        key = B << 32 | C
+        keys = self.keys
+        slot = pair_slot(key, self.bits)
+        while True:
+            found = keys[slot]
+            if found == key:
+                return tuple(self.heads[self.offsets[slot]:self.offsets[slot + 1]])
+            if found == EMPTY_KEY:
+                return default
+            slot = (slot + 1) & self.mask
+
+    def __getitem__(self, pair) -> tuple[int, ...]:
+        heads = self.get(pair)
+        if heads is None:
+            raise KeyError(pair)
+        return heads
+
+    def __contains__(self, pair) -> bool:
+        return self.get(pair) is not None
+
+    def __iter__(self):
+        for key in self.keys:
+            if key != EMPTY_KEY:
+                yield (key >> 32, key & 0xFFFFFFFF)
+
+    def items(self):
+        for slot, key in enumerate(self.keys):
+            if key != EMPTY_KEY:
+                yield (key >> 32, key & 0xFFFFFFFF), \
+                    tuple(self.heads[self.offsets[slot]:self.offsets[slot + 1]])
+
+    def __len__(self) -> int:
+        if self.count is None:
+            self.count = sum(1 for _ in self)
+        return self.count
+
+
+class MappedIndex(CYKIndex):
+    '''
+    CYKIndex backed by the sections of a compiled grammar file.
+
+    The lexicon and binary rules are looked up in the mapped file, so the
+    pages are shared by every process mapping it. The heads are tuples
+    instead of frozensets.
+    '''
+
+    def __init__(self, sections: dict[str, memoryview]) -> None:
+        self.symbols = MappedStrings(
+            sections['symbol_offsets'].cast('I'), sections['symbols'])
+        self.lexicon = MappedLexicon(
+            MappedStrings(sections['terminal_offsets'].cast('I'), sections['terminals']),
+            sections['lexicon_offsets'].cast('I'), sections['lexicon_heads'].cast('I'))
+        self.binary = MappedBinary(
+            sections['binary_keys'].cast('Q'), sections['binary_offsets'].cast('I'),
+            sections['binary_heads'].cast('I'))
+        self.initial = 0
+
+    def intern(self, symbol: str) -> int:
+        raise TypeError('A mapped CYK index is read only')
+
+
+class RegisteredGrammar:
+    '''
+    A compiled grammar file mapped in memory.
+
+    It parses like a Grammar: the 'indexed', 'numpy' and 'parallel' CYK
+    engines run on the mapped index, while the 'naive' engine and the Earley
+    parser compile the grammar lines again the first time they are used.
+    The lines and the CNF grammar text are read from the file on access.
+
+    Args:
+        path (str): The compiled grammar file.
+        cache (GrammarCache): Where to compile the grammar when needed.
+    '''
+
+    def __init__(self, path: str, cache: GrammarCache = None) -> None:
+        self.path = path
+        self.cache = cache
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.buffer)
+        if len(view) < HEADER.size:
+            raise ValueError(f'{path} is not a compiled grammar file')
+        magic, version, *positions = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a compiled grammar file')
+        if version != VERSION:
+            raise ValueError(
+                f'{path} has version {version}, expected {VERSION}')
+        if sys.byteorder != 'little':
+            raise ValueError('Compiled grammar files need a little endian host')
+
+        sections = {name: view[offset:offset + length] for name, offset, length
+                    in zip(SECTIONS, positions[::2], positions[1::2])}
+        metadata = json.loads(bytes(sections['metadata']).decode('utf-8'))
+        self.key: str = metadata['key']
+        self.prefix: str = metadata['prefix']
+        self.initial_symbol: str = metadata['initialSymbol']
+        self.cnf_mode: str = metadata['cnfMode']
+        self.sizes: dict[str, int] = metadata.get('sizes', {})
+        self.lines = MappedStrings(
+            sections['line_offsets'].cast('I'), sections['lines'])
+        self.__resultant_grammar = sections['resultant_grammar']
+        self.index = MappedIndex(sections)
+        self.__grammar = None
+
+    @property
+    def resultant_grammar(self) -> str:
+        '''
+        The CNF grammar text, decoded from the file.
+        '''
+        return bytes(self.__resultant_grammar).decode('utf-8')
+
+    def __getstate__(self) -> dict:
+        # Worker processes map the file again instead of receiving its content.
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['path'])
+
+    def grammar(self):
+        '''
+        Get the full CNF Grammar, compiled from the lines on first use.
+        '''
+        if self.__grammar is None:
+            if self.cache is not None:
+                self.__grammar = self.cache.get_or_compile(
+                    self.lines, self.initial_symbol, self.prefix, self.cnf_mode).grammar
+            else:
+                from src.grammar import Grammar
+
+                self.__grammar = Grammar(read_grammar(
+                    self.lines), self.initial_symbol, self.prefix)
+                self.__grammar.CNF(self.cnf_mode)
+        return self.__grammar
+
+    def cyk_index(self) -> MappedIndex:
+        return self.index
+
+    def earley_parser(self):
+        return self.grammar().earley_parser()
+
+    def parse(self, string: str, engine: str = 'indexed', parser: str = 'cyk', budget=None):
+        '''
+        Parse the string like Grammar.parse.
+        '''
+        from src.grammar import CYK_ENGINES, PARSERS, parse_with_index
+
+        if parser not in PARSERS:
+            raise ValueError(
+                f'Unknown parser {parser!r}, expected one of {PARSERS}')
+        if engine not in CYK_ENGINES:
+            raise ValueError(
+                f'Unknown CYK engine {engine!r}, expected one of {CYK_ENGINES}')
+        if parser == 'cyk' and engine != 'naive':
+            return parse_with_index(self.index, string, engine, budget)
+        return self.grammar().parse(string, engine, parser, budget)
+
+    def recognize(self, string: str, budget=None) -> tuple[bool, float]:
+        '''
+        Tell whether the string is in the language, on the mapped index.
+        '''
+        from src.grammar import recognize_with_index
+
+        return recognize_with_index(self.index, string, budget)
+
+    def describe(self) -> dict:
+        return {
+            'grammarId': self.key,
+            'prefix': self.prefix,
+            'initialSymbol': self.initial_symbol,
+            'cnfMode': self.cnf_mode,
+            'initialGrammar': '\n'.join(self.lines),
+            'resultantGrammar': self.resultant_grammar,
+        }
+
+
+class GrammarRegistry:
+    '''
+    Compiled grammars stored as files named by their content hash.
+
+    The id of a grammar is its cache key (see grammar_key), so registering the
+    same grammar twice gives the same id. Files written by another process are
+    picked up on their first use.
+
+    Args:
+        folder (str): Where the compiled grammar files are kept.
+        cache (GrammarCache): Used to compile the grammars.
+    '''
+
+    def __init__(self, folder: str, cache: GrammarCache = None) -> None:
+        self.folder = folder
+        self.cache = cache if cache is not None else GrammarCache()
+        self.entries: dict[str, RegisteredGrammar] = {}
+        self.lock = Lock()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, f'{key}.grm')
+
+    def register(self, lines: list[str], initial_symbol: str = None, prefix: str = None, cnf_mode: str = 'classic') -> RegisteredGrammar:
+        '''
+        Compile a grammar and store it, unless it is already registered.
+        '''
+        key = grammar_key(lines, initial_symbol, prefix, cnf_mode)
+        try:
+            return self.get(key)
+        except UnknownGrammar:
+            pass
+
+        compiled = self.cache.get_or_compile(
+            lines, initial_symbol, prefix, cnf_mode)
+        return self.add(compiled, lines, cnf_mode)
+
+    def add(self, compiled, lines: list[str], cnf_mode: str = 'classic') -> RegisteredGrammar:
+        '''
+        Store a grammar already compiled, unless it is already registered.
+        '''
+        try:
+            return self.get(compiled.key)
+        except UnknownGrammar:
+            pass
+
+        os.makedirs(self.folder, exist_ok=True)
+        write_compiled(self.path(compiled.key), compiled, lines, cnf_mode)
+        return self.get(compiled.key)
+
+    def get(self, key: str) -> RegisteredGrammar:
+        '''
+        Get a registered grammar. Raises UnknownGrammar if there is none with this id.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+            # The id names a file, only hashes are accepted.
+            if not isinstance(key, str) or not KEY_REGEX.fullmatch(key) or \
+                    not os.path.isfile(self.path(key)):
+                raise UnknownGrammar(key)
+            entry = RegisteredGrammar(self.path(key), self.cache)
+            self.entries[key] = entry
+            return entry
+
+    def load(self) -> int:
+        '''
+        Map every compiled grammar file of the folder.
+
+        Files of another format version are skipped. Returns the number of
+        grammars loaded.
+        '''
+        if not os.path.isdir(self.folder):
+            return 0
+        loaded = 0
+        for name in sorted(os.listdir(self.folder)):
+            key, extension = os.path.splitext(name)
+            if extension != '.grm':
+                continue
+            try:
+                self.get(key)
+            except (UnknownGrammar, ValueError):
+                continue
+            loaded += 1
+        return loaded
+
+    def keys(self) -> list[str]:
+        with self.lock:
+            return list(self.entries)
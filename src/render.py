@@ -0,0 +1,109 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+
+GRAPH_ATTRIBUTES = {
+    'rankdir': 'TB',
+    'labelloc': 'b',
+    'fontname': 'Helvetica'
+}
+
+# Bytes closing each rendered graph when dot writes several to one stream.
+GRAPH_TERMINATORS = {
+    'svg': b'</svg>\n',
+    'png': b'IEND\xaeB`\x82',
+}
+
+
+def tree_sources(trees, attributes: dict = GRAPH_ATTRIBUTES) -> list[str]:
+    '''
+    Build the DOT source of each parse tree, byte for byte the one of the
+    graphviz Digraph the trees were drawn on before.
+
+    The source of a subtree depends only on the subtree, so it is built once
+    and reused by every tree sharing it (the forest shares subtree objects).
+
+    Args:
+        trees (iterable): (label, id, children) parse trees.
+        attributes (dict): The graph attributes.
+    '''
+    # Imported here, the json and bracketed trees outputs never load graphviz.
+    from graphviz.quoting import attr_list, quote, quote_edge
+
+    head = f'digraph {{\n\tgraph{attr_list(None, kwargs=attributes)}\n'
+    fragments: dict[int, str] = {}
+
+    def children_source(tree: tuple) -> str:
+        # Pre-order: each child is declared and linked, then its own children drawn.
+        key = id(tree)
+        if key not in fragments:
+            _, parent_id, children = tree
+            lines = []
+            for child in children:
+                child_label, child_id, grandchildren = child
+                shape = {'shape': 'none'} if not grandchildren else None
+                lines.append(
+                    f'\t{quote(child_id)}{attr_list(child_label, kwargs=shape)}\n')
+                lines.append(
+                    f'\t{quote_edge(parent_id)} -> {quote_edge(child_id)}\n')
+                lines.append(children_source(child))
+            fragments[key] = ''.join(lines)
+        return fragments[key]
+
+    sources = []
+    kept = []
+    for tree in trees:
+        # Keep the trees alive so the ids of the fragments stay unique.
+        kept.append(tree)
+        label, node_id, _ = tree
+        sources.append(
+            f'{head}\t{quote(node_id)}{attr_list(label)}\n{children_source(tree)}}}\n')
+    return sources
+
+
+def split_output(output: bytes, format: str) -> list[bytes]:
+    '''
+    Split the output of one dot run over many graphs into one document per graph.
+    '''
+    terminator = GRAPH_TERMINATORS[format]
+    documents = output.split(terminator)
+    # The last piece is whatever follows the last terminator, usually empty.
+    return [document + terminator for document in documents[:-1]]
+
+
+def run_dot(sources: list[str], format: str) -> list[bytes]:
+    '''
+    Render all the sources with a single dot process, fed as one multi-graph input.
+    '''
+    if not sources:
+        return []
+    completed = subprocess.run(['dot', '-Kdot', f'-T{format}'],
+                               input=''.join(sources).encode('utf-8'),
+                               capture_output=True, check=True)
+    documents = split_output(completed.stdout, format)
+    if len(documents) != len(sources):
+        raise RuntimeError(
+            f'dot rendered {len(documents)} graphs out of {len(sources)}')
+    return documents
+
+
+def render(sources: list[str], format: str = 'svg', processes: int = 1) -> list[bytes]:
+    '''
+    Render DOT sources using at most `processes` dot processes in total.
+
+    Args:
+        sources (list[str]): The DOT sources.
+        format (str): The output format, one of GRAPH_TERMINATORS.
+        processes (int): How many dot processes to split the graphs across.
+    '''
+    if format not in GRAPH_TERMINATORS:
+        raise ValueError(f'Unsupported render format {format!r}')
+    processes = max(1, min(processes, len(sources)))
+    if processes == 1:
+        return run_dot(sources, format)
+
+    size = -(-len(sources) // processes)
+    chunks = [sources[i:i+size] for i in range(0, len(sources), size)]
+    with ThreadPoolExecutor(len(chunks)) as pool:
+        rendered = pool.map(lambda chunk: run_dot(chunk, format), chunks)
+    return [document for documents in rendered for document in documents]
@@ -0,0 +1,231 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+import time
+import uuid
+
+
+class ParseSession:
+    '''
+    Incremental left to right CYK chart, kept column by column.
+
+    columns[e][s] holds the non-terminal ids deriving the tokens s..e, so
+    appending a token only fills the new column: the e + 1 cells ending at it,
+    about O(n^2) work instead of rebuilding the whole O(n^3) chart.
+
+    Args:
+        index (CYKIndex): The interned CNF grammar.
+        max_tokens (int): Maximum number of tokens of the session.
+    '''
+
+    def __init__(self, index, max_tokens: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.index = index
+        self.max_tokens = max_tokens
+        self.tokens: list[str] = []
+        self.columns: list[list[frozenset[int]]] = []
+        self.entries = 0
+        # The entries the store counted for the session, see SessionStore.
+        self.counted_entries = 0
+        self.last_used = time.monotonic()
+        # Held while the chart changes, so sessions fill their columns in parallel.
+        self.lock = Lock()
+
+    def append(self, token: str) -> int:
+        '''
+        Append a token filling only the cells that end at it.
+
+        Returns the number of chart entries added.
+        '''
+        if len(self.tokens) >= self.max_tokens:
+            raise ValueError(
+                f'Session reached its limit of {self.max_tokens} tokens')
+
+        binary = self.index.binary
+        columns = self.columns
+        e = len(self.tokens)
+        column: list[frozenset[int]] = [frozenset()] * (e + 1)
+        column[e] = self.index.lexicon.get(token, frozenset())
+
+        # Cells are filled from the shortest span, so the right child is ready.
+        for s in range(e - 1, -1, -1):
+            cell = set()
+            for m in range(s, e):
+                left = columns[m][s]
+                right = column[m + 1]
+                if not left or not right:
+                    continue
+                for B in left:
+                    for C in right:
+                        heads = binary.get((B, C))
+                        if heads is not None:
+                            cell.update(heads)
+            column[s] = frozenset(cell)
+
+        self.tokens.append(token)
+        columns.append(column)
+        added = sum(len(cell) for cell in column)
+        self.entries += added
+        return added
+
+    def extend(self, tokens: list[str], max_entries: int) -> int:
+        '''
+        Append the tokens, all of them or none: if they pass max_tokens the
+        session is left as it was, and if its chart passes max_entries the
+        tokens appended are removed again. Both raise ValueError.
+
+        Returns the number of chart entries added.
+        '''
+        if len(self.tokens) + len(tokens) > self.max_tokens:
+            raise ValueError(
+                f'Session reached its limit of {self.max_tokens} tokens')
+        added = 0
+        for appended, token in enumerate(tokens, 1):
+            added += self.append(token)
+            if self.entries > max_entries:
+                self.pop(appended)
+                raise ValueError('Session exceeds the chart memory cap')
+        return added
+
+    def pop(self, count: int = 1) -> int:
+        '''
+        Remove the last count tokens and their columns, all of them or none.
+
+        Returns the number of chart entries removed.
+        '''
+        if count > 0 and not self.tokens:
+            raise ValueError('Session has no tokens to pop')
+        if not 0 <= count <= len(self.tokens):
+            raise ValueError(
+                f'Cannot pop {count} tokens from a session of {len(self.tokens)}')
+        removed = 0
+        for _ in range(count):
+            self.tokens.pop()
+            removed += sum(len(cell) for cell in self.columns.pop())
+        self.entries -= removed
+        return removed
+
+    def is_in(self) -> bool:
+        '''
+        Check whether the current tokens are a sentence of the grammar.
+        '''
+        if not self.tokens:
+            return False
+        return self.index.initial in self.columns[-1][0]
+
+    def state(self) -> dict:
+        return {
+            'sessionId': self.id,
+            'tokens': self.tokens,
+            'isIn': self.is_in(),
+        }
+
+
+class SessionStore:
+    '''
+    Parsing sessions with an idle timeout and a memory cap.
+
+    Sessions idle for more than idle_timeout seconds are dropped, and the
+    least recently used ones are evicted when there are more than
+    max_sessions or more than max_entries chart entries over all of them.
+
+    The store lock only guards the sessions and their counted entries. The
+    columns are filled under the lock of each session, so a long session
+    does not hold up the others.
+
+    Args:
+        idle_timeout (float): Seconds a session may stay unused.
+        max_sessions (int): Maximum number of live sessions.
+        max_entries (int): Maximum chart entries over all the sessions.
+        max_tokens (int): Maximum tokens per session.
+    '''
+
+    def __init__(self, idle_timeout: float, max_sessions: int, max_entries: int, max_tokens: int) -> None:
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.sessions: OrderedDict[str, ParseSession] = OrderedDict()
+        self.entries = 0
+        self.lock = Lock()
+
+    def __expire(self) -> None:
+        '''
+        Drop the idle sessions and evict the least recently used over the limits.
+        '''
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_used <= self.idle_timeout and \
+                    len(self.sessions) <= self.max_sessions and \
+                    self.entries <= self.max_entries:
+                break
+            self.__drop(session.id)
+
+    def __drop(self, session_id: str) -> None:
+        session = self.sessions.pop(session_id)
+        self.entries -= session.counted_entries
+
+    def __count(self, session: ParseSession) -> None:
+        '''
+        Count the entries of a session changed under its own lock, if it is
+        still in the store.
+        '''
+        if self.sessions.get(session.id) is session:
+            self.entries += session.entries - session.counted_entries
+            session.counted_entries = session.entries
+
+    def create(self, index) -> ParseSession:
+        '''
+        Create a session on the interned CNF grammar.
+        '''
+        session = ParseSession(index, self.max_tokens)
+        with self.lock:
+            self.sessions[session.id] = session
+            self.__expire()
+        return session
+
+    def __get(self, session_id: str) -> ParseSession:
+        self.__expire()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def get(self, session_id: str) -> ParseSession:
+        '''
+        Get a live session. Raises KeyError if it does not exist or expired.
+        '''
+        with self.lock:
+            return self.__get(session_id)
+
+    def append(self, session_id: str, tokens: list[str]) -> ParseSession:
+        '''
+        Append tokens to a session, all of them or none, see ParseSession.extend.
+        '''
+        session = self.get(session_id)
+        with session.lock:
+            session.extend(tokens, self.max_entries)
+            with self.lock:
+                self.__count(session)
+                self.__expire()
+        return session
+
+    def pop(self, session_id: str, count: int = 1) -> ParseSession:
+        '''
+        Remove the last count tokens of a session, all of them or none.
+        '''
+        session = self.get(session_id)
+        with session.lock:
+            session.pop(count)
+            with self.lock:
+                self.__count(session)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        with self.lock:
+            if session_id not in self.sessions:
+                raise KeyError(session_id)
+            self.__drop(session_id)
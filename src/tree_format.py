@@ -0,0 +1,174 @@
+from __future__ import annotations
+import json
+
+# Ways to return the parse trees: images drawn by dot, or the structure
+# itself, as nested JSON objects or bracketed strings.
+TREE_OUTPUTS = ('images', 'json', 'bracketed')
+
+# Penn Treebank escapes of the brackets inside labels and tokens.
+BRACKET_ESCAPES = {'(': '-LRB-', ')': '-RRB-'}
+
+
+def tree_json(trees) -> list[dict]:
+    '''
+    Convert (label, id, children) parse trees to nested JSON objects.
+
+    Non-terminals are {"label": A, "children": [...]}, tokens (and ϵ) are
+    {"label": token}. Subtrees shared by several trees of the forest are
+    converted once.
+    '''
+    converted: dict[int, dict] = {}
+
+    def convert(tree: tuple) -> dict:
+        # Post-order on an explicit stack, deep trees overflow the recursion.
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            key = id(node)
+            if key in converted:
+                continue
+            label, _, children = node
+            if children and not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            converted[key] = {'label': label}
+            if children:
+                converted[key]['children'] = [converted[id(child)]
+                                              for child in children]
+        return converted[id(tree)]
+
+    kept = []
+    objects = []
+    for tree in trees:
+        # Keep the trees alive so the ids of the converted nodes stay unique.
+        kept.append(tree)
+        objects.append(convert(tree))
+    return objects
+
+
+def pack_json(objects: list[dict]) -> tuple[list, list[int]]:
+    '''
+    Flatten tree_json objects into (nodes, roots) to send them to another
+    process, pickle recurses once per level and fails on deep trees. Each
+    node is a (label, child indices) pair, children before their parent,
+    and shared subtrees are packed once. unpack_json builds them back.
+    '''
+    indices: dict[int, int] = {}
+    nodes = []
+    for tree in objects:
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in indices:
+                continue
+            children = node.get('children')
+            if children and not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            indices[id(node)] = len(nodes)
+            nodes.append((node['label'], [indices[id(child)] for child in children]
+                          if children else None))
+    return nodes, [indices[id(tree)] for tree in objects]
+
+
+def unpack_json(packed: tuple[list, list[int]]) -> list[dict]:
+    '''
+    The tree_json objects of pack_json.
+    '''
+    nodes, roots = packed
+    built = []
+    for label, children in nodes:
+        node = {'label': label}
+        if children is not None:
+            node['children'] = [built[child] for child in children]
+        built.append(node)
+    return [built[root] for root in roots]
+
+
+def dumps_json(value, sort_keys: bool = False, ensure_ascii: bool = True) -> str:
+    '''
+    Compact json.dumps on an explicit stack, for the tree_json objects too
+    deep for the json encoder, which recurses once per level.
+    '''
+    parts = []
+    # (True, text) items are written as they are, (False, value) encoded.
+    stack = [(False, value)]
+    while stack:
+        written, item = stack.pop()
+        if written:
+            parts.append(item)
+        elif isinstance(item, dict):
+            keys = sorted(item) if sort_keys else list(item)
+            stack.append((True, '}'))
+            for i in reversed(range(len(keys))):
+                stack.append((False, item[keys[i]]))
+                key = json.dumps(str(keys[i]), ensure_ascii=ensure_ascii)
+                stack.append((True, f'{key}:' if i == 0 else f',{key}:'))
+            stack.append((True, '{'))
+        elif isinstance(item, (list, tuple)):
+            stack.append((True, ']'))
+            for i in reversed(range(len(item))):
+                stack.append((False, item[i]))
+                if i > 0:
+                    stack.append((True, ','))
+            stack.append((True, '['))
+        else:
+            parts.append(json.dumps(item, ensure_ascii=ensure_ascii))
+    return ''.join(parts)
+
+
+def escape_bracketed(label: str) -> str:
+    for bracket, escape in BRACKET_ESCAPES.items():
+        label = label.replace(bracket, escape)
+    return label
+
+
+def tree_bracketed(trees) -> list[str]:
+    '''
+    Convert (label, id, children) parse trees to Penn style bracketed
+    strings, (S (A a) (B b)). Brackets in the labels are written -LRB- and
+    -RRB-.
+    '''
+    fragments: dict[int, str] = {}
+
+    def bracketed(tree: tuple) -> str:
+        # Post-order on an explicit stack, like tree_json.
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            key = id(node)
+            if key in fragments:
+                continue
+            label, _, children = node
+            if children and not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            label = escape_bracketed(label)
+            if children:
+                inner = ' '.join(fragments[id(child)] for child in children)
+                fragments[key] = f'({label} {inner})'
+            else:
+                fragments[key] = label
+        return fragments[id(tree)]
+
+    kept = []
+    strings = []
+    for tree in trees:
+        kept.append(tree)
+        strings.append(bracketed(tree))
+    return strings
+
+
+def format_trees(trees, output: str) -> list:
+    '''
+    Convert parse trees to the 'json' or 'bracketed' output.
+    '''
+    if output == 'json':
+        return tree_json(trees)
+    if output == 'bracketed':
+        return tree_bracketed(trees)
+    raise ValueError(
+        f'Unknown trees output {output!r}, expected one of {TREE_OUTPUTS}')
@@ -0,0 +1,217 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import os
+import re
+
+KEY_REGEX = re.compile(r'[0-9a-f]{64}')
+
+
+def image_key(image: bytes) -> str:
+    '''
+    Content address of an image, the SHA-256 of its bytes.
+    '''
+    return hashlib.sha256(image).hexdigest()
+
+
+def source_key(source: str) -> str:
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+class TreeStore:
+    '''
+    Bounded store of rendered parse tree images, addressed by their content hash.
+
+    Images are kept in memory, LRU bounded by entries and bytes. When a
+    folder is given they are also written to it, LRU bounded by bytes, so
+    they outlive the memory tier and the process, and are shared by every
+    process using the same folder (each one bounds only the files it knows).
+
+    The DOT source of each stored image is remembered too, so a tree drawn
+    before is found without rendering it again.
+
+    Args:
+        max_entries (int): Maximum images kept in memory.
+        max_bytes (int): Maximum bytes of the images kept in memory.
+        folder (str): Folder of the disk tier, no disk tier when None.
+        max_disk_bytes (int): Maximum bytes of the disk tier files.
+        max_sources (int): Maximum DOT sources remembered in memory.
+    '''
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 64 * 1024 * 1024, folder: str = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024, max_sources: int = 65536) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self.max_sources = max_sources
+        self.images: OrderedDict[str, bytes] = OrderedDict()
+        self.bytes = 0
+        self.sources: OrderedDict[str, str] = OrderedDict()
+        # Disk tier files, relative to the folder, by last use.
+        self.files: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        if folder is not None:
+            self.__scan()
+
+    def __scan(self) -> None:
+        '''
+        Index the files already in the folder, oldest first.
+        '''
+        os.makedirs(os.path.join(self.folder, 'sources'), exist_ok=True)
+        found = [name for name in os.listdir(self.folder) if name.endswith('.svg')]
+        found += [os.path.join('sources', name)
+                  for name in os.listdir(os.path.join(self.folder, 'sources'))
+                  if not name.endswith('.tmp')]
+        stats = []
+        for name in found:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(stats):
+            self.files[name] = size
+            self.disk_bytes += size
+
+    def __read(self, name: str) -> bytes | None:
+        try:
+            with open(os.path.join(self.folder, name), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            # Evicted by another process sharing the folder.
+            with self.lock:
+                size = self.files.pop(name, None)
+                if size is not None:
+                    self.disk_bytes -= size
+            return None
+        with self.lock:
+            if name in self.files:
+                self.files.move_to_end(name)
+        return data
+
+    def __write(self, name: str, data: bytes) -> None:
+        with self.lock:
+            if name in self.files:
+                self.files.move_to_end(name)
+                return
+        path = os.path.join(self.folder, name)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        evicted = []
+        with self.lock:
+            if name not in self.files:
+                self.files[name] = len(data)
+                self.disk_bytes += len(data)
+            while self.disk_bytes > self.max_disk_bytes and len(self.files) > 1:
+                evicted_name, size = self.files.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.folder, evicted_name))
+            except FileNotFoundError:
+                pass
+
+    def __keep(self, key: str, image: bytes) -> None:
+        '''
+        Keep an image in memory, evicting the least recently used ones over the limits.
+        '''
+        with self.lock:
+            if len(image) > self.max_bytes:
+                return
+            if key in self.images:
+                self.images.move_to_end(key)
+                return
+            self.images[key] = image
+            self.bytes += len(image)
+            while len(self.images) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def put(self, image: bytes, source: str = None) -> str:
+        '''
+        Store an image, and the DOT source it was rendered from when given.
+
+        Returns the key of the image.
+        '''
+        key = image_key(image)
+        self.__keep(key, image)
+        if self.folder is not None:
+            self.__write(f'{key}.svg', image)
+        if source is not None:
+            digest = source_key(source)
+            with self.lock:
+                self.sources[digest] = key
+                self.sources.move_to_end(digest)
+                while len(self.sources) > self.max_sources:
+                    self.sources.popitem(last=False)
+            if self.folder is not None:
+                self.__write(os.path.join('sources', digest),
+                             key.encode('ascii'))
+        return key
+
+    def get(self, key: str) -> bytes | None:
+        '''
+        Get an image by key, from memory or else from the disk tier.
+        '''
+        if not KEY_REGEX.fullmatch(key):
+            return None
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return image
+        if self.folder is not None:
+            image = self.__read(f'{key}.svg')
+            if image is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                self.__keep(key, image)
+                return image
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def find(self, source: str) -> str | None:
+        '''
+        Get the key of the image rendered from a DOT source, if it was stored.
+        '''
+        digest = source_key(source)
+        with self.lock:
+            key = self.sources.get(digest)
+            if key is not None:
+                self.sources.move_to_end(digest)
+                return key
+        if self.folder is not None:
+            data = self.__read(os.path.join('sources', digest))
+            if data is not None:
+                key = data.decode('ascii')
+                with self.lock:
+                    self.sources[digest] = key
+                return key
+        return None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.images),
+                'bytes': self.bytes,
+                'maxEntries': self.max_entries,
+                'maxBytes': self.max_bytes,
+                'sources': len(self.sources),
+                'diskFiles': len(self.files),
+                'diskBytes': self.disk_bytes,
+                'maxDiskBytes': self.max_disk_bytes if self.folder is not None else None,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+            }
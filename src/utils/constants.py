@@ -1,9 +1,85 @@
+import os
+
 AZ = '(A|B|C|D|E|F|G|H|I|J|K|L|M|N|O|P|Q|R|S|T|U|V|W|X|Y|Z)'
-az = '(a|b|c|d|e|f|g|h|i|j|k|l|m|n|o|p|q|r|s|t|u|v|w|x|y|z)'
 digit = '(0|1|2|3|4|5|6|7|8|9)'
 
-# (( x)+ \|)*( x)+
-valid_characters = f'(( ({AZ}|{az}|{digit}))+|( \ϵ))'
-body = f'({valid_characters} \|)*{valid_characters}'
-left = f'{AZ} ->'
+# A normalized grammar line, N -> x y | z [0.5] | ϵ. The non-terminal on the
+# left is upper case letters and digits, a symbol on the right is anything
+# but spaces and | (and not ->), brackets too, S -> [ S ], and a rule may end
+# with a weight, a space separated [number].
+# The groups do not capture, the pattern only validates.
+symbol = r'(?!->(?: |$))[^\s|]+'
+weight = r'(?: \[[0-9.eE+-]+\])?'
+# ( x)+( [w])?( \|( x)+( [w])?)*
+rule = f'(?: {symbol})+{weight}'
+body = f'{rule}(?: \\|{rule})*'
+left = f'{AZ}(?:{AZ}|{digit})* ->'
 regex_str = f'{left}{body}'
+
+# Compiled grammars cache limits.
+GRAMMAR_CACHE_MAX_ENTRIES = 128
+GRAMMAR_CACHE_MAX_BYTES = int(os.environ.get('GRAMMAR_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Batch endpoint worker pool.
+BATCH_WORKERS = os.cpu_count() or 1
+BATCH_PARALLEL_THRESHOLD = 32
+BATCH_CHUNKS_PER_WORKER = 4
+
+# Parallel CYK engine: worker processes, sentences shorter than the tokens
+# threshold are parsed by the serial indexed engine, and span lengths of
+# fewer cell splits (start positions times split points) are filled without
+# the pool.
+CYK_PARALLEL_WORKERS = int(os.environ.get('GRAMMAR_CYK_PARALLEL_WORKERS', os.cpu_count() or 1))
+CYK_PARALLEL_MIN_TOKENS = 100
+CYK_PARALLEL_MIN_SPAN_WORK = 2048
+
+# Parse trees drawn per sentence when the request does not say.
+DEFAULT_MAX_TREES = 10
+
+# dot processes used to render the parse trees of one response.
+RENDER_PROCESSES = 2
+
+# Parse trees rendered together before being streamed.
+STREAM_RENDER_CHUNK = 4
+
+# Incremental parsing sessions limits.
+SESSION_IDLE_TIMEOUT = 300
+SESSION_MAX_COUNT = 1024
+SESSION_MAX_ENTRIES = 4_000_000
+SESSION_MAX_TOKENS = 512
+
+# Compiled grammars registry folder, loaded at startup.
+REGISTRY_FOLDER = os.environ.get('GRAMMAR_REGISTRY_FOLDER', './compiled')
+
+# Production serving (python server.py): /cyk worker processes, requests
+# allowed to wait for one before answering 503, and jobs a worker runs
+# before it is replaced (0 never).
+SERVER_WORKERS = int(os.environ.get('GRAMMAR_SERVER_WORKERS', os.cpu_count() or 1))
+SERVER_QUEUE_DEPTH = int(os.environ.get('GRAMMAR_SERVER_QUEUE_DEPTH', 32))
+SERVER_MAX_TASKS_PER_WORKER = int(
+    os.environ.get('GRAMMAR_SERVER_MAX_TASKS_PER_WORKER', 500))
+# Streams, batches, sessions and registrations run on the request threads,
+# at most this many at once before answering 503.
+SERVER_THREAD_SLOTS = int(os.environ.get('GRAMMAR_SERVER_THREAD_SLOTS', 16))
+# Server threads kept on top of the admitted requests, for /healthz and the
+# fast 503 answers.
+SERVER_SPARE_THREADS = 4
+SERVER_RETRY_AFTER = 1
+
+# Request budgets: the limits of every request, which may only lower them
+# with its 'budget' object. None is no limit.
+BUDGET_SECONDS = float(os.environ.get('GRAMMAR_BUDGET_SECONDS', 30))
+BUDGET_MAX_TOKENS = 1024
+BUDGET_MAX_CHART_ENTRIES = 20_000_000
+BUDGET_MAX_TREES = 1000
+BUDGET_MAX_CNF_RULES = 1_000_000
+
+# Rendered parse tree images store, served from GET /trees/<hash>. The disk
+# tier is off unless a folder is set.
+TREE_STORE_MAX_ENTRIES = 4096
+TREE_STORE_MAX_BYTES = 64 * 1024 * 1024
+TREE_STORE_FOLDER = os.environ.get('GRAMMAR_TREE_STORE_FOLDER')
+TREE_STORE_MAX_DISK_BYTES = int(
+    os.environ.get('GRAMMAR_TREE_STORE_MAX_DISK_BYTES', 1024 * 1024 * 1024))
+# Seconds the clients may cache a tree image, they never change.
+TREE_MAX_AGE = 365 * 24 * 60 * 60
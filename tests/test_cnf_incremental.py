@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from src.cache import GrammarCache
+from src.cnf_incremental import IncrementalCNF
+from src.grammar import Grammar
+
+NON_TERMINALS = ['S', 'A', 'B', 'C', 'D', 'E', 'F1', 'G']
+TERMINALS = ['a', 'b', 'c', 'd', 'x']
+EDITS = 25
+
+
+def random_rule(rng: random.Random, weighted: bool) -> str:
+    '''
+    A rule body of up to 4 symbols, sometimes ϵ, with a weight half of the
+    time when weighted.
+    '''
+    if rng.random() < 0.08:
+        rule = 'ϵ'
+    else:
+        length = rng.choice([1, 1, 1, 2, 2, 3, 4])
+        rule = ' '.join(rng.choice(NON_TERMINALS + TERMINALS * 2)
+                        for _ in range(length))
+    if weighted and rng.random() < 0.5:
+        rule += f' [{rng.choice([0.1, 0.25, 0.5, 0.9, 1])}]'
+    return rule
+
+
+def grammar_lines(rules: dict[str, list[str]]) -> list[str]:
+    return [f'{non_terminal} -> ' + ' | '.join(bodies)
+            for non_terminal, bodies in rules.items() if bodies]
+
+
+def assert_same_cnf(lines: list[str], incremental: IncrementalCNF, initial_symbol: str, prefix: str) -> None:
+    full = Grammar(lines, initial_symbol, prefix)
+    full.CNF()
+    edited = Grammar(lines, initial_symbol, prefix)
+    edited.CNF(incremental=incremental)
+
+    assert str(edited) == str(full), lines
+    assert list(edited.productions) == list(full.productions)
+    assert dict(edited.productions) == dict(full.productions)
+    assert edited.weights == full.weights
+    assert edited.non_terminals == full.non_terminals
+    assert edited.terminals == full.terminals
+    assert edited.nullables == full.nullables
+
+
+def edit(rng: random.Random, rules: dict[str, list[str]], weighted: bool) -> dict[str, list[str]]:
+    '''
+    The rules after one random edit: a rule added, removed or replaced, a
+    non-terminal removed, or the non-terminals reordered.
+    '''
+    rules = {non_terminal: list(bodies) for non_terminal, bodies in rules.items()}
+    non_terminal = rng.choice(NON_TERMINALS)
+    bodies = rules.get(non_terminal)
+    action = rng.random()
+    if action < 0.4:
+        rules[non_terminal] = sorted(set(bodies or []) | {random_rule(rng, weighted)})
+    elif action < 0.65 and bodies:
+        bodies.pop(rng.randrange(len(bodies)))
+    elif action < 0.85 and bodies:
+        bodies[rng.randrange(len(bodies))] = random_rule(rng, weighted)
+    elif action < 0.92:
+        rules.pop(non_terminal, None)
+    else:
+        items = list(rules.items())
+        rng.shuffle(items)
+        rules = dict(items)
+    return rules if any(rules.values()) else {'S': ['a']}
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_edits_give_the_full_cnf(seed):
+    rng = random.Random(seed)
+    weighted = seed % 2 == 1
+    rules = {non_terminal: sorted({random_rule(rng, weighted) for _ in range(rng.randint(1, 4))})
+             for non_terminal in ['S'] + rng.sample(NON_TERMINALS[1:], rng.randint(1, 7))}
+    incremental = IncrementalCNF()
+    initial_symbol = prefix = None
+    for _ in range(EDITS):
+        assert_same_cnf(grammar_lines(rules), incremental, initial_symbol, prefix)
+        change = rng.random()
+        if change < 0.1:
+            initial_symbol = rng.choice([None, 'S', 'A', 'B'])
+        elif change < 0.18:
+            prefix = rng.choice([None, 'XY', 'Z'])
+        elif change < 0.22:
+            # The same grammar, weighted or not.
+            weighted = not weighted
+            rules = {non_terminal: [body.split(' [')[0] for body in bodies]
+                     for non_terminal, bodies in rules.items()}
+        else:
+            rules = edit(rng, rules, weighted)
+
+
+def test_cache_counts_the_incremental_state():
+    lines = [f'T{i} -> ' + ' | '.join(f'w{i}x{j}' for j in range(50)) for i in range(20)]
+    lines.insert(0, 'S -> ' + ' | '.join(f'T{i} T{(i + 1) % 20}' for i in range(20)))
+
+    cache = GrammarCache()
+    entry = cache.get_or_compile(lines)
+    assert 0 < cache.incremental_bytes
+    assert cache.stats()['bytes'] == entry.size
+
+    # Over half of the limit the state is dropped.
+    small = GrammarCache(max_bytes=entry.size * 2)
+    small.get_or_compile(lines)
+    assert small.incremental_bytes == 0
+    assert small.incremental.read == {}
@@ -0,0 +1,66 @@
+from itertools import product
+import glob
+import random
+
+import pytest
+
+from src.grammar import Grammar
+
+# The strings of each grammar are every sequence of its terminals, from the
+# shortest up to the length that keeps them under this many.
+MAX_STRINGS = 3000
+MAX_LENGTH = 8
+
+
+def strings(terminals: set[str]) -> list[str]:
+    alphabet = sorted(terminals - {'ϵ'})
+    found = []
+    for length in range(1, MAX_LENGTH + 1):
+        if len(found) + len(alphabet) ** length > MAX_STRINGS:
+            break
+        found += [' '.join(tokens) for tokens in product(alphabet, repeat=length)]
+    return found
+
+
+def random_grammar(seed: int) -> list[str]:
+    '''
+    A small grammar with ϵ rules, unit cycles and long rules.
+    '''
+    rng = random.Random(seed)
+    non_terminals = ['S', 'A', 'B', 'C']
+    symbols = non_terminals + ['a', 'b', 'c']
+    lines = []
+    for non_terminal in non_terminals:
+        rules = {' '.join(rng.choice(symbols) for _ in range(rng.randint(1, 4)))
+                 for _ in range(rng.randint(1, 4))}
+        if rng.random() < 0.4:
+            rules.add('ϵ')
+        # A unit rule to the next non-terminal, closing a cycle back to S.
+        if rng.random() < 0.5:
+            rules.add(non_terminals[(non_terminals.index(non_terminal) + 1) % len(non_terminals)])
+        if rng.random() < 0.5:
+            rules.add(rng.choice('abc'))
+        lines.append(f'{non_terminal} -> {" | ".join(sorted(rules))}')
+    return lines
+
+
+def verdicts(lines: list[str], mode: str, sentences: list[str]) -> list[bool]:
+    grammar = Grammar(lines)
+    grammar.CNF(mode)
+    return [grammar.recognize(sentence)[0] for sentence in sentences]
+
+
+def assert_same_language(lines: list[str]) -> None:
+    sentences = strings(Grammar(lines).terminals)
+    assert verdicts(lines, 'linear', sentences) == verdicts(lines, 'classic', sentences)
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob('docs/*.txt')))
+def test_docs_grammars(path: str):
+    with open(path, encoding='utf-8') as file:
+        assert_same_language(file.read().splitlines())
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_random_grammars(seed: int):
+    assert_same_language(random_grammar(seed))
@@ -0,0 +1,38 @@
+from src.grammar import Grammar
+from src.tree_format import format_trees
+
+
+def earley_forest(lines: list[str], sentence: str):
+    return Grammar(lines).parse(sentence, parser='earley')
+
+
+def test_unit_cycles_keep_every_cycle_free_tree():
+    forest = earley_forest(['S -> A | B', 'A -> B | a', 'B -> A | a'], 'a')
+
+    assert forest.count() == 4
+    assert sorted(format_trees(list(forest.trees()), 'bracketed')) == [
+        '(S (A (B a)))', '(S (A a))', '(S (B (A a)))', '(S (B a))']
+
+
+def test_count_does_not_depend_on_the_visit_order():
+    lines = ['S -> A | B', 'A -> B | a', 'B -> A | a']
+    forest = earley_forest(lines, 'a')
+    # Counting a child first must not prune the trees of the root.
+    assert forest.count(('B', 0, 1)) == 2
+    assert forest.count() == 4
+
+
+def test_epsilon_cycles_are_finite():
+    forest = earley_forest(['S -> S S | a | ϵ'], 'a a')
+
+    assert forest.count() == 1
+    assert format_trees(list(forest.trees()), 'bracketed') == ['(S (S a) (S a))']
+
+
+def test_same_count_as_cyk_without_cycles():
+    grammar = Grammar(['E -> E + E | E * E | id'])
+    earley = grammar.parse('id + id * id + id', parser='earley')
+    grammar.CNF()
+    cyk = grammar.parse('id + id * id + id')
+
+    assert earley.count() == cyk.count() == 5
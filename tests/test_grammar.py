@@ -0,0 +1,18 @@
+from src.grammar import Grammar
+from src.grammar_reader import read_grammar
+
+
+def test_bracket_terminals_are_not_weights():
+    grammar = Grammar(['S -> [ S ] | a | x [0.5]'])
+
+    assert grammar.productions['S'] == {('[', 'S', ']'), ('a',), ('x',)}
+    assert grammar.weights == {('S', ('x',)): 0.5}
+    grammar.CNF()
+    assert grammar.parse('[ [ a ] ]').is_in
+    assert not grammar.parse('[ a').is_in
+
+
+def test_reader_accepts_bracket_symbols():
+    lines = ['S -> [ S ] | a | x [0.5]', 'A -> [a] b']
+
+    assert list(read_grammar(lines)) == lines
@@ -0,0 +1,77 @@
+import json
+import pickle
+import sys
+
+import pytest
+
+from src.grammar import Grammar
+from src.tree_format import dumps_json, format_trees, pack_json, unpack_json
+
+
+def deep_tree(tokens: int) -> tuple:
+    '''
+    The (label, id, children) tree of S -> A S | a over tokens a's.
+    '''
+    leaf = ('a', 0, ())
+    tree = ('S', 1, (leaf,))
+    for i in range(tokens - 1):
+        tree = ('S', i + 2, (('A', -i, (leaf,)), tree))
+    return tree
+
+
+def test_formats_deep_trees():
+    tree = deep_tree(5000)
+
+    bracketed, = format_trees([tree], 'bracketed')
+    assert bracketed.startswith('(S (A a) (S (A a)')
+    assert bracketed.count('(A a)') == 4999
+
+    objects = format_trees([tree], 'json')
+    written = dumps_json(objects)
+    assert written.count('"label":"A"') == 4999
+    # Comparing the objects would recurse too, compare their JSON.
+    assert dumps_json(unpack_json(pickle.loads(pickle.dumps(pack_json(objects))))) == written
+
+
+def test_long_sentence_json_trees():
+    forest = Grammar(['S -> A S | a', 'A -> a']).parse(
+        ' '.join(['a'] * 700), parser='earley')
+
+    tree, = format_trees(list(forest.trees()), 'json')
+    assert dumps_json(tree).count('"label":"A"') == 699
+
+
+def test_long_sentence_viterbi_trees():
+    grammar = Grammar(['S -> A S [0.5] | A B | a', 'A -> a', 'B -> a'])
+    grammar.CNF()
+    forest = grammar.parse(' '.join(['a'] * 300), parser='viterbi')
+
+    # The k-best search must not recurse once per level either.
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(200)
+    try:
+        assert forest.probability(1) == pytest.approx(forest.probability(0) / 2)
+        second = forest.tree(1)
+    finally:
+        sys.setrecursionlimit(limit)
+    assert format_trees([second], 'bracketed')[0].count('(A a)') == 299
+
+
+def test_pack_json_keeps_shared_subtrees():
+    leaf = {'label': 'a'}
+    shared = {'label': 'A', 'children': [leaf]}
+    objects = [{'label': 'S', 'children': [shared, shared]}, shared]
+
+    unpacked = unpack_json(pack_json(objects))
+    assert unpacked == objects
+    assert unpacked[0]['children'][0] is unpacked[0]['children'][1] is unpacked[1]
+
+
+def test_dumps_json_matches_json_dumps():
+    value = {'b': [1, 2.5, None, True, '(é)'], 'a': {}, 'c': [],
+             'trees': [{'label': 'S', 'children': [{'label': 'a'}]}]}
+
+    for sort_keys in (False, True):
+        for ensure_ascii in (False, True):
+            assert dumps_json(value, sort_keys, ensure_ascii) == json.dumps(
+                value, sort_keys=sort_keys, ensure_ascii=ensure_ascii, separators=(',', ':'))
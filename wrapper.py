@@ -1,50 +1,718 @@
-from src.grammar import Grammar
-from src.utils.tools import to_base64
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from src.budget import Budget, BudgetExceeded
+from src.cache import GrammarCache
+from src.metrics import MetricsRegistry, exponential_buckets
+from src.pool import QueueFull, ThreadSlots, WorkerPool
+from src.utils.constants import GRAMMAR_CACHE_MAX_ENTRIES, GRAMMAR_CACHE_MAX_BYTES, \
+    BATCH_WORKERS, BATCH_PARALLEL_THRESHOLD, BATCH_CHUNKS_PER_WORKER, DEFAULT_MAX_TREES, \
+    RENDER_PROCESSES, STREAM_RENDER_CHUNK, SESSION_IDLE_TIMEOUT, SESSION_MAX_COUNT, \
+    SESSION_MAX_ENTRIES, SESSION_MAX_TOKENS, REGISTRY_FOLDER, BUDGET_SECONDS, BUDGET_MAX_TOKENS, \
+    BUDGET_MAX_CHART_ENTRIES, BUDGET_MAX_TREES, BUDGET_MAX_CNF_RULES, TREE_STORE_MAX_ENTRIES, \
+    TREE_STORE_MAX_BYTES, TREE_STORE_FOLDER, TREE_STORE_MAX_DISK_BYTES
+from src.registry import GrammarRegistry, UnknownGrammar
+from src.render import render, tree_sources
+from src.session import SessionStore
+from src.tree_format import TREE_OUTPUTS, format_trees, pack_json, unpack_json
+from src.tree_store import TreeStore
+from src.utils.tools import extract_svg_height_width, to_base64
+import multiprocessing
+import time
 
+GRAMMAR_CACHE = GrammarCache(
+    GRAMMAR_CACHE_MAX_ENTRIES, GRAMMAR_CACHE_MAX_BYTES)
 
-def wrapper_cyk(lines: list[str], sentence: str, HEIGHT_REGEX, WIDTH_REGEX, prefix, initial_symbol, web=True) -> str:
+# Grammars compiled ahead, mapped from their files at startup.
+REGISTRY = GrammarRegistry(REGISTRY_FOLDER, GRAMMAR_CACHE)
+REGISTRY.load()
+
+# Rendered parse trees, by content hash.
+TREE_STORE = TreeStore(TREE_STORE_MAX_ENTRIES, TREE_STORE_MAX_BYTES,
+                       TREE_STORE_FOLDER, TREE_STORE_MAX_DISK_BYTES)
+
+# How the responses carry the tree images: base64 data URIs or /trees/<hash> URLs.
+IMAGE_MODES = ('inline', 'reference')
+
+SESSIONS = SessionStore(SESSION_IDLE_TIMEOUT, SESSION_MAX_COUNT,
+                        SESSION_MAX_ENTRIES, SESSION_MAX_TOKENS)
+
+BATCH_POOL: ProcessPoolExecutor = None
+
+# Worker processes of /cyk in production serving, see start_serving_pool.
+SERVING_POOL: WorkerPool = None
+# Admission of the requests computed on their own thread, see thread_slot.
+THREAD_SLOTS: ThreadSlots = None
+
+BUDGET_LIMITS = {
+    'seconds': BUDGET_SECONDS,
+    'maxTokens': BUDGET_MAX_TOKENS,
+    'maxChartEntries': BUDGET_MAX_CHART_ENTRIES,
+    'maxTrees': BUDGET_MAX_TREES,
+    'maxCnfRules': BUDGET_MAX_CNF_RULES,
+}
+
+METRICS = MetricsRegistry()
+PHASE_SECONDS = METRICS.histogram(
+    'grammar_phase_seconds', 'Seconds spent on each phase of a request.',
+    exponential_buckets(0.0001, 4, 10), ('phase',))
+GRAMMAR_RULES = METRICS.histogram(
+    'grammar_rules', 'Rules of the requested grammars, before (original) and after (cnf) CNF.',
+    exponential_buckets(10, 4, 10), ('stage',))
+GRAMMAR_NON_TERMINALS = METRICS.histogram(
+    'grammar_non_terminals', 'Non-terminals of the requested grammars, before (original) and after (cnf) CNF.',
+    exponential_buckets(10, 4, 10), ('stage',))
+CHART_CELLS = METRICS.histogram(
+    'grammar_chart_cells', 'Chart cells of each parse: CYK triangle cells or Earley completed items.',
+    exponential_buckets(10, 4, 12), ('parser',))
+PARSE_TREES = METRICS.histogram(
+    'grammar_parse_trees', 'Parse trees of each sentence in the language, the sum counts at most 1e12 per sentence.',
+    exponential_buckets(1, 10, 13), clamp_sum=True)
+RESPONSE_BYTES = METRICS.histogram(
+    'grammar_response_bytes', 'Size of the responses.',
+    exponential_buckets(256, 4, 10), ('endpoint',))
+BUDGETS_EXCEEDED = METRICS.counter(
+    'grammar_budgets_exceeded_total', 'Requests stopped by their budget, by limit and phase.',
+    ('limit', 'phase'))
+
+
+def check_modes(images: str, output: str) -> None:
+    if images not in IMAGE_MODES:
+        raise ValueError(
+            f'Unknown images mode {images!r}, expected one of {IMAGE_MODES}')
+    if output not in TREE_OUTPUTS:
+        raise ValueError(
+            f'Unknown trees output {output!r}, expected one of {TREE_OUTPUTS}')
+
+
+def request_budget(requested: dict = None) -> Budget:
     '''
-    Wrapper for the CYK algorithm.
+    The budget of a request: the server limits, lowered by the ones it asks for.
     '''
-    initial_grammar = '\n'.join(lines)
-    grammar = Grammar(lines, initial_symbol, prefix)
-    grammar.CNF()
-    resultant_grammar = str(grammar).split('\n')
-    resultant_grammar = resultant_grammar[2:]
-    resultant_grammar = '\n'.join(resultant_grammar)
-    is_in, images, took = grammar.CYK(sentence, web=True)
-
-    if is_in:
-        new_images = []
-        for image in images:
+    return Budget.from_request(requested, BUDGET_LIMITS)
+
+
+def budget_exceeded(error: BudgetExceeded, phase: str) -> dict:
+    '''
+    The 'budgetExceeded' object of a response stopped in a phase.
+    '''
+    return {**error.to_dict(), 'phase': phase}
+
+
+def request_grammar(lines: list[str], initial_symbol, prefix, cnf_mode: str, grammar_id: str = None, phases: dict = None, budget: Budget = None) -> tuple:
+    '''
+    Get the compiled grammar of a request: the registered one when it sends a
+    grammarId, the cached compilation of its lines otherwise.
+
+    Returns the grammar lines, the grammar and the compiled grammar, which
+    holds the CNF grammar text and the grammar sizes.
+    '''
+    if grammar_id is not None:
+        registered = REGISTRY.get(grammar_id)
+        return registered.lines, registered, registered
+    if lines is None:
+        raise ValueError('The request needs a grammar or a grammarId')
+    compiled = GRAMMAR_CACHE.get_or_compile(
+        lines, initial_symbol, prefix, cnf_mode, phases, budget)
+    return lines, compiled.grammar, compiled
+
+
+def observation(phases: dict, sizes: dict, forest, parser: str, exceeded: dict = None) -> dict:
+    '''
+    The metrics of one parse, as plain data so worker processes can return it.
+
+    The sizes and forest are None when the budget ran out before them.
+    '''
+    return {
+        'phases': phases,
+        'sizes': sizes,
+        'cells': forest.cells if forest is not None else None,
+        'parser': parser,
+        'parseTrees': forest.count() if forest is not None and forest.is_in else None,
+        'budgetExceeded': exceeded,
+    }
+
+
+def record_request(observed: dict) -> None:
+    '''
+    Record the phases and sizes of one parse in the metrics.
+    '''
+    for phase, took in observed['phases'].items():
+        PHASE_SECONDS.observe(took, phase=phase)
+    sizes = observed['sizes']
+    if sizes:
+        GRAMMAR_RULES.observe(sizes['rules'], stage='original')
+        GRAMMAR_RULES.observe(sizes['cnfRules'], stage='cnf')
+        GRAMMAR_NON_TERMINALS.observe(sizes['nonTerminals'], stage='original')
+        GRAMMAR_NON_TERMINALS.observe(sizes['cnfNonTerminals'], stage='cnf')
+    if observed['cells'] is not None:
+        CHART_CELLS.observe(observed['cells'], parser=observed['parser'])
+    if observed['parseTrees'] is not None:
+        PARSE_TREES.observe(observed['parseTrees'])
+    exceeded = observed['budgetExceeded']
+    if exceeded:
+        BUDGETS_EXCEEDED.inc(limit=exceeded['limit'], phase=exceeded['phase'])
+
+
+def images_data(images: list[tuple[str, bytes]], sentence: str, HEIGHT_REGEX, WIDTH_REGEX, mode: str = 'inline', trees_url: str = '/trees/') -> list[dict]:
+    '''
+    Convert the (key, svg) parse trees to the image objects of the response.
+
+    Args:
+        mode (str): One of IMAGE_MODES. 'inline' images are base64 data URIs,
+            'reference' ones the trees_url of their key in the tree store.
+        trees_url (str): The URL GET /trees/<key> is served from.
+    '''
+    new_images = []
+    for key, image in images:
+        if mode == 'reference':
+            # Trees rendered on worker processes are stored here too, where
+            # GET /trees/<key> looks for them.
+            TREE_STORE.put(image)
+            height, width = extract_svg_height_width(
+                image.decode('utf-8'), HEIGHT_REGEX, WIDTH_REGEX)
+            src = trees_url + key
+        else:
             string, width, height = to_base64(image, HEIGHT_REGEX, WIDTH_REGEX)
-            data = {
-                'src': 'data:image/svg+xml;base64,' + string,
-                'alt': 'Parse tree',
-                'width': width,
-                'height': height,
-                'title': 'Parse tree',
-                'description': f'\nSentence: {sentence}'
-            }
-            new_images.append(data)
-        return {
+            src = 'data:image/svg+xml;base64,' + string
+        data = {
+            'src': src,
+            'alt': 'Parse tree',
+            'width': width,
+            'height': height,
+            'title': 'Parse tree',
+            'description': f'\nSentence: {sentence}'
+        }
+        if mode == 'reference':
+            data['hash'] = key
+        new_images.append(data)
+    return new_images
+
+
+def extract_trees(forest, k: int, start: int = 0, budget: Budget = None) -> list[tuple]:
+    '''
+    The trees of forest.trees, stopping early when the budget runs out of
+    trees. The budget keeps the BudgetExceeded then, and the deadline still
+    raises it.
+    '''
+    trees = []
+    try:
+        for tree in forest.trees(k, start, budget):
+            trees.append(tree)
+    except BudgetExceeded as error:
+        if error.limit != 'maxTrees':
+            raise
+    return trees
+
+
+def tree_probabilities(forest, start: int, count: int) -> list[float]:
+    '''
+    The probabilities of count trees of a 'viterbi' forest, from the start-th.
+    '''
+    return [forest.probability(i) for i in range(start, start + count)]
+
+
+def format_forest_trees(forest, max_trees: int, output: str, phases: dict = None, budget: Budget = None) -> list:
+    '''
+    The first max_trees trees of the forest in the 'json' or 'bracketed'
+    output, no graphviz nor dot involved. If phases is given, the seconds
+    are added to its 'trees' entry.
+    '''
+    start_time = time.perf_counter()
+    trees = format_trees(extract_trees(forest, max_trees, 0, budget), output)
+    if phases is not None:
+        phases['trees'] = phases.get(
+            'trees', 0) + time.perf_counter() - start_time
+    return trees
+
+
+def render_stored(sources: list[str]) -> list[tuple[str, bytes]]:
+    '''
+    Render DOT sources to svg through the tree store. The trees drawn before
+    are read from it, only the others are rendered, in one pass, and stored.
+
+    Returns the (key, image) pair of each source.
+    '''
+    found = []
+    for source in sources:
+        key = TREE_STORE.find(source)
+        found.append((key, TREE_STORE.get(key) if key is not None else None))
+    missing = [source for source, (_, image) in zip(sources, found)
+               if image is None]
+    rendered = iter(render(missing, 'svg', RENDER_PROCESSES))
+    images = []
+    for source, (key, image) in zip(sources, found):
+        if image is None:
+            image = next(rendered)
+            key = TREE_STORE.put(image, source)
+        images.append((key, image))
+    return images
+
+
+def render_trees(forest, max_trees: int, phases: dict = None, budget: Budget = None) -> tuple[list[tuple[str, bytes]], float]:
+    '''
+    Render the first max_trees trees of the forest to svg, see render_stored.
+
+    Returns the (key, image) pairs and the seconds spent extracting and
+    rendering the trees. If phases is given, the seconds of each step are added to its
+    'trees' and 'render' entries. Only the trees the budget allows are
+    rendered, see extract_trees.
+    '''
+    start_time = time.perf_counter()
+    trees = extract_trees(forest, max_trees, 0, budget)
+    trees_time = time.perf_counter()
+    images = render_stored(tree_sources(trees))
+    end_time = time.perf_counter()
+    if phases is not None:
+        phases['trees'] = phases.get('trees', 0) + trees_time - start_time
+        phases['render'] = phases.get('render', 0) + end_time - trees_time
+    return images, end_time - start_time
+
+
+def cyk_job(lines: list[str], sentence: str, prefix, initial_symbol, engine: str, max_trees: int, parser: str, cnf_mode: str, grammar_id: str, budget: Budget = None, output: str = 'images', recognize_only: bool = False) -> tuple[dict, dict]:
+    '''
+    The work of wrapper_cyk, runnable on the serving pool workers.
+
+    Returns the response and the observation to record in the metrics. The
+    response images are (key, svg) pairs, wrapper_cyk encodes them. With
+    the 'json' or 'bracketed' output the trees go in 'trees' and nothing is
+    drawn, the json ones packed by pack_json. When
+    the budget runs out the response keeps what was found until then, and
+    'budgetExceeded' tells the limit and the phase (grammar, chart or trees)
+    it stopped. 'isIn' and 'parseCount' are None when the chart was not
+    completed. The 'viterbi' parser returns the trees best first, with their
+    'probabilities'. With recognize_only only 'isIn' is computed, by the
+    bitset recognizer: no trees, and 'parseCount' stays None.
+    '''
+    timings = {}
+    response = {
+        'prefix': prefix,
+        'initialSymbol': initial_symbol,
+        'initialGrammar': '\n'.join(lines) if lines is not None else None,
+        'resultantGrammar': None,
+        'images': [],
+        'took': 0,
+        'renderTook': 0,
+        'isIn': None,
+        'parseCount': None,
+        'sentence': sentence,
+        'engine': parser,
+    }
+    compiled = forest = None
+    phase = 'grammar'
+    try:
+        lines, grammar, compiled = request_grammar(
+            lines, initial_symbol, prefix, cnf_mode, grammar_id, timings, budget)
+        response.update({
             'prefix': grammar.prefix,
             'initialSymbol': grammar.initial_symbol,
-            'initialGrammar': initial_grammar,
-            'resultantGrammar': resultant_grammar,
-            'images': new_images,
-            'took': took,
-            'isIn': is_in,
+            'initialGrammar': '\n'.join(lines),
+            'resultantGrammar': compiled.resultant_grammar,
+        })
+
+        phase = 'chart'
+        if recognize_only:
+            is_in, took = grammar.recognize(sentence, budget)
+            timings['chart'] = took
+            response.update({'took': took, 'isIn': is_in})
+            return response, observation(timings, compiled.sizes, None, parser)
+        forest = grammar.parse(sentence, engine, parser, budget)
+        timings['chart'] = forest.took
+        response.update({
+            'took': forest.took,
+            'isIn': forest.is_in,
+            'parseCount': forest.count() if forest.is_in else 0,
+        })
+
+        phase = 'trees'
+        if output != 'images':
+            response['trees'] = []
+            if forest.is_in:
+                response['trees'] = format_forest_trees(
+                    forest, max_trees, output, timings, budget)
+        elif forest.is_in:
+            response['images'], response['renderTook'] = render_trees(
+                forest, max_trees, timings, budget)
+        if parser == 'viterbi':
+            response['probabilities'] = tree_probabilities(
+                forest, 0, len(response['trees'] if output != 'images' else response['images']))
+        if budget is not None and budget.exceeded is not None:
+            response['budgetExceeded'] = budget_exceeded(
+                budget.exceeded, phase)
+    except BudgetExceeded as error:
+        response['budgetExceeded'] = budget_exceeded(error, phase)
+
+    if output == 'json' and 'trees' in response:
+        response['trees'] = pack_json(response['trees'])
+    sizes = compiled.sizes if compiled is not None else None
+    return response, observation(timings, sizes, forest, parser, response.get('budgetExceeded'))
+
+
+def start_serving_pool(workers: int, queue_depth: int, max_tasks_per_child: int = None, thread_slots: int = None) -> WorkerPool:
+    '''
+    Run the /cyk work on a pool of worker processes from now on, and admit
+    at most thread_slots of the requests computed on their own thread.
+    '''
+    global SERVING_POOL, THREAD_SLOTS
+    SERVING_POOL = WorkerPool(workers, queue_depth, max_tasks_per_child)
+    if thread_slots:
+        THREAD_SLOTS = ThreadSlots(thread_slots)
+    return SERVING_POOL
+
+
+def thread_slot():
+    '''
+    Hold one of the thread slots for the work in the with block, raising
+    QueueFull if they are all taken. Unbounded without a serving pool.
+    '''
+    return THREAD_SLOTS if THREAD_SLOTS is not None else nullcontext()
+
+
+def wrapper_pool_stats() -> dict:
+    '''
+    The serving pool state, None when /cyk runs on the request threads.
+    '''
+    if SERVING_POOL is None:
+        return None
+    stats = SERVING_POOL.stats()
+    if THREAD_SLOTS is not None:
+        stats['threadSlots'] = THREAD_SLOTS.stats()
+    return stats
+
+
+def wrapper_cyk(lines: list[str], sentence: str, HEIGHT_REGEX, WIDTH_REGEX, prefix, initial_symbol, web=True, engine: str = 'indexed', max_trees: int = DEFAULT_MAX_TREES, parser: str = 'cyk', cnf_mode: str = 'classic', grammar_id: str = None, phases: bool = False, budget: dict = None, images: str = 'inline', trees_url: str = '/trees/', output: str = 'images', recognize_only: bool = False) -> str:
+    '''
+    Wrapper for the CYK algorithm.
+
+    The parse trees are counted on the shared packed forest, and only the
+    first max_trees of them are drawn. The seconds of each phase are always
+    recorded in the metrics, and returned as 'phases' when asked.
+
+    Runs on the serving pool when it was started, raising QueueFull if the
+    pool has no free slot and BrokenProcessPool if its worker died, and in
+    the calling thread otherwise. The budget
+    object of the request lowers the server limits, its deadline counts the
+    time waiting for a worker too.
+
+    The images are inline data URIs or references to GET /trees/<hash>, by
+    the images mode, see images_data. The 'json' and 'bracketed' outputs
+    return the tree structures in 'trees' instead of drawing them.
+    recognize_only skips the chart and the trees, and only tells 'isIn'.
+    '''
+    check_modes(images, output)
+    args = (lines, sentence, prefix, initial_symbol, engine, max_trees,
+            parser, cnf_mode, grammar_id, request_budget(budget), output, recognize_only)
+    if SERVING_POOL is not None:
+        response, observed = SERVING_POOL.run(cyk_job, *args)
+    else:
+        response, observed = cyk_job(*args)
+    if output == 'json' and 'trees' in response:
+        response['trees'] = unpack_json(response['trees'])
+    start_time = time.perf_counter()
+    response['images'] = images_data(
+        response['images'], sentence, HEIGHT_REGEX, WIDTH_REGEX, images, trees_url)
+    observed['phases']['encode'] = time.perf_counter() - start_time
+    if phases:
+        response['phases'] = observed['phases']
+    record_request(observed)
+    return response
+
+
+def wrapper_cyk_stream(lines: list[str], sentence: str, HEIGHT_REGEX, WIDTH_REGEX, prefix, initial_symbol, engine: str = 'indexed', max_trees: int = DEFAULT_MAX_TREES, parser: str = 'cyk', cnf_mode: str = 'classic', grammar_id: str = None, phases: bool = False, budget: dict = None, images: str = 'inline', trees_url: str = '/trees/', output: str = 'images'):
+    '''
+    Streaming wrapper for the CYK algorithm.
+
+    Yields the membership verdict and CNF grammar first, then one event per
+    parse tree as soon as it is rendered, and a last event with the totals.
+    Trees are rendered STREAM_RENDER_CHUNK at a time and dropped once sent, so
+    memory stays flat no matter how many trees there are.
+
+    When the budget runs out before the verdict, the result event has
+    'budgetExceeded' and no trees follow. When it runs out while drawing the
+    trees, the end event has it.
+
+    With the 'json' or 'bracketed' output the tree events have the 'tree'
+    structure instead of the 'image'. With the 'viterbi' parser they come
+    best first, each with its 'probability'.
+    '''
+    check_modes(images, output)
+    timings = {}
+    budget = request_budget(budget)
+    phase = 'grammar'
+    try:
+        lines, grammar, compiled = request_grammar(
+            lines, initial_symbol, prefix, cnf_mode, grammar_id, timings, budget)
+        phase = 'chart'
+        forest = grammar.parse(sentence, engine, parser, budget)
+    except BudgetExceeded as error:
+        exceeded = budget_exceeded(error, phase)
+        record_request(observation(timings, None, None, parser, exceeded))
+        yield {
+            'type': 'result',
+            'took': 0,
+            'isIn': None,
+            'parseCount': None,
             'sentence': sentence,
+            'budgetExceeded': exceeded,
         }
-    else:
+        yield {'type': 'end', 'trees': 0, 'renderTook': 0}
+        return
+    timings['chart'] = forest.took
+    parse_count = forest.count() if forest.is_in else 0
+
+    yield {
+        'type': 'result',
+        'prefix': grammar.prefix,
+        'initialSymbol': grammar.initial_symbol,
+        'initialGrammar': '\n'.join(lines),
+        'resultantGrammar': compiled.resultant_grammar,
+        'took': forest.took,
+        'isIn': forest.is_in,
+        'parseCount': parse_count,
+        'sentence': sentence,
+    }
+
+    total = parse_count if max_trees is None else min(parse_count, max_trees)
+    render_took = 0
+    sent = 0
+    exceeded = None
+    for start in range(0, total, STREAM_RENDER_CHUNK):
+        start_time = time.perf_counter()
+        try:
+            chunk = extract_trees(
+                forest, min(STREAM_RENDER_CHUNK, total - start), start, budget)
+        except BudgetExceeded:
+            chunk = []
+        forest.release_trees()
+        trees_time = time.perf_counter()
+        if output != 'images':
+            key, items = 'tree', format_trees(chunk, output)
+            timings['trees'] = timings.get(
+                'trees', 0) + time.perf_counter() - start_time
+        else:
+            rendered = render_stored(tree_sources(chunk))
+            end_time = time.perf_counter()
+            key, items = 'image', images_data(rendered, sentence,
+                                              HEIGHT_REGEX, WIDTH_REGEX, images, trees_url)
+            timings['trees'] = timings.get(
+                'trees', 0) + trees_time - start_time
+            timings['render'] = timings.get(
+                'render', 0) + end_time - trees_time
+            timings['encode'] = timings.get(
+                'encode', 0) + time.perf_counter() - end_time
+            render_took += end_time - start_time
+        for i, item in enumerate(items):
+            event = {
+                'type': 'tree',
+                'index': start + i,
+                key: item,
+            }
+            if parser == 'viterbi':
+                event['probability'] = forest.probability(start + i)
+            yield event
+        sent += len(items)
+        if budget.exceeded is not None:
+            exceeded = budget_exceeded(budget.exceeded, 'trees')
+            break
+
+    record_request(observation(
+        timings, compiled.sizes, forest, parser, exceeded))
+    end = {
+        'type': 'end',
+        'trees': sent,
+        'renderTook': render_took,
+    }
+    if exceeded is not None:
+        end['budgetExceeded'] = exceeded
+    if phases:
+        end['phases'] = timings
+    yield end
+
+
+def parse_sentences(grammar, sentences: list[str], trees: bool, engine: str, max_trees: int, parser: str, budget: Budget = None, output: str = 'images') -> list[tuple]:
+    '''
+    Run CYK for each sentence. Runs on the batch worker processes.
+
+    Returns (is_in, images, took, parse_count, render_took, exceeded,
+    probabilities) tuples, the count and images are only computed when the
+    trees are requested. With the 'json' or 'bracketed' output, images
+    holds the formatted trees, the json ones packed by pack_json. The probabilities of the trees are None but
+    for the 'viterbi' parser.
+    Each sentence gets its own work limits of the budget, exceeded is the
+    'budgetExceeded' object of the sentences it stopped, and is_in is None
+    when it stopped before the verdict.
+    '''
+    parsed = []
+    for sentence in sentences:
+        sentence_budget = budget.for_sentence() if budget is not None else None
+        is_in, images, took, parse_count, render_took, exceeded = None, [], 0, None, 0, None
+        probabilities = None
+        phase = 'chart'
+        try:
+            forest = grammar.parse(sentence, engine, parser, sentence_budget)
+            is_in, took = forest.is_in, forest.took
+            if trees and forest.is_in:
+                phase = 'trees'
+                parse_count = forest.count()
+                if output != 'images':
+                    images = format_forest_trees(
+                        forest, max_trees, output, budget=sentence_budget)
+                else:
+                    images, render_took = render_trees(
+                        forest, max_trees, budget=sentence_budget)
+                if parser == 'viterbi':
+                    probabilities = tree_probabilities(forest, 0, len(images))
+                if sentence_budget is not None and sentence_budget.exceeded is not None:
+                    exceeded = budget_exceeded(sentence_budget.exceeded, phase)
+        except BudgetExceeded as error:
+            exceeded = budget_exceeded(error, phase)
+        if output == 'json':
+            images = pack_json(images)
+        parsed.append((is_in, images, took,
+                      parse_count, render_took, exceeded, probabilities))
+    return parsed
+
+
+def parse_registered(grammar_id: str, *args) -> list[tuple]:
+    '''
+    parse_sentences on a registered grammar. Runs on the batch worker
+    processes, each one maps the grammar file once and keeps it.
+    '''
+    return parse_sentences(REGISTRY.get(grammar_id), *args)
+
+
+def batch_pool() -> ProcessPoolExecutor:
+    '''
+    Get the worker pool of the batch endpoint, created on first use.
+
+    The workers are started with spawn, never forked from the threaded server.
+    '''
+    global BATCH_POOL
+    if BATCH_POOL is None:
+        BATCH_POOL = ProcessPoolExecutor(
+            BATCH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return BATCH_POOL
+
+
+def drop_batch_pool(pool: ProcessPoolExecutor) -> None:
+    '''
+    Shut down a broken batch pool, the next batch starts a new one.
+    '''
+    global BATCH_POOL
+    pool.shutdown(wait=False, cancel_futures=True)
+    if BATCH_POOL is pool:
+        BATCH_POOL = None
+
+
+def wrapper_cyk_batch(lines: list[str], sentences: list[str], HEIGHT_REGEX, WIDTH_REGEX, prefix, initial_symbol, trees=False, engine: str = 'indexed', max_trees: int = DEFAULT_MAX_TREES, parser: str = 'cyk', cnf_mode: str = 'classic', grammar_id: str = None, budget: dict = None, images: str = 'inline', trees_url: str = '/trees/', output: str = 'images') -> dict:
+    '''
+    Wrapper for the CYK algorithm over many sentences of the same grammar.
+
+    The grammar is compiled once. Big batches are split in chunks parsed in
+    parallel on the batch worker pool, the grammar is stored in the registry
+    first so the workers map its file instead of receiving it with each
+    chunk. BrokenProcessPool is raised when a worker dies, and the pool is
+    started again for the next batch. Trees are not drawn unless requested.
+
+    The deadline of the budget is shared by the whole batch, the work limits
+    apply to each sentence. A sentence stopped by the budget has its
+    'budgetExceeded' object, a grammar stopped by it gives no results and
+    the 'budgetExceeded' object of the response.
+
+    With the 'json' or 'bracketed' output the requested trees are returned
+    in 'trees' instead of 'images'.
+    '''
+    check_modes(images, output)
+    start_time = time.perf_counter()
+    budget = request_budget(budget)
+    try:
+        lines, grammar, compiled = request_grammar(
+            lines, initial_symbol, prefix, cnf_mode, grammar_id, budget=budget)
+    except BudgetExceeded as error:
+        BUDGETS_EXCEEDED.inc(limit=error.limit, phase='grammar')
         return {
-            'prefix': grammar.prefix,
-            'initialSymbol': grammar.initial_symbol,
-            'initialGrammar': initial_grammar,
-            'resultantGrammar': resultant_grammar,
-            'images': [],
-            'took': took,
-            'isIn': is_in,
+            'prefix': prefix,
+            'initialSymbol': initial_symbol,
+            'initialGrammar': '\n'.join(lines) if lines is not None else None,
+            'resultantGrammar': None,
+            'results': [],
+            'took': time.perf_counter() - start_time,
+            'budgetExceeded': budget_exceeded(error, 'grammar'),
+        }
+    initial_grammar = '\n'.join(lines)
+
+    if len(sentences) < BATCH_PARALLEL_THRESHOLD:
+        parsed = parse_sentences(
+            grammar, sentences, trees, engine, max_trees, parser, budget, output)
+    else:
+        if grammar_id is None:
+            grammar_id = REGISTRY.add(compiled, lines, cnf_mode).key
+        chunks_count = BATCH_WORKERS * BATCH_CHUNKS_PER_WORKER
+        chunk_size = -(-len(sentences) // chunks_count)
+        chunks = [sentences[i:i+chunk_size]
+                  for i in range(0, len(sentences), chunk_size)]
+        pool = batch_pool()
+        futures = [pool.submit(parse_registered, grammar_id, chunk, trees, engine, max_trees, parser, budget, output)
+                   for chunk in chunks]
+        try:
+            parsed = [result for future in futures for result in future.result()]
+        except BrokenProcessPool:
+            drop_batch_pool(pool)
+            raise
+
+    results = []
+    for sentence, (is_in, rendered, took, parse_count, render_took, exceeded, probabilities) in zip(sentences, parsed):
+        result = {
             'sentence': sentence,
+            'isIn': is_in,
+            'took': took,
         }
+        if trees:
+            result['parseCount'] = parse_count or 0
+            result['renderTook'] = render_took
+            if output == 'json':
+                result['trees'] = unpack_json(rendered) if is_in else []
+            elif output != 'images':
+                result['trees'] = rendered if is_in else []
+            else:
+                result['images'] = images_data(
+                    rendered, sentence, HEIGHT_REGEX, WIDTH_REGEX, images, trees_url) if is_in else []
+            if parser == 'viterbi':
+                result['probabilities'] = probabilities or []
+        if exceeded is not None:
+            result['budgetExceeded'] = exceeded
+            BUDGETS_EXCEEDED.inc(
+                limit=exceeded['limit'], phase=exceeded['phase'])
+        results.append(result)
+
+    return {
+        'prefix': grammar.prefix,
+        'initialSymbol': grammar.initial_symbol,
+        'initialGrammar': initial_grammar,
+        'resultantGrammar': compiled.resultant_grammar,
+        'results': results,
+        'took': time.perf_counter() - start_time,
+    }
+
+
+def wrapper_session_create(lines: list[str], prefix, initial_symbol, cnf_mode: str = 'classic', grammar_id: str = None) -> dict:
+    '''
+    Create an incremental parsing session on the compiled grammar.
+    '''
+    lines, grammar, compiled = request_grammar(
+        lines, initial_symbol, prefix, cnf_mode, grammar_id)
+    session = SESSIONS.create(grammar.cyk_index())
+    return {
+        **session.state(),
+        'prefix': grammar.prefix,
+        'initialSymbol': grammar.initial_symbol,
+        'initialGrammar': '\n'.join(lines),
+        'resultantGrammar': compiled.resultant_grammar,
+    }
+
+
+def wrapper_register(lines: list[str], prefix, initial_symbol, cnf_mode: str = 'classic') -> dict:
+    '''
+    Compile a grammar into the registry, so the next requests only send its id.
+    '''
+    return REGISTRY.register(lines, initial_symbol, prefix, cnf_mode).describe()